@@ -1,3 +1,4 @@
+import atexit
 import logging
 from logging.handlers import SMTPHandler, RotatingFileHandler
 import os
@@ -13,6 +14,12 @@ from elasticsearch import Elasticsearch
 from redis import Redis
 import rq
 from config import Config
+from app.http_client import HTTPClient
+from app.langid import LanguageIdentifier, NgramEngine
+from app.notifications import NotificationHub
+from app.search_backends import ElasticsearchBackend, SQLiteSearchBackend
+from app.token_cache import TokenCache
+from app.translation_cache import TranslationCache
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -36,10 +43,41 @@ def create_app(config_class=Config):
     bootstrap.init_app(app)
     moment.init_app(app)
     babel.init_app(app)
+    app.http = HTTPClient(
+        app.config['HTTP_POOL_MAXSIZE'], app.config['HTTP_CONNECT_TIMEOUT'],
+        app.config['HTTP_READ_TIMEOUT'], app.config['HTTP_RETRIES'])
+    app.langid = LanguageIdentifier(
+        NgramEngine(app.config['LANGID_LANGUAGES'])
+        if app.config['LANGID_LANGUAGES'] else None,
+        app.config['LANGID_CACHE_SIZE'])
     app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
         if app.config['ELASTICSEARCH_URL'] else None
+    if app.elasticsearch:
+        app.search_backend = ElasticsearchBackend(app.elasticsearch)
+    elif app.config['SEARCH_INDEX_PATH']:
+        app.search_backend = SQLiteSearchBackend(
+            app.config['SEARCH_INDEX_PATH'])
+    else:
+        app.search_backend = None
     app.redis = Redis.from_url(app.config['REDIS_URL'])
     app.task_queue = rq.Queue('microblog-tasks', connection=app.redis)
+    app.notification_hub = NotificationHub(app.redis, app.logger)
+    app.token_cache = TokenCache(
+        app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL'],
+        app.redis if app.config['TOKEN_CACHE_REDIS'] else None,
+        app.config['TOKEN_REVOCATION_POLL'])
+    app.translation_cache = TranslationCache(
+        app.config['TRANSLATION_CACHE_SIZE'],
+        app.config['TRANSLATION_CACHE_TTL'],
+        app.config['TRANSLATION_FAILURE_TTL'], app.redis)
+    from app.presence import LastSeenBuffer
+    app.last_seen = LastSeenBuffer(
+        app.config['LAST_SEEN_FLUSH_INTERVAL'],
+        app.config['LAST_SEEN_FLUSH_THRESHOLD'],
+        app.redis if app.config['LAST_SEEN_REDIS'] else None)
+    if not app.testing:
+        # the values still buffered by this worker would be lost otherwise
+        atexit.register(app.last_seen.flush_at_exit, app)
 
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
@@ -5,12 +5,14 @@ from app.api.errors import bad_request, error_response
 from app.models import Post, User, Favorite
 from app.api import bp
 from app.api.auth import token_auth
+from app.timeline import fan_out
 
 
 ACTION_1 = "no user with id %s found"
 ACTION_2 = "you do not have permission to post as user %s. You are logged in as user %s"
 ACTION_3 = "must include id field"
 ACTION_4 = "post with id %s not found (requested from user %d)"
+ACTION_5 = "invalid cursor"
 
 # Get all posts by all users
 @bp.route("/posts", methods=["GET"])
@@ -18,7 +20,16 @@ ACTION_4 = "post with id %s not found (requested from user %d)"
 def get_posts():
     page = request.args.get("page", 1, type=int)
     per_page = min(request.args.get("per_page", 10, type=int), 100)
-    data = Post.to_collection_dict(Post.query, page, per_page, "api.get_posts")
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        try:
+            data = Post.to_cursor_collection_dict(Post.query, cursor, per_page,
+                                                  "api.get_posts")
+        except ValueError:
+            return bad_request(ACTION_5)
+    else:
+        data = Post.to_collection_dict(Post.query, page, per_page,
+                                       "api.get_posts")
     return jsonify(data)
 
 
@@ -33,7 +44,16 @@ def posts(id):
     if request.method == "GET":
         page = request.args.get("page", 1, type=int)
         per_page = min(request.args.get("per_page", 10, type=int), 100)
-        data = Post.to_collection_dict(Post.query, page, per_page, "api.posts", id=id)
+        cursor = request.args.get("cursor")
+        if cursor is not None:
+            try:
+                data = Post.to_cursor_collection_dict(
+                    Post.query, cursor, per_page, "api.posts", id=id)
+            except ValueError:
+                return bad_request(ACTION_5)
+        else:
+            data = Post.to_collection_dict(Post.query, page, per_page,
+                                           "api.posts", id=id)
         return jsonify(data)
 
     # Create a post by a specific user
@@ -49,6 +69,7 @@ def posts(id):
 
         db.session.add(post)
         db.session.commit()
+        fan_out(post)
         response = jsonify(post.to_dict())
         response.status_code = 201
         response.headers['Location'] = url_for('main.index')
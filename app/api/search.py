@@ -0,0 +1,32 @@
+from flask import jsonify, request, url_for
+from app.models import Post
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request
+
+
+@bp.route('/search', methods=['GET'])
+@token_auth.login_required
+def search_posts():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return bad_request('must include q parameter')
+    per_page = min(request.args.get('per_page', 10, type=int), 100)
+    cursor = request.args.get('cursor')
+    try:
+        posts, next_cursor = Post.search_after(q, per_page, cursor)
+    except ValueError:
+        return bad_request('invalid cursor')
+    return jsonify({
+        'items': [post.to_dict() for post in posts],
+        '_meta': {
+            'per_page': per_page,
+            'cursor': cursor
+        },
+        '_links': {
+            'self': url_for('api.search_posts', q=q, cursor=cursor,
+                            per_page=per_page),
+            'next': url_for('api.search_posts', q=q, cursor=next_cursor,
+                            per_page=per_page) if next_cursor else None
+        }
+    })
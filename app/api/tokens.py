@@ -1,4 +1,4 @@
-from flask import jsonify
+from flask import jsonify, current_app
 from app import db
 from app.api import bp
 from app.api.auth import basic_auth, token_auth
@@ -18,3 +18,9 @@ def revoke_token():
     token_auth.current_user().revoke_token()
     db.session.commit()
     return '', 204
+
+
+@bp.route('/tokens/stats', methods=['GET'])
+@token_auth.login_required
+def token_cache_stats():
+    return jsonify(current_app.token_cache.stats())
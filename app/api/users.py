@@ -18,8 +18,17 @@ def get_followers(id):
     user = User.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(user.followers, page, per_page,
-                                   'api.get_followers', id=id)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            data = User.to_cursor_collection_dict(user.followers, cursor,
+                                                  per_page, 'api.get_followers',
+                                                  id=id)
+        except ValueError:
+            return bad_request('invalid cursor')
+    else:
+        data = User.to_collection_dict(user.followers, page, per_page,
+                                       'api.get_followers', id=id)
     return jsonify(data)
 
 
@@ -29,8 +38,17 @@ def get_followed(id):
     user = User.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(user.followed, page, per_page,
-                                   'api.get_followed', id=id)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            data = User.to_cursor_collection_dict(user.followed, cursor,
+                                                  per_page, 'api.get_followed',
+                                                  id=id)
+        except ValueError:
+            return bad_request('invalid cursor')
+    else:
+        data = User.to_collection_dict(user.followed, page, per_page,
+                                       'api.get_followed', id=id)
     return jsonify(data)
 
 
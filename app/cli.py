@@ -1,5 +1,18 @@
+from datetime import datetime
 import os
+from time import monotonic
 import click
+from flask import current_app
+from app import db
+from app.counters import reconcile_unread_counters, repair_post_counters, \
+    repair_user_counters
+from app.indexes import check_indexes
+from app.models import SearchableMixin
+from app.reindex import Checkpoint, bulk_reindex
+from app.retention import prune_exports, prune_notifications
+from app.search import create_index, delete_index, finish_rebuild, \
+    index_lag, invalidate_search_results, queue_index_changes, \
+    start_rebuild, swap_alias, update_index_settings
 
 
 def register(app):
@@ -33,3 +46,214 @@ def register(app):
         """Compile all languages."""
         if os.system('pybabel compile -d app/translations'):
             raise RuntimeError('compile command failed')
+
+    @app.cli.group()
+    def counters():
+        """Denormalized counter maintenance commands."""
+        pass
+
+    @counters.command()
+    @click.option('--batch-size', default=1000, show_default=True,
+                  help='Number of rows checked per transaction.')
+    def repair(batch_size):
+        """Recompute drifted post, follow and like counters."""
+        for name, batches in [('user', repair_user_counters(batch_size)),
+                              ('post', repair_post_counters(batch_size))]:
+            checked = repaired = 0
+            for last_id, batch_checked, batch_repaired in batches:
+                checked += batch_checked
+                repaired += batch_repaired
+                click.echo('{} rows up to id {}: {} checked, {} repaired'.format(
+                    name, last_id, checked, repaired))
+            click.echo('{} counters: {} checked, {} repaired'.format(
+                name, checked, repaired))
+
+    @counters.command()
+    @click.option('--batch-size', default=1000, show_default=True,
+                  help='Number of counters checked per batch.')
+    @click.option('--background', is_flag=True,
+                  help='Run the reconciliation in the task queue.')
+    def unread(batch_size, background):
+        """Reconcile the unread message counters with the database."""
+        if background:
+            job = current_app.task_queue.enqueue(
+                'app.tasks.reconcile_unread_counters', batch_size)
+            click.echo('Reconciliation queued as job {}'.format(
+                job.get_id()))
+            return
+        checked = repaired = 0
+        for batch_checked, batch_repaired in reconcile_unread_counters(
+                batch_size):
+            checked += batch_checked
+            repaired += batch_repaired
+        click.echo('unread counters: {} checked, {} repaired'.format(
+            checked, repaired))
+
+    @app.cli.group()
+    def indexes():
+        """Database index commands."""
+        pass
+
+    @indexes.command()
+    def report():
+        """Check the database indexes against the main access patterns."""
+        missing = 0
+        for query, table, columns, index in check_indexes(db.engine):
+            if index is None:
+                missing += 1
+            click.echo('{:<8} {:<24} {}({}) {}'.format(
+                'ok' if index else 'MISSING', query, table,
+                ', '.join(columns), index or ''))
+        if missing:
+            raise click.ClickException(
+                '{} access patterns have no index'.format(missing))
+
+    @app.cli.group()
+    def presence():
+        """User presence commands."""
+        pass
+
+    @presence.command()
+    @click.option('--background', is_flag=True,
+                  help='Run the flush in the task queue.')
+    def flush(background):
+        """Write the buffered last_seen times to the database."""
+        if background:
+            job = current_app.task_queue.enqueue('app.tasks.flush_last_seen')
+            click.echo('Flush queued as job {}'.format(job.get_id()))
+            return
+        click.echo('Flushed last_seen of {} users'.format(
+            current_app.last_seen.flush()))
+
+    @app.cli.group()
+    def notifications():
+        """Notification storage commands."""
+        pass
+
+    @notifications.command()
+    @click.option('--batch-size', default=1000, show_default=True,
+                  help='Number of rows deleted per transaction.')
+    @click.option('--background', is_flag=True,
+                  help='Run the compaction in the task queue.')
+    def compact(batch_size, background):
+        """Delete notifications older than NOTIFICATIONS_MAX_AGE."""
+        if background:
+            job = current_app.task_queue.enqueue(
+                'app.tasks.compact_notifications', batch_size)
+            click.echo('Compaction queued as job {}'.format(job.get_id()))
+            return
+        deleted = 0
+        for batch_deleted in prune_notifications(
+                current_app.config['NOTIFICATIONS_MAX_AGE'], batch_size):
+            deleted += batch_deleted
+            click.echo('{} notifications deleted'.format(deleted))
+        click.echo('Compaction done, {} notifications deleted'.format(
+            deleted))
+
+    @app.cli.group()
+    def exports():
+        """Post export commands."""
+        pass
+
+    @exports.command()
+    @click.option('--background', is_flag=True,
+                  help='Run the pruning in the task queue.')
+    def prune(background):
+        """Delete exports older than EXPORT_MAX_AGE."""
+        if background:
+            job = current_app.task_queue.enqueue('app.tasks.expire_exports')
+            click.echo('Pruning queued as job {}'.format(job.get_id()))
+            return
+        click.echo('{} expired exports deleted'.format(prune_exports(
+            current_app.config['EXPORT_DIR'],
+            current_app.config['EXPORT_MAX_AGE'])))
+
+    @app.cli.group()
+    def search():
+        """Full-text search index commands."""
+        pass
+
+    @search.command()
+    def status():
+        """Show how many index changes are pending and for how long."""
+        for index in SearchableMixin.searchable_models():
+            pending, lag = index_lag(index)
+            click.echo('{}: {} pending changes, {:.1f}s behind'.format(
+                index, pending, lag))
+
+    @search.command()
+    @click.argument('name', required=False)
+    @click.option('--chunk-size', default=1000, show_default=True,
+                  help='Number of rows sent per bulk request.')
+    @click.option('--workers', default=4, show_default=True,
+                  help='Number of threads sending bulk requests.')
+    @click.option('--new-index', is_flag=True,
+                  help='Build a new index and point the alias at it when '
+                       'done, instead of indexing in place.')
+    @click.option('--resume', is_flag=True,
+                  help='Continue an interrupted run from its checkpoint.')
+    @click.option('--checkpoint-dir', default='.', show_default=True,
+                  type=click.Path(file_okay=False, writable=True),
+                  help='Directory of the checkpoint files.')
+    def reindex(name, chunk_size, workers, new_index, resume, checkpoint_dir):
+        """Rebuild the search index of one or all searchable models."""
+        if not current_app.search_backend:
+            raise click.ClickException('No search backend is configured')
+        if new_index and not current_app.elasticsearch:
+            raise click.ClickException('--new-index requires Elasticsearch')
+        models = SearchableMixin.searchable_models()
+        if name is not None and name not in models:
+            raise click.BadParameter('must be one of: ' + ', '.join(models),
+                                     param_hint='NAME')
+        for name in [name] if name else list(models):
+            checkpoint = Checkpoint(os.path.join(
+                checkpoint_dir, 'reindex-{}.json'.format(name)))
+            state = checkpoint.load() if resume else None
+            if state is not None:
+                click.echo('{}: resuming into {} after id {}'.format(
+                    name, state['index'], state['last_id']))
+            else:
+                state = {'index': name, 'alias': None, 'last_id': 0}
+                if new_index:
+                    state['index'] = '{}-{}'.format(
+                        name, datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+                    state['alias'] = name
+                    # refreshing while bulk loading only slows it down
+                    create_index(state['index'], {'refresh_interval': '-1'})
+                checkpoint.save(state)
+            if state['alias']:
+                start_rebuild(state['alias'])
+
+            started = monotonic()
+
+            def on_chunk(last_id, indexed, failed):
+                state['last_id'] = last_id
+                checkpoint.save(state)
+                click.echo('{}: {} indexed, {} failed, up to id {} '
+                           '({:.0f} docs/s)'.format(
+                               name, indexed, failed, last_id,
+                               indexed / max(monotonic() - started, 1e-6)))
+
+            indexed, failed = bulk_reindex(
+                models[name], state['index'], chunk_size, workers,
+                state['last_id'], on_chunk)
+            if state['alias']:
+                update_index_settings(state['index'],
+                                      {'index': {'refresh_interval': None}})
+                previous = swap_alias(state['alias'], state['index'])
+                click.echo('{}: alias now points at {}'.format(
+                    state['alias'], state['index']))
+                changes = finish_rebuild(state['alias'])
+                if changes:
+                    # applied through the alias, to the new index
+                    queue_index_changes(state['alias'], changes)
+                    models[name].apply_index_changes()
+                    click.echo('{}: {} changes made meanwhile replayed'.format(
+                        name, len(changes)))
+                for old in previous:
+                    delete_index(old)
+                    click.echo('{}: deleted old index {}'.format(name, old))
+            invalidate_search_results(name)
+            checkpoint.clear()
+            click.echo('{}: {} documents indexed, {} failed in {:.1f}s'.format(
+                name, indexed, failed, monotonic() - started))
@@ -0,0 +1,100 @@
+from itertools import islice
+from flask import current_app
+from app import db
+from app.models import User, Post, Conversation, followers, likes, \
+    unread_key, UNREAD_TTL
+
+USER_COUNTERS = {
+    'post_count': (Post.user_id, Post.__table__),
+    'follower_count': (followers.c.followed_id, followers),
+    'followed_count': (followers.c.follower_id, followers),
+}
+POST_COUNTERS = {
+    'like_count': (likes.c.post_id, likes),
+}
+
+
+def _actual_counts(key, table, ids):
+    rows = db.session.query(key, db.func.count()).select_from(table).filter(
+        key.in_(ids)).group_by(key)
+    return dict(rows)
+
+
+def _repair(model, counters, batch_size):
+    last_id = 0
+    while True:
+        rows = db.session.query(model.id, *[getattr(model, name)
+                                            for name in counters]).filter(
+            model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+        actual = {name: _actual_counts(key, table, ids)
+                  for name, (key, table) in counters.items()}
+        updates = []
+        for row in rows:
+            values = {name: actual[name].get(row.id, 0) for name in counters}
+            if any(getattr(row, name) != value
+                   for name, value in values.items()):
+                updates.append(dict(values, id=row.id))
+        if updates:
+            db.session.bulk_update_mappings(model, updates)
+        db.session.commit()
+        last_id = ids[-1]
+        yield last_id, len(rows), len(updates)
+
+
+def repair_user_counters(batch_size=1000):
+    """Recompute the post and follow counters of all users in batches.
+
+    Yields ``(last_id, checked, repaired)`` after each committed batch.
+    """
+    return _repair(User, USER_COUNTERS, batch_size)
+
+
+def repair_post_counters(batch_size=1000):
+    """Recompute the like counters of all posts in batches.
+
+    Yields ``(last_id, checked, repaired)`` after each committed batch.
+    """
+    return _repair(Post, POST_COUNTERS, batch_size)
+
+
+def _unread_counts(user_ids):
+    rows = db.session.query(
+        Conversation.user_id, db.func.sum(Conversation.unread_count)).filter(
+            Conversation.user_id.in_(user_ids)).group_by(Conversation.user_id)
+    return {user_id: int(count) for user_id, count in rows}
+
+
+def reconcile_unread_counters(batch_size=1000):
+    """Correct the unread message counters kept in Redis against SQL.
+
+    The counters are checked ``batch_size`` at a time. A batch whose
+    counters change while it is checked is checked again, so that no
+    concurrent increment is overwritten. Yields ``(checked, repaired)``
+    after each batch.
+    """
+    keys = current_app.redis.scan_iter(match=unread_key('*'),
+                                       count=batch_size)
+    while True:
+        batch = list(islice(keys, batch_size))
+        if not batch:
+            break
+        user_ids = [int(key.split(b':')[1]) for key in batch]
+        repaired = []
+
+        def check(pipe):
+            del repaired[:]
+            cached = pipe.mget(batch)
+            actual = _unread_counts(user_ids)
+            pipe.multi()
+            for key, user_id, count in zip(batch, user_ids, cached):
+                if count is not None and \
+                        int(count) != actual.get(user_id, 0):
+                    pipe.set(key, actual.get(user_id, 0), ex=UNREAD_TTL)
+                    repaired.append(user_id)
+
+        current_app.redis.transaction(check, *batch)
+        db.session.commit()
+        yield len(batch), len(repaired)
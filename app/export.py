@@ -0,0 +1,125 @@
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+from tempfile import SpooledTemporaryFile
+from time import monotonic, time
+from app.models import Post
+
+FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+CHUNK_SIZE = 64 * 1024
+
+
+class Throttle(object):
+    """Call ``callback(done)`` at most every ``rows`` rows or ``seconds``."""
+
+    def __init__(self, callback, rows=1000, seconds=2.0):
+        self.callback = callback
+        self.rows = rows
+        self.seconds = seconds
+        self._last_rows = 0
+        self._last_time = monotonic()
+
+    def __call__(self, done):
+        if done - self._last_rows >= self.rows or \
+                monotonic() - self._last_time >= self.seconds:
+            self._last_rows = done
+            self._last_time = monotonic()
+            self.callback(done)
+
+
+def write_posts(rows, f, fmt='json', progress=None):
+    """Write ``(body, timestamp)`` rows to the text file ``f``.
+
+    ``json`` writes the same ``{"posts": [...]}`` document as before, one
+    post per line, and ``ndjson`` writes one post object per line. Rows are
+    written as they are read, so memory use does not depend on their number.
+    Returns the number of rows written.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('unknown export format: ' + fmt)
+    count = 0
+    if fmt == 'json':
+        f.write('{"posts": [')
+    for body, timestamp in rows:
+        if fmt == 'json':
+            f.write(',\n' if count else '\n')
+        f.write(json.dumps({'body': body,
+                            'timestamp': timestamp.isoformat() + 'Z'}))
+        if fmt == 'ndjson':
+            f.write('\n')
+        count += 1
+        if progress is not None:
+            progress(count)
+    if fmt == 'json':
+        f.write('\n]}\n')
+    return count
+
+
+def export_user_posts(user, fmt='json', compress=False, progress=None,
+                      batch_size=1000, spool_size=1024 * 1024):
+    """Export the posts of ``user`` into a spooled temporary file.
+
+    Rows are streamed from the database with ``yield_per``, and the file
+    stays in memory only up to ``spool_size`` bytes. Returns the file,
+    rewound, along with its name and content type.
+    """
+    rows = Post.query.with_entities(Post.body, Post.timestamp).filter(
+        Post.user_id == user.id).order_by(
+            Post.timestamp.asc(), Post.id.asc()).yield_per(batch_size)
+    spool = SpooledTemporaryFile(max_size=spool_size, mode='w+b')
+    raw = gzip.GzipFile(fileobj=spool, mode='wb') if compress else spool
+    f = io.TextIOWrapper(raw, encoding='utf-8')
+    write_posts(rows, f, fmt, progress)
+    f.flush()
+    # detached rather than closed, which would close the spool as well
+    f.detach()
+    if compress:
+        raw.close()
+    spool.seek(0)
+    filename = 'posts.' + fmt + ('.gz' if compress else '')
+    content_type = 'application/gzip' if compress else FORMATS[fmt]
+    return spool, filename, content_type
+
+
+def _user_dir(directory, user_id):
+    return os.path.join(directory, str(user_id))
+
+
+def store_export(export, directory, user_id, token, filename):
+    """Copy an export into the user's download directory, in chunks.
+
+    The file is named after the random ``token`` that the download link
+    carries, followed by ``filename``.
+    """
+    user_dir = _user_dir(directory, user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    path = os.path.join(user_dir, '{}-{}'.format(token, filename))
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(export, f, CHUNK_SIZE)
+    return path
+
+
+def find_export(directory, user_id, token, max_age):
+    """Return the path and file name of the user's export with ``token``,
+    or ``None`` if there is none written in the last ``max_age`` seconds."""
+    if not re.fullmatch(r'[0-9a-f]{32}', token):
+        return None
+    user_dir = _user_dir(directory, user_id)
+    try:
+        names = os.listdir(user_dir)
+    except FileNotFoundError:
+        return None
+    for name in names:
+        if name.startswith(token + '-'):
+            path = os.path.join(user_dir, name)
+            try:
+                # expired links stop working even before the file is pruned
+                if os.path.getmtime(path) < time() - max_age:
+                    return None
+            except FileNotFoundError:
+                return None
+            return path, name[len(token) + 1:]
+    return None
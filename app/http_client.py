@@ -0,0 +1,77 @@
+import threading
+from time import monotonic
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HTTPClient(object):
+    """Pooled session for the application's outbound HTTP calls.
+
+    Connections are kept alive and reused, at most ``pool_maxsize`` per host;
+    a request that finds the pool exhausted opens a connection of its own,
+    which is closed afterwards, rather than wait for a free one without a
+    time limit. Every request has a connect and a read timeout unless the
+    caller passes its own. Failed connections are retried a bounded number
+    of times with exponential backoff, and so are the retryable responses
+    of idempotent requests. Latency is recorded per host.
+    """
+
+    def __init__(self, pool_maxsize=10, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff_factor=0.3):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      status=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES,
+                      # POST requests are only retried when they could not
+                      # connect, and so were never sent
+                      allowed_methods=frozenset(['GET', 'HEAD']),
+                      # a Retry-After of minutes would hold the request
+                      # far past its timeouts
+                      respect_retry_after_header=False,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).netloc
+        started = monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(host, monotonic() - started, error=True)
+            raise
+        self._record(host, monotonic() - started,
+                     error=response.status_code >= 500)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _record(self, host, elapsed, error):
+        with self._lock:
+            stats = self._stats.setdefault(
+                host, {'requests': 0, 'errors': 0, 'total_time': 0.0,
+                       'max_time': 0.0})
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def stats(self):
+        """Return request counts and latencies in seconds, per host."""
+        with self._lock:
+            return {host: dict(stats, mean_time=stats['total_time'] /
+                               stats['requests'])
+                    for host, stats in self._stats.items()}
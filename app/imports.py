@@ -0,0 +1,112 @@
+import csv
+from datetime import datetime, timezone
+from itertools import islice
+import json
+from flask import current_app
+from app import db
+from app.models import User, Post
+from app.search import bulk_index, invalidate_search_results
+from app.timeline import invalidate_follower_timelines
+
+FORMATS = ('ndjson', 'csv')
+MAX_BODY_LENGTH = 140
+
+
+def _parse_timestamp(value):
+    if not value:
+        return datetime.utcnow()
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1]
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        # stored as naive UTC, like the timestamps the application writes
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _post(item):
+    if not isinstance(item, dict) or not isinstance(item.get('body'), str):
+        return None
+    body = item['body'].strip()
+    if not body or len(body) > MAX_BODY_LENGTH:
+        return None
+    try:
+        return body, _parse_timestamp(item.get('timestamp'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _ndjson_items(f):
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def parse_posts(f, fmt='ndjson'):
+    """Yield ``(body, timestamp)`` for each post of the text file ``f``.
+
+    NDJSON files have one ``{"body": ..., "timestamp": ...}`` object per
+    line, as written by the NDJSON export, and CSV files a header row with
+    ``body`` and an optional ``timestamp`` column. The file is read one line
+    at a time. Invalid entries, including bodies longer than the 140
+    characters of a post, yield ``None``.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('unknown import format: ' + fmt)
+    items = _ndjson_items(f) if fmt == 'ndjson' else csv.DictReader(f)
+    for item in items:
+        yield _post(item)
+
+
+def _insert(user_id, posts):
+    languages = current_app.langid.detect_many([body for body, _ in posts])
+    last_id = db.session.query(db.func.max(Post.id)).filter(
+        Post.user_id == user_id).scalar() or 0
+    # bulk inserts skip the mapper events, the post count included
+    db.session.bulk_insert_mappings(Post, [
+        {'body': body, 'timestamp': timestamp, 'user_id': user_id,
+         'language': language}
+        for (body, timestamp), language in zip(posts, languages)])
+    User.query.filter_by(id=user_id).update(
+        {User.post_count: User.post_count + len(posts)},
+        synchronize_session=False)
+    db.session.commit()
+    inserted = Post.query.filter(Post.user_id == user_id,
+                                 Post.id > last_id).all()
+    failed = bulk_index(Post.__tablename__, inserted)
+    if failed:
+        current_app.logger.error('%d imported posts could not be indexed',
+                                 len(failed))
+    return len(inserted)
+
+
+def import_user_posts(user, posts, batch_size=1000, progress=None):
+    """Insert the ``(body, timestamp)`` posts of ``user`` in batches.
+
+    Each batch has its languages identified together, is inserted with a
+    single bulk insert and committed, and is indexed with one bulk request.
+    ``None`` entries are skipped. ``progress(done)`` is called after each
+    batch with the number of entries processed. Returns the number of posts
+    imported and of entries skipped.
+    """
+    posts = iter(posts)
+    imported = skipped = 0
+    while True:
+        batch = list(islice(posts, batch_size))
+        if not batch:
+            break
+        valid = [post for post in batch if post is not None]
+        skipped += len(batch) - len(valid)
+        if valid:
+            imported += _insert(user.id, valid)
+        if progress is not None:
+            progress(imported + skipped)
+    if imported:
+        invalidate_search_results(Post.__tablename__)
+        invalidate_follower_timelines(user)
+    return imported, skipped
@@ -0,0 +1,45 @@
+from sqlalchemy import inspect
+
+# (query, table, columns) for the lookups the application runs most often;
+# each one needs an index whose leading columns match the listed columns
+ACCESS_PATTERNS = [
+    ('User.is_following', 'followers', ['follower_id', 'followed_id']),
+    ('User.followers', 'followers', ['followed_id', 'follower_id']),
+    ('User.is_liking', 'likes', ['user_id', 'post_id']),
+    ('User.has_favorited', 'favorite', ['user_id', 'post_id']),
+    ('User.posts by timestamp', 'post', ['user_id', 'timestamp']),
+    ('User.new_messages', 'message', ['recipient_id', 'timestamp']),
+    ('main.conversation', 'message', ['conversation_key', 'timestamp']),
+    ('main.messages', 'conversation', ['user_id', 'last_activity']),
+    ('User.add_notification', 'notification', ['user_id', 'name']),
+    ('main.notifications', 'notification', ['user_id', 'timestamp']),
+]
+
+
+def _covering_index(indexes, columns):
+    for index in indexes:
+        if index['column_names'][:len(columns)] == columns:
+            return index['name']
+
+
+def check_indexes(engine):
+    """Match :data:`ACCESS_PATTERNS` against the indexes in the database.
+
+    Returns ``(query, table, columns, index_name)`` tuples, where the index
+    name is ``None`` for patterns that have no usable index.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    report = []
+    for query, table, columns in ACCESS_PATTERNS:
+        indexes = []
+        if table in tables:
+            indexes = inspector.get_indexes(table) + \
+                inspector.get_unique_constraints(table)
+            pk = inspector.get_pk_constraint(table)
+            if pk['constrained_columns']:
+                indexes.append({'name': pk['name'] or 'PRIMARY KEY',
+                                'column_names': pk['constrained_columns']})
+        report.append((query, table, columns,
+                       _covering_index(indexes, columns)))
+    return report
@@ -1,5 +1,6 @@
 from flask import request
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from wtforms import StringField, SubmitField, TextAreaField
 from wtforms.validators import ValidationError, DataRequired, Length
 from flask_babel import _, lazy_gettext as _l
@@ -47,3 +48,9 @@ class MessageForm(FlaskForm):
     message = TextAreaField(_l('Message'), validators=[
         DataRequired(), Length(min=1, max=140)])
     submit = SubmitField(_l('Submit'))
+
+
+class ImportPostsForm(FlaskForm):
+    file = FileField(_l('NDJSON or CSV file'), validators=[
+        FileRequired(), FileAllowed(['ndjson', 'jsonl', 'csv'])])
+    submit = SubmitField(_l('Import'))
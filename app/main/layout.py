@@ -0,0 +1,69 @@
+from flask import g, has_app_context, before_render_template, \
+    template_rendered
+from flask_login import current_user
+from sqlalchemy.engine import Engine
+from werkzeug.utils import cached_property
+from app import db
+
+
+class Layout(object):
+    """Viewer data of the page layout, computed at most once per request.
+
+    ``base.html`` and the pages extending it read the unread message count,
+    the tasks in progress and follow states from here instead of querying
+    them from ``current_user`` each time they are needed.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._following = {}
+
+    @cached_property
+    def new_messages(self):
+        return self.user.new_messages() if self.user.is_authenticated else 0
+
+    @cached_property
+    def tasks_in_progress(self):
+        if not self.user.is_authenticated:
+            return []
+        return self.user.get_tasks_in_progress()
+
+    def task_in_progress(self, name):
+        for task in self.tasks_in_progress:
+            if task.name == name:
+                return task
+
+    def is_following(self, user):
+        if user.id not in self._following:
+            self._following[user.id] = self.user.is_following(user)
+        return self._following[user.id]
+
+
+def start_request():
+    """Reset the request-scoped layout and query counts on ``g``."""
+    g.layout = Layout(current_user)
+    g.query_count = 0
+    g.template_queries = {}
+    g.template_query_starts = []
+
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    # only requests count their queries; workers and CLI commands do not
+    if has_app_context() and 'query_count' in g:
+        g.query_count += 1
+
+
+def _template_started(sender, template, context, **extra):
+    if 'query_count' in g:
+        g.template_query_starts.append(g.query_count)
+
+
+def _template_rendered(sender, template, context, **extra):
+    if 'query_count' in g and g.template_query_starts:
+        g.template_queries[template.name] = \
+            g.query_count - g.template_query_starts.pop()
+
+
+before_render_template.connect(_template_started)
+template_rendered.connect(_template_rendered)
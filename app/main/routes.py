@@ -1,91 +1,169 @@
-from datetime import datetime
+import os
+from uuid import uuid4
 from flask import render_template, flash, redirect, url_for, request, g, \
-    jsonify, current_app
+    jsonify, current_app, Response, session, abort, send_file
 from flask_login import current_user, login_required
 from flask_babel import _, get_locale
-from langdetect import detect, LangDetectException
 from app import db
 from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm, \
-    MessageForm
-from app.models import User, Post, Message, Notification, Favorite
-from app.translate import translate
+    MessageForm, ImportPostsForm
+from app.models import User, Post, Message, Notification, Favorite, \
+    Conversation, conversation_key
+from app.pagination import paginate_cursor
+from app.notifications import event_stream, notifications_unchanged, \
+    remember_no_notifications, wait_for_notification
+from app.progress import get_live_notifications
+from app.export import FORMATS as EXPORT_FORMATS, find_export
+from app.translate import translate, translate_batch
+from app.timeline import fan_out, followed_posts_cursor, followed_posts_page, \
+    invalidate_timeline, update_celebrity
 from app.main import bp
+from app.main.layout import start_request
+from app.main.viewer import load_viewer_context
 
 redirect_main_index = "main.index"
 main_explore = "main.explore"
 main_user = "main.user"
 
 
+def cursor_urls(endpoint, pagination, **kwargs):
+    next_url = url_for(endpoint, cursor=pagination.next_cursor, **kwargs) \
+        if pagination.has_next else None
+    prev_url = url_for(endpoint, cursor=pagination.prev_cursor, **kwargs) \
+        if pagination.has_prev else None
+    return next_url, prev_url
+
 
 @bp.before_app_request
 def before_request():
+    if request.endpoint == 'main.notifications' and \
+            not request.args.get('wait') and '_user_id' in session:
+        # polls with nothing new are answered before the user is loaded
+        user_id = int(session['_user_id'])
+        if notifications_unchanged(
+                user_id, request.args.get('since', 0.0, type=float)):
+            current_app.last_seen.record(user_id)
+            return '', 304
+    start_request()
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        current_app.last_seen.record(current_user.id)
         g.search_form = SearchForm()
     g.locale = str(get_locale())
 
 
+@bp.app_context_processor
+def inject_api_token():
+    def api_token():
+        # resolved at most once per request; a newly minted token is
+        # committed after the response is rendered, not in the middle of it
+        if 'api_token' not in g:
+            old_token = current_user.token
+            g.api_token = current_user.ensure_token()
+            g.api_token_minted = g.api_token != old_token
+        return g.api_token
+    return {'api_token': api_token}
+
+
+@bp.after_app_request
+def commit_api_token(response):
+    if g.get('api_token_minted'):
+        db.session.commit()
+    return response
+
+
 @bp.route('/', methods=['GET', 'POST'])
 @bp.route('/index', methods=['GET', 'POST'])
 @login_required
 def index():
     form = PostForm()
     if form.validate_on_submit():
-        try:
-            language = detect(form.post.data)
-        except LangDetectException:
-            language = ''
+        language = current_app.langid.detect(form.post.data)
         post = Post(body=form.post.data, author=current_user,
                     language=language)
         db.session.add(post)
         db.session.commit()
+        fan_out(post)
         flash(_('Your post is now live!'))
         return redirect(url_for(redirect_main_index))
-    page = request.args.get('page', 1, type=int)
-    posts = current_user.followed_posts().paginate(
-        page=page, per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False)
-    next_url = url_for(redirect_main_index, page=posts.next_num) \
-        if posts.has_next else None
-    prev_url = url_for(redirect_main_index, page=posts.prev_num) \
-        if posts.has_prev else None
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        posts, has_next = followed_posts_page(
+            current_user, page, current_app.config['POSTS_PER_PAGE'])
+        next_url = url_for(redirect_main_index, page=page + 1) \
+            if has_next else None
+        prev_url = url_for(redirect_main_index, page=page - 1) \
+            if page > 1 else None
+    else:
+        try:
+            pagination = followed_posts_cursor(
+                current_user, current_app.config['POSTS_PER_PAGE'],
+                request.args.get('cursor'))
+        except ValueError:
+            return redirect(url_for(redirect_main_index))
+        posts = pagination.items
+        next_url, prev_url = cursor_urls(redirect_main_index, pagination)
     return render_template('index.html', title=_('Home'), form=form,
-                           posts=posts.items, next_url=next_url,
-                           prev_url=prev_url)
+                           posts=posts, next_url=next_url,
+                           prev_url=prev_url,
+                           viewer=load_viewer_context(current_user, posts))
 
 
 @bp.route('/explore')
 @login_required
 def explore():
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False)
-    next_url = url_for(main_explore, page=posts.next_num) \
-        if posts.has_next else None
-    prev_url = url_for(main_explore, page=posts.prev_num) \
-        if posts.has_prev else None
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        posts = Post.query.order_by(Post.timestamp.desc()).paginate(
+            page=page, per_page=current_app.config['POSTS_PER_PAGE'],
+            error_out=False)
+        next_url = url_for(main_explore, page=posts.next_num) \
+            if posts.has_next else None
+        prev_url = url_for(main_explore, page=posts.prev_num) \
+            if posts.has_prev else None
+    else:
+        try:
+            posts = paginate_cursor(
+                Post.query, [Post.timestamp, Post.id],
+                current_app.config['POSTS_PER_PAGE'],
+                request.args.get('cursor'))
+        except ValueError:
+            return redirect(url_for(main_explore))
+        next_url, prev_url = cursor_urls(main_explore, posts)
     return render_template('index.html', title=_('Explore'),
                            posts=posts.items, next_url=next_url,
-                           prev_url=prev_url)
+                           prev_url=prev_url,
+                           viewer=load_viewer_context(current_user,
+                                                      posts.items))
 
 
 @bp.route('/user/<username>')
 @login_required
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    posts = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False)
-    next_url = url_for(main_user, username=user.username,
-                       page=posts.next_num) if posts.has_next else None
-    prev_url = url_for(main_user, username=user.username,
-                       page=posts.prev_num) if posts.has_prev else None
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        posts = user.posts.order_by(Post.timestamp.desc()).paginate(
+            page=page, per_page=current_app.config['POSTS_PER_PAGE'],
+            error_out=False)
+        next_url = url_for(main_user, username=user.username,
+                           page=posts.next_num) if posts.has_next else None
+        prev_url = url_for(main_user, username=user.username,
+                           page=posts.prev_num) if posts.has_prev else None
+    else:
+        try:
+            posts = paginate_cursor(
+                user.posts, [Post.timestamp, Post.id],
+                current_app.config['POSTS_PER_PAGE'],
+                request.args.get('cursor'))
+        except ValueError:
+            return redirect(url_for(main_user, username=user.username))
+        next_url, prev_url = cursor_urls(main_user, posts,
+                                         username=user.username)
     form = EmptyForm()
     return render_template('user.html', user=user, posts=posts.items,
-                           next_url=next_url, prev_url=prev_url, form=form)
+                           next_url=next_url, prev_url=prev_url, form=form,
+                           viewer=load_viewer_context(current_user,
+                                                      posts.items))
 
 
 @bp.route('/user/<username>/popup')
@@ -127,6 +205,7 @@ def follow(username):
             return redirect(url_for(main_user, username=username))
         current_user.follow(user)
         db.session.commit()
+        invalidate_timeline(current_user)
         flash(_('You are following %(username)s!', username=username))
         return redirect(url_for(main_user, username=username))
     else:
@@ -147,6 +226,8 @@ def unfollow(username):
             return redirect(url_for(main_user, username=username))
         current_user.unfollow(user)
         db.session.commit()
+        invalidate_timeline(current_user)
+        update_celebrity(user)
         flash(_('You are not following %(username)s.', username=username))
         return redirect(url_for(main_user, username=username))
     else:
@@ -161,20 +242,75 @@ def translate_text():
                                       request.form['dest_language'])})
 
 
+def _invalid_request(message):
+    return jsonify({'error': message}), 400
+
+
+@bp.route('/translate/batch', methods=['POST'])
+@login_required
+def translate_batch_text():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return _invalid_request('request must be a JSON object')
+    dest_language = data.get('dest_language')
+    post_ids = data.get('posts') or []
+    texts = data.get('texts') or []
+    if not dest_language or not isinstance(dest_language, str):
+        return _invalid_request('must include dest_language')
+    if not isinstance(post_ids, list) or not isinstance(texts, list):
+        return _invalid_request('posts and texts must be lists')
+    if len(post_ids) + len(texts) > \
+            current_app.config['TRANSLATE_BATCH_LIMIT']:
+        return _invalid_request('too many texts')
+    if not all(isinstance(text, dict) and isinstance(text.get('text'), str)
+               and isinstance(text.get('source_language') or '', str)
+               for text in texts):
+        return _invalid_request('invalid texts')
+    try:
+        post_ids = [int(id) for id in post_ids]
+    except (TypeError, ValueError):
+        return _invalid_request('invalid posts')
+    pairs = [(text['text'], text.get('source_language')) for text in texts]
+    posts = Post.query.filter(Post.id.in_(post_ids)).all() \
+        if post_ids else []
+    translations = translate_batch(
+        pairs + [(post.body, post.language or None) for post in posts],
+        dest_language)
+    return jsonify({
+        'texts': translations[:len(pairs)],
+        'posts': {post.id: translation for post, translation
+                  in zip(posts, translations[len(pairs):])}})
+
+
 @bp.route('/search')
 @login_required
 def search():
     if not g.search_form.validate():
         return redirect(url_for(main_explore))
-    page = request.args.get('page', 1, type=int)
-    posts, total = Post.search(g.search_form.q.data, page,
-                               current_app.config['POSTS_PER_PAGE'])
-    next_url = url_for('main.search', q=g.search_form.q.data, page=page + 1) \
-        if total > page * current_app.config['POSTS_PER_PAGE'] else None
-    prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) \
-        if page > 1 else None
+    q = g.search_form.q.data
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        posts, total = Post.search(q, page,
+                                   current_app.config['POSTS_PER_PAGE'])
+        posts = posts.all()
+        next_url = url_for('main.search', q=q, page=page + 1) \
+            if total > page * current_app.config['POSTS_PER_PAGE'] else None
+        prev_url = url_for('main.search', q=q, page=page - 1) \
+            if page > 1 else None
+    else:
+        cursor = request.args.get('cursor')
+        try:
+            posts, next_cursor = Post.search_after(
+                q, current_app.config['POSTS_PER_PAGE'], cursor)
+        except ValueError:
+            return redirect(url_for('main.search', q=q))
+        # search_after only moves forward, so "previous" restarts the search
+        next_url = url_for('main.search', q=q, cursor=next_cursor) \
+            if next_cursor else None
+        prev_url = url_for('main.search', q=q) if cursor else None
     return render_template('search.html', title=_('Search'), posts=posts,
-                           next_url=next_url, prev_url=prev_url)
+                           next_url=next_url, prev_url=prev_url,
+                           viewer=load_viewer_context(current_user, posts))
 
 
 @bp.route('/send_message/<recipient>', methods=['GET', 'POST'])
@@ -186,10 +322,12 @@ def send_message(recipient):
         msg = Message(author=current_user, recipient=user,
                       body=form.message.data)
         db.session.add(msg)
-        user.add_notification('unread_message_count', user.new_messages())
+        Conversation.add_message(msg)
+        user.add_notification('unread_message_count',
+                              user.add_unread_message())
         db.session.commit()
         flash(_('Your message has been sent.'))
-        return redirect(url_for(main_user, username=recipient))
+        return redirect(url_for('main.conversation', username=recipient))
     return render_template('send_message.html', title=_('Send Message'),
                            form=form, recipient=recipient)
 
@@ -197,55 +335,194 @@ def send_message(recipient):
 @bp.route('/messages')
 @login_required
 def messages():
-    current_user.last_message_read_time = datetime.utcnow()
-    current_user.add_notification('unread_message_count', 0)
+    # conversations are marked read one at a time, when they are opened
+    query = Conversation.query.filter_by(user_id=current_user.id).options(
+        db.contains_eager(Conversation.peer)).join(Conversation.peer)
+    if 'page' in request.args:
+        # links from before the cursor pagination
+        page = request.args.get('page', 1, type=int)
+        conversations = query.order_by(
+            Conversation.last_activity.desc(), Conversation.id.desc()).paginate(
+                page=page, per_page=current_app.config['POSTS_PER_PAGE'],
+                error_out=False)
+        next_url = url_for('main.messages', page=conversations.next_num) \
+            if conversations.has_next else None
+        prev_url = url_for('main.messages', page=conversations.prev_num) \
+            if conversations.has_prev else None
+    else:
+        # one range scan of the user's conversations, peers joined in
+        try:
+            conversations = paginate_cursor(
+                query, [Conversation.last_activity, Conversation.id],
+                current_app.config['POSTS_PER_PAGE'],
+                request.args.get('cursor'))
+        except ValueError:
+            return redirect(url_for('main.messages'))
+        next_url, prev_url = cursor_urls('main.messages', conversations)
+    return render_template('messages.html',
+                           conversations=conversations.items,
+                           next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/messages/<username>')
+@login_required
+def conversation(username):
+    peer = User.query.filter_by(username=username).first_or_404()
+    unread = Conversation.mark_read(current_user, peer)
+    if unread is not None:
+        current_user.add_notification('unread_message_count', unread)
     db.session.commit()
-    page = request.args.get('page', 1, type=int)
-    messages = current_user.messages_received.order_by(
-        Message.timestamp.desc()).paginate(
-            page=page, per_page=current_app.config['POSTS_PER_PAGE'],
-            error_out=False)
-    next_url = url_for('main.messages', page=messages.next_num) \
-        if messages.has_next else None
-    prev_url = url_for('main.messages', page=messages.prev_num) \
-        if messages.has_prev else None
-    return render_template('messages.html', messages=messages.items,
+    try:
+        messages = paginate_cursor(
+            Message.query.filter_by(conversation_key=conversation_key(
+                current_user.id, peer.id)),
+            [Message.timestamp, Message.id],
+            current_app.config['POSTS_PER_PAGE'], request.args.get('cursor'))
+    except ValueError:
+        return redirect(url_for('main.conversation', username=username))
+    next_url, prev_url = cursor_urls('main.conversation', messages,
+                                     username=username)
+    return render_template('conversation.html', title=peer.username,
+                           peer=peer, messages=messages.items,
                            next_url=next_url, prev_url=prev_url)
 
+
 @bp.route('/favorites')
 @login_required
 def favorites():
     favorites_list = Favorite.query.filter_by(user_id=current_user.id).all() # list of all favorites
+    # load all favorited posts with a single query
+    post_ids = [item.post_id for item in favorites_list]
+    found = {post.id: post for post in Post.query.filter(
+        Post.id.in_(post_ids))} if post_ids else {}
     send_list = [] # this list contains non-deleted posts
     deleted = [] # this list contains deleted posts
     for item in favorites_list: # iterate through all favorites
-        # should have used .first() but while this was written I forgot it existed
-        post_object = Post.query.filter_by(id=item.post_id).all()
-        if len(post_object) >= 1: # if favorite is found
-            send_list.append(post_object[0]) 
+        if item.post_id in found: # if favorite is found
+            send_list.append(found[item.post_id])
         else: # if not found
             deleted.append(item)
-    return render_template('favorites.html', posts=send_list, deleted_posts=deleted)
+    return render_template('favorites.html', posts=send_list, deleted_posts=deleted,
+                           viewer=load_viewer_context(current_user, send_list))
 
 @bp.route('/export_posts')
 @login_required
 def export_posts():
-    if current_user.get_task_in_progress('export_posts'):
+    if g.layout.task_in_progress('export_posts'):
         flash(_('An export task is currently in progress'))
     else:
-        current_user.launch_task('export_posts', _('Exporting posts...'))
+        fmt = request.args.get('format', 'json')
+        if fmt not in EXPORT_FORMATS:
+            fmt = 'json'
+        token = uuid4().hex
+        current_user.launch_task(
+            'export_posts', _('Exporting posts...'), token,
+            url_for('main.download_export', token=token, _external=True),
+            fmt, request.args.get('gzip') is not None)
         db.session.commit()
     return redirect(url_for(main_user, username=current_user.username))
 
 
-@bp.route('/notifications')
+@bp.route('/exports/<token>')
 @login_required
-def notifications():
-    since = request.args.get('since', 0.0, type=float)
-    notifications = current_user.notifications.filter(
+def download_export(token):
+    export = find_export(current_app.config['EXPORT_DIR'], current_user.id,
+                         token, current_app.config['EXPORT_MAX_AGE'])
+    if export is None:
+        abort(404)
+    path, filename = export
+    return send_file(path, as_attachment=True, download_name=filename)
+
+
+@bp.route('/import_posts', methods=['GET', 'POST'])
+@login_required
+def import_posts():
+    if g.layout.task_in_progress('import_posts'):
+        flash(_('An import task is currently in progress'))
+        return redirect(url_for(main_user, username=current_user.username))
+    form = ImportPostsForm()
+    if form.validate_on_submit():
+        fmt = 'csv' if form.file.data.filename.lower().endswith('.csv') \
+            else 'ndjson'
+        # the worker reads the file from the same disk and removes it
+        upload_dir = current_app.config['IMPORT_UPLOAD_DIR']
+        os.makedirs(upload_dir, exist_ok=True)
+        path = os.path.join(upload_dir, uuid4().hex + '.' + fmt)
+        form.file.data.save(path)
+        current_user.launch_task('import_posts', _('Importing posts...'),
+                                 path, fmt)
+        db.session.commit()
+        flash(_('Your posts are being imported'))
+        return redirect(url_for(main_user, username=current_user.username))
+    return render_template('import_posts.html', title=_('Import Posts'),
+                           form=form)
+
+
+def _notification_feed(user, since):
+    notifications = user.notifications.filter(
         Notification.timestamp > since).order_by(Notification.timestamp.asc())
-    return jsonify([{
+    feed = [{
         'name': n.name,
         'data': n.get_data(),
         'timestamp': n.timestamp
-    } for n in notifications])
+    } for n in notifications]
+    # progress of running tasks is only kept in Redis until they complete
+    feed.extend(get_live_notifications(user.id, since))
+    feed.sort(key=lambda n: n['timestamp'])
+    return feed
+
+
+@bp.route('/notifications')
+@login_required
+def notifications():
+    since = request.args.get('since', 0.0, type=float)
+    wait = min(request.args.get('wait', 0.0, type=float),
+               current_app.config['NOTIFICATIONS_LONG_POLL_TIMEOUT'])
+    user_id = current_user.id
+    # subscribed before reading the feed so nothing falls in between
+    listener = current_app.notification_hub.subscribe(user_id) \
+        if wait > 0 else None
+    try:
+        feed = [] if notifications_unchanged(user_id, since) else \
+            _notification_feed(current_user, since)
+        if not feed:
+            remember_no_notifications(user_id, since)
+        if not feed and listener is not None:
+            # no database connection is held while waiting
+            db.session.remove()
+            notification = wait_for_notification(listener, since, wait)
+            if notification is not None:
+                feed = [notification]
+    finally:
+        if listener is not None:
+            current_app.notification_hub.unsubscribe(user_id, listener)
+    return jsonify(feed)
+
+
+@bp.route('/notifications/stream')
+@login_required
+def notification_stream():
+    since = request.headers.get('Last-Event-ID', type=float)
+    if since is None:
+        since = request.args.get('since', 0.0, type=float)
+    user_id = current_user.id
+    hub = current_app.notification_hub
+    listener = hub.subscribe(user_id)
+    feed = [] if notifications_unchanged(user_id, since) else \
+        _notification_feed(current_user, since)
+    db.session.remove()
+    events = event_stream(
+        listener, feed, since,
+        current_app.config['NOTIFICATIONS_STREAM_DURATION'],
+        current_app.config['NOTIFICATIONS_HEARTBEAT'])
+
+    def generate():
+        try:
+            yield from events
+        finally:
+            if listener is not None:
+                hub.unsubscribe(user_id, listener)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
@@ -0,0 +1,45 @@
+from app import db
+from app.models import User, Favorite, likes
+
+
+class ViewerContext(object):
+    """Per-viewer state of the posts on one page.
+
+    ``_post.html`` reads the liked and favorited flags from here instead of
+    querying them once per post.
+    """
+
+    def __init__(self, authors, liked_ids, favorited_ids):
+        # keeps the preloaded authors in the session's identity map, so
+        # post.author resolves without a query while the page renders
+        self.authors = authors
+        self.liked_ids = liked_ids
+        self.favorited_ids = favorited_ids
+
+    def liked(self, post):
+        return post.id in self.liked_ids
+
+    def favorited(self, post):
+        return post.id in self.favorited_ids
+
+
+def load_viewer_context(viewer, posts):
+    """Resolve authors, likes and favorites of a page of posts at once.
+
+    The number of queries does not depend on the number of posts.
+    """
+    posts = list(posts)
+    author_ids = {post.user_id for post in posts}
+    post_ids = [post.id for post in posts]
+    authors = User.query.filter(User.id.in_(author_ids)).all() \
+        if author_ids else []
+    liked_ids = set()
+    favorited_ids = set()
+    if post_ids:
+        liked_ids = {row.post_id for row in db.session.query(
+            likes.c.post_id).filter(likes.c.user_id == viewer.id,
+                                    likes.c.post_id.in_(post_ids))}
+        favorited_ids = {row.post_id for row in db.session.query(
+            Favorite.post_id).filter(Favorite.user_id == viewer.id,
+                                     Favorite.post_id.in_(post_ids))}
+    return ViewerContext(authors, liked_ids, favorited_ids)
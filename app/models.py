@@ -6,19 +6,84 @@ import os
 from time import time
 from flask import current_app, url_for
 from flask_login import UserMixin
-from langdetect import detect
-from sqlalchemy.orm import RelationshipProperty
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import RelationshipProperty, make_transient_to_detached
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
+import redis
+import rq
 from app import db, login
-from app.search import add_to_index, remove_from_index, query_index
+from app.notifications import queue_notification, \
+    publish_queued_notifications, discard_queued_notifications
+from app.pagination import paginate_cursor
+from app.progress import get_progress
+from app.reindex import bulk_reindex
+from app.search import add_to_index, remove_from_index, query_index, \
+    bulk_index, queue_index_changes, take_index_changes, \
+    invalidate_search_results, query_index_after, requeue_index_changes, \
+    unschedule_index_changes, record_rebuild_changes, schedule_index_retry
 
 db_user_id = 'user.id'
+UNREAD_TTL = 7 * 24 * 3600
+
+
+def unread_key(user_id):
+    return 'unread:{}'.format(user_id)
+
+
+def queue_unread_change(session, user_id, delta):
+    """Change the user's unread message counter by ``delta`` once
+    ``session`` commits."""
+    session.info.setdefault('unread', []).append((user_id, delta))
+
+
+def _apply_unread_change(user_id, delta):
+    key = unread_key(user_id)
+
+    def update(pipe):
+        count = pipe.get(key)
+        # a missing counter is left to be counted on the next read
+        if count is not None:
+            pipe.multi()
+            pipe.set(key, max(int(count) + delta, 0), ex=UNREAD_TTL)
+
+    current_app.redis.transaction(update, key)
+
+
+def apply_unread_changes(session):
+    for user_id, delta in session.info.pop('unread', []):
+        try:
+            _apply_unread_change(user_id, delta)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not update unread message '
+                                       'count', exc_info=True)
+            try:
+                # counted again on the next read rather than left wrong
+                current_app.redis.delete(unread_key(user_id))
+            except redis.exceptions.RedisError:
+                pass
+
+
+def discard_unread_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('unread', None)
+
+
+def increment_counter(obj, name, delta=1):
+    # persistent rows get an atomic "column = column + delta" UPDATE at flush
+    # time, so concurrent requests cannot lose each other's increments
+    if inspect(obj).persistent:
+        setattr(obj, name, getattr(type(obj), name) + delta)
+    else:
+        setattr(obj, name, (getattr(obj, name) or 0) + delta)
+
 
 class SearchableMixin(object):
     @classmethod
     def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
+        ids, total = query_index(cls.__tablename__, expression, page, per_page,
+                                 cls.__searchable__)
         if total == 0:
             return cls.query.filter_by(id=0), 0
         when = []
@@ -27,44 +92,134 @@ class SearchableMixin(object):
         return cls.query.filter(cls.id.in_(ids)).order_by(
             db.case(when, value=cls.id)), total
 
+    @classmethod
+    def search_after(cls, expression, per_page, cursor=None):
+        """Return one page of matches in relevance order and the next cursor.
+
+        Raises ``ValueError`` if the cursor is invalid.
+        """
+        ids, next_cursor = query_index_after(
+            cls.__tablename__, expression, per_page, cursor,
+            cls.__searchable__)
+        found = {obj.id: obj for obj in cls.query.filter(cls.id.in_(ids))} \
+            if ids else {}
+        # rows deleted since they were indexed are skipped
+        return [found[id] for id in ids if id in found], next_cursor
+
+    def search_fields_changed(self):
+        """Return whether a column that is indexed has a pending change."""
+        state = inspect(self)
+        return any(state.attrs[field].history.has_changes()
+                   for field in self.__searchable__)
+
     @classmethod
     def before_commit(cls, session):
         session._changes = {
             'add': list(session.new),
-            'update': list(session.dirty),
+            # updates to counters and other columns that are not indexed
+            # leave the documents and the cached results as they are
+            'update': [obj for obj in session.dirty
+                       if isinstance(obj, SearchableMixin) and
+                       obj.search_fields_changed()],
             'delete': list(session.deleted)
         }
 
     @classmethod
     def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
-            if isinstance(obj, SearchableMixin):
+        changes = {}
+        for op, objs in [('add', session._changes['add']),
+                         ('add', session._changes['update']),
+                         ('remove', session._changes['delete'])]:
+            for obj in objs:
+                if isinstance(obj, SearchableMixin):
+                    changes.setdefault(obj.__tablename__, {})[obj.id] = op
+        indexes = list(changes)
+        if current_app.elasticsearch:
+            # recorded before they are applied, which could still be to the
+            # index that a rebuild replaces
+            for index in indexes:
+                record_rebuild_changes(index, changes[index])
+        if current_app.search_backend and \
+                not current_app.config['SEARCH_INDEX_SYNC']:
+            for index in indexes:
+                if queue_index_changes(index, changes[index]):
+                    del changes[index]
+        for obj in session._changes['add'] + session._changes['update']:
+            if isinstance(obj, SearchableMixin) and \
+                    obj.__tablename__ in changes:
                 add_to_index(obj.__tablename__, obj)
         for obj in session._changes['delete']:
-            if isinstance(obj, SearchableMixin):
+            if isinstance(obj, SearchableMixin) and \
+                    obj.__tablename__ in changes:
                 remove_from_index(obj.__tablename__, obj)
         session._changes = None
+        for index in indexes:
+            invalidate_search_results(index)
+
+    @classmethod
+    def apply_index_changes(cls, attempt=0):
+        """Apply the changes queued by after_commit with bulk requests.
+
+        Changes that fail are queued again with a delayed retry and the
+        number of failures is returned.
+        """
+        index = cls.__tablename__
+        try:
+            add_ids, remove_ids = take_index_changes(index)
+            found = cls.query.filter(cls.id.in_(add_ids)).all() \
+                if add_ids else []
+            # rows deleted after their change was queued are removed instead
+            removed = set(remove_ids) | (set(add_ids) -
+                                         {obj.id for obj in found})
+            try:
+                failed = bulk_index(index, found, sorted(removed))
+            except Exception:
+                failed = add_ids + remove_ids
+                raise
+            finally:
+                if failed:
+                    requeue_index_changes(index, {
+                        id: 'remove' if id in removed else 'add'
+                        for id in failed})
+                    schedule_index_retry(index, attempt)
+            invalidate_search_results(index)
+        finally:
+            # a job that failed must not keep the next ones from being
+            # scheduled
+            unschedule_index_changes(index)
+        return len(failed)
+
+    @staticmethod
+    def searchable_models():
+        return {model.__tablename__: model
+                for model in SearchableMixin.__subclasses__()}
 
     @classmethod
     def reindex(cls):
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+        bulk_reindex(cls)
 
 
 db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_commit', publish_queued_notifications)
+db.event.listen(db.session, 'after_soft_rollback',
+                discard_queued_notifications)
+db.event.listen(db.session, 'after_commit', apply_unread_changes)
+db.event.listen(db.session, 'after_soft_rollback', discard_unread_changes)
 
 
 class PaginatedAPIMixin(object):
-    @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
+    @classmethod
+    def to_dicts(cls, items):
+        """Render a page of items; overridden to batch per-item lookups."""
+        return [item.to_dict() for item in items]
+
+    @classmethod
+    def to_collection_dict(cls, query, page, per_page, endpoint, **kwargs):
         resources = query.paginate(page=page, per_page=per_page,
                                    error_out=False)
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': cls.to_dicts(resources.items),
             '_meta': {
                 'page': page,
                 'per_page': per_page,
@@ -82,20 +237,50 @@ class PaginatedAPIMixin(object):
         }
         return data
 
+    @classmethod
+    def to_cursor_collection_dict(cls, query, cursor, per_page, endpoint,
+                                  **kwargs):
+        columns = [getattr(cls, name) for name in cls.__cursor__]
+        resources = paginate_cursor(query, columns, per_page, cursor)
+        data = {
+            'items': cls.to_dicts(resources.items),
+            '_meta': {
+                'per_page': per_page,
+                'cursor': cursor
+            },
+            '_links': {
+                'self': url_for(endpoint, cursor=cursor, per_page=per_page,
+                                **kwargs),
+                'next': url_for(endpoint, cursor=resources.next_cursor,
+                                per_page=per_page, **kwargs)
+                if resources.has_next else None,
+                'prev': url_for(endpoint, cursor=resources.prev_cursor,
+                                per_page=per_page, **kwargs)
+                if resources.has_prev else None
+            }
+        }
+        return data
+
 
 followers = db.Table(
     'followers',
     db.Column('follower_id', db.Integer, db.ForeignKey(db_user_id)),
-    db.Column('followed_id', db.Integer, db.ForeignKey(db_user_id))
+    db.Column('followed_id', db.Integer, db.ForeignKey(db_user_id)),
+    db.Index('ix_followers_follower_id_followed_id', 'follower_id',
+             'followed_id', unique=True),
+    db.Index('ix_followers_followed_id_follower_id', 'followed_id',
+             'follower_id')
 )
 
 likes = db.Table(
     'likes',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('post_id', db.Integer, db.ForeignKey('post.id'))
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id')),
+    db.Index('ix_likes_user_id_post_id', 'user_id', 'post_id', unique=True)
 )
 
 class User(UserMixin, PaginatedAPIMixin, db.Model):
+    __cursor__ = ['id']
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
@@ -106,6 +291,12 @@ class User(UserMixin, PaginatedAPIMixin, db.Model):
     token = db.Column(db.String(32), index=True, unique=True)
     token_expiration = db.Column(db.DateTime, unique = True)
     fa_token = db.Column(db.String(16))
+    post_count = db.Column(db.Integer, default=0, server_default='0',
+                           nullable=False)
+    follower_count = db.Column(db.Integer, default=0, server_default='0',
+                               nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default='0',
+                               nullable=False)
     followed = db.relationship(
         'User', secondary=followers,
         primaryjoin=(followers.c.follower_id == id),
@@ -167,10 +358,14 @@ class User(UserMixin, PaginatedAPIMixin, db.Model):
     def follow(self, user):
         if not self.is_following(user):
             self.followed.append(user)
+            increment_counter(self, 'followed_count')
+            increment_counter(user, 'follower_count')
 
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            increment_counter(self, 'followed_count', -1)
+            increment_counter(user, 'follower_count', -1)
 
     def is_following(self, user):
         return self.followed.filter(
@@ -186,10 +381,12 @@ class User(UserMixin, PaginatedAPIMixin, db.Model):
     def like(self, post):
         if not self.is_liking(post):
             self.liked.append(post)
+            increment_counter(post, 'like_count')
 
     def unlike(self, post):
         if self.is_liking(post):
             self.liked.remove(post)
+            increment_counter(post, 'like_count', -1)
 
     def is_liking(self, post):
         return self.liked.filter(likes.c.post_id == post.id).count() > 0
@@ -209,15 +406,66 @@ class User(UserMixin, PaginatedAPIMixin, db.Model):
         return User.query.get(id)
 
     def new_messages(self):
-        last_read_time = self.last_message_read_time or datetime(1900, 1, 1)
-        return Message.query.filter_by(recipient=self).filter(
-            Message.timestamp > last_read_time).count()
+        """Return the number of unread messages, kept in Redis."""
+        key = unread_key(self.id)
+        try:
+            count = current_app.redis.get(key)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not read unread message count',
+                                       exc_info=True)
+            return self.count_new_messages()
+        if count is None:
+            count = self.count_new_messages()
+            try:
+                # a counter set meanwhile by a send or a read is kept
+                current_app.redis.set(key, count, ex=UNREAD_TTL, nx=True)
+            except redis.exceptions.RedisError:
+                pass
+        return int(count)
+
+    def count_new_messages(self):
+        # the unread messages of every conversation, as marked read one
+        # conversation at a time
+        return db.session.query(db.func.coalesce(
+            db.func.sum(Conversation.unread_count), 0)).filter(
+                Conversation.user_id == self.id).scalar()
+
+    def update_unread_messages(self, delta):
+        """Change the unread count by ``delta`` once committed, and return
+        the count it will make.
+
+        The conversations must already hold the change, which the count
+        taken from the database includes.
+        """
+        queue_unread_change(db.session, self.id, delta)
+        try:
+            count = current_app.redis.get(unread_key(self.id))
+        except redis.exceptions.RedisError:
+            count = None
+        return max(int(count) + delta, 0) if count is not None else \
+            self.count_new_messages()
+
+    def add_unread_message(self):
+        """Count a new message sent to the user once it is committed, and
+        return the unread count it will make."""
+        return self.update_unread_messages(1)
 
     def add_notification(self, name, data):
-        self.notifications.filter_by(name=name).delete()
-        n = Notification(name=name, payload_json=json.dumps(data), user=self)
-        db.session.add(n)
-        return n
+        # a user has one notification per name, updated in place; its
+        # timestamp is the version that polls compare against
+        values = {'payload_json': json.dumps(data), 'timestamp': time()}
+        query = Notification.query.filter_by(user_id=self.id, name=name)
+        if not query.update(values, synchronize_session=False):
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Notification(user_id=self.id, name=name,
+                                                **values))
+            except IntegrityError:
+                # inserted by a concurrent request in the meantime
+                query.update(values, synchronize_session=False)
+        queue_notification(db.session, self.id,
+                           {'name': name, 'data': data,
+                            'timestamp': values['timestamp']})
 
     def launch_task(self, name, description, *args, **kwargs):
         rq_job = current_app.task_queue.enqueue('app.tasks.' + name, self.id,
@@ -234,15 +482,25 @@ class User(UserMixin, PaginatedAPIMixin, db.Model):
         return Task.query.filter_by(name=name, user=self,
                                     complete=False).first()
 
-    def to_dict(self, include_email=False):
+    def get_last_seen(self):
+        return self._latest_seen(current_app.last_seen.get(self.id))
+
+    def _latest_seen(self, buffered):
+        if buffered is not None and (self.last_seen is None or
+                                     buffered > self.last_seen):
+            return buffered
+        return self.last_seen
+
+    def to_dict(self, include_email=False, last_seen=None):
         data = {
             'id': self.id,
             'username': self.username,
-            'last_seen': self.last_seen.isoformat() + 'Z',
+            'last_seen': (last_seen or self.get_last_seen()).isoformat() +
+            'Z',
             'about_me': self.about_me,
-            'post_count': self.posts.count(),
-            'follower_count': self.followers.count(),
-            'followed_count': self.followed.count(),
+            'post_count': self.post_count,
+            'follower_count': self.follower_count,
+            'followed_count': self.followed_count,
             '_links': {
                 'self': url_for('api.get_user', id=self.id),
                 'followers': url_for('api.get_followers', id=self.id),
@@ -254,6 +512,14 @@ class User(UserMixin, PaginatedAPIMixin, db.Model):
             data['email'] = self.email
         return data
 
+    @classmethod
+    def to_dicts(cls, users):
+        # the buffered last_seen times of the whole page in one lookup
+        buffered = current_app.last_seen.get_many([user.id for user in users])
+        return [user.to_dict(
+            last_seen=user._latest_seen(buffered.get(user.id)))
+            for user in users]
+
     def from_dict(self, data, new_user=False):
         for field in ['username', 'email', 'about_me']:
             if field in data:
@@ -261,24 +527,51 @@ class User(UserMixin, PaginatedAPIMixin, db.Model):
         if new_user and 'password' in data:
             self.set_password(data['password'])
 
-    def get_token(self, expires_in=3600):
+    def ensure_token(self, expires_in=3600):
+        # like get_token, but a newly minted token is left for the caller
+        # to commit
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
             return self.token
+        if self.token:
+            current_app.token_cache.invalidate(self.token)
         self.token = base64.b64encode(os.urandom(24)).decode('utf-8')
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
-        db.session.commit()
         return self.token
 
+    def get_token(self, expires_in=3600):
+        old_token = self.token
+        token = self.ensure_token(expires_in)
+        if token != old_token:
+            db.session.commit()
+        return token
+
     def revoke_token(self):
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
+        if self.token:
+            current_app.token_cache.invalidate(self.token)
+
+    # columns kept in the token cache; the user is rebuilt from them without
+    # a query, and any other column loads from the database when it is first
+    # read, so that it is never stale
+    token_cache_columns = ['id', 'token', 'token_expiration']
 
     @staticmethod
     def check_token(token):
+        values = current_app.token_cache.get(token, ('token_expiration',))
+        if values is not None:
+            if values['token_expiration'] < datetime.utcnow():
+                return None
+            user = User(**values)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
         user = User.query.filter_by(token=token).first()
         if user is None or user.token_expiration < datetime.utcnow():
             return None
+        current_app.token_cache.set(token, {
+            column: getattr(user, column)
+            for column in User.token_cache_columns})
         return user
 
 
@@ -288,11 +581,17 @@ def load_user(id):
 
 class Post(SearchableMixin, PaginatedAPIMixin, db.Model):
     __searchable__ = ['body']
+    __cursor__ = ['timestamp', 'id']
+    __table_args__ = (
+        db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey(db_user_id))
     language = db.Column(db.String(5))
+    like_count = db.Column(db.Integer, default=0, server_default='0',
+                           nullable=False)
 
     def to_dict(self):
         data = {
@@ -301,31 +600,136 @@ class Post(SearchableMixin, PaginatedAPIMixin, db.Model):
             'timestamp': self.timestamp,
             'user_id': self.user_id,
             'language': self.language,
-            'likes': self.likes.count()
+            'likes': self.like_count
         }
         return data
 
     def from_dict(self, data):
         for field in ["body", "user_id"]:
             setattr(self, field, data[field])
-        setattr(self, "language", detect(data["body"]))
+        setattr(self, "language", current_app.langid.detect(data["body"]))
 
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
 
+@db.event.listens_for(Post, 'after_insert')
+def increment_post_count(mapper, connection, target):
+    users = User.__table__
+    connection.execute(users.update().where(
+        users.c.id == target.user_id).values(post_count=users.c.post_count + 1))
+
+
+@db.event.listens_for(Post, 'after_delete')
+def decrement_post_count(mapper, connection, target):
+    users = User.__table__
+    connection.execute(users.update().where(
+        users.c.id == target.user_id).values(post_count=users.c.post_count - 1))
+
+
+def conversation_key(user_id, other_id):
+    """Return the key shared by the messages between two users."""
+    return '{}:{}'.format(*sorted([user_id, other_id]))
+
+
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_recipient_id_timestamp', 'recipient_id',
+                 'timestamp'),
+        db.Index('ix_message_conversation_key_timestamp_id',
+                 'conversation_key', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey(db_user_id))
     recipient_id = db.Column(db.Integer, db.ForeignKey(db_user_id))
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    conversation_key = db.Column(db.String(32))
 
     def __repr__(self):
         return '<Message {}>'.format(self.body)
 
 
+@db.event.listens_for(Message, 'before_insert')
+def set_conversation_key(mapper, connection, target):
+    target.conversation_key = conversation_key(target.sender_id,
+                                               target.recipient_id)
+
+
+class Conversation(db.Model):
+    """One user's side of the private messages exchanged with a peer.
+
+    It holds a copy of the last message, so that the inbox is read from this
+    table alone, and the number of messages the user has not read yet.
+    """
+    __table_args__ = (
+        db.Index('ix_conversation_user_id_peer_id', 'user_id', 'peer_id',
+                 unique=True),
+        db.Index('ix_conversation_user_id_last_activity_id', 'user_id',
+                 'last_activity', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(db_user_id),
+                        nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey(db_user_id),
+                        nullable=False)
+    last_activity = db.Column(db.DateTime, nullable=False)
+    last_sender_id = db.Column(db.Integer, db.ForeignKey(db_user_id))
+    last_body = db.Column(db.String(140))
+    unread_count = db.Column(db.Integer, default=0, server_default='0',
+                             nullable=False)
+    peer = db.relationship('User', foreign_keys=[peer_id])
+
+    @staticmethod
+    def _update(user_id, peer_id, message, unread):
+        values = {'last_activity': message.timestamp,
+                  'last_sender_id': message.sender_id,
+                  'last_body': message.body}
+        changes = dict(values, unread_count=Conversation.unread_count + unread)
+        query = Conversation.query.filter_by(user_id=user_id, peer_id=peer_id)
+        if query.update(changes, synchronize_session=False):
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(Conversation(user_id=user_id, peer_id=peer_id,
+                                            unread_count=unread, **values))
+        except IntegrityError:
+            # created by a concurrent message in the meantime
+            query.update(changes, synchronize_session=False)
+
+    @staticmethod
+    def add_message(message):
+        """Record a new message in the conversations of both users."""
+        db.session.flush()
+        Conversation._update(message.sender_id, message.recipient_id,
+                             message, 0)
+        Conversation._update(message.recipient_id, message.sender_id,
+                             message, 1)
+
+    @staticmethod
+    def mark_read(user, peer):
+        """Mark the user's conversation with ``peer`` read.
+
+        The messages read are taken off the user's unread count. Returns
+        the unread count that makes, or ``None`` if nothing was unread.
+        """
+        query = Conversation.query.filter_by(user_id=user.id,
+                                             peer_id=peer.id)
+        unread = query.with_entities(Conversation.unread_count).scalar()
+        if not unread:
+            return None
+        # messages that arrive meanwhile stay unread
+        query.update({'unread_count': Conversation.unread_count - unread},
+                     synchronize_session=False)
+        return user.update_unread_messages(-unread)
+
+
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_user_id_name', 'user_id', 'name',
+                 unique=True),
+        db.Index('ix_notification_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), index=True)
     user_id = db.Column(db.Integer, db.ForeignKey(db_user_id))
@@ -351,11 +755,20 @@ class Task(db.Model):
         return rq_job
 
     def get_progress(self):
+        if self.complete:
+            return 100
+        progress = get_progress(self.id)
+        if progress is not None:
+            return progress
         job = self.get_rq_job()
         return job.meta.get('progress', 0) if job is not None else 100
 
 # class for favorites table
 class Favorite(db.Model):
+    __table_args__ = (
+        db.Index('ix_favorite_user_id_post_id', 'user_id', 'post_id',
+                 unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(db_user_id))
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
@@ -0,0 +1,223 @@
+import json
+import queue
+import threading
+from time import monotonic, sleep, time
+import redis
+from flask import current_app
+
+CHANNEL_PREFIX = 'notifications:user:'
+# bounds how long polls can be answered from a stale marker, when recording
+# a notification in Redis failed and the marker could not be removed either
+LATEST_TTL = 300
+# seconds the browser waits before reconnecting a stream that ended
+RETRY_DELAY = 10
+
+
+def channel(user_id):
+    return CHANNEL_PREFIX + str(user_id)
+
+
+def _latest_key(user_id):
+    return 'notifications:latest:{}'.format(user_id)
+
+
+def set_latest_notification(connection, user_id, timestamp):
+    """Record ``timestamp`` as the user's latest notification, unless a
+    later one is recorded already."""
+    key = _latest_key(user_id)
+
+    def update(pipe):
+        latest = pipe.get(key)
+        if latest is None or float(latest) < timestamp:
+            pipe.multi()
+            pipe.set(key, repr(timestamp), ex=LATEST_TTL)
+
+    connection.transaction(update, key)
+
+
+def forget_latest_notification(connection, user_id):
+    """Remove the user's latest notification marker after a failure to
+    update it, so that polls go to the database."""
+    try:
+        connection.delete(_latest_key(user_id))
+    except redis.exceptions.RedisError:
+        pass
+
+
+def notifications_unchanged(user_id, since):
+    """Tell from Redis alone whether the user has nothing newer than
+    ``since``. ``False`` means the database has to be asked."""
+    try:
+        latest = current_app.redis.get(_latest_key(user_id))
+    except redis.exceptions.RedisError:
+        return False
+    return latest is not None and float(latest) <= since
+
+
+def remember_no_notifications(user_id, since):
+    """Record that the database has nothing newer than ``since``.
+
+    Only done if nothing is recorded, so that a concurrent notification
+    cannot be hidden. Lets users without notifications poll without
+    touching the database too.
+    """
+    if since > time():
+        return
+    try:
+        current_app.redis.set(_latest_key(user_id), repr(since),
+                              ex=LATEST_TTL, nx=True)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def publish_notification(user_id, notification):
+    """Publish a ``{name, data, timestamp}`` notification to its user's
+    open streams."""
+    try:
+        set_latest_notification(current_app.redis, user_id,
+                                notification['timestamp'])
+        current_app.redis.publish(channel(user_id), json.dumps(notification))
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not publish notification',
+                                   exc_info=True)
+        forget_latest_notification(current_app.redis, user_id)
+
+
+def queue_notification(session, user_id, notification):
+    """Publish a notification once ``session`` commits."""
+    session.info.setdefault('notifications', []).append(
+        (user_id, notification))
+
+
+def publish_queued_notifications(session):
+    for user_id, notification in session.info.pop('notifications', []):
+        publish_notification(user_id, notification)
+
+
+def discard_queued_notifications(session, previous_transaction):
+    # the rollback of a savepoint leaves the notifications queued before it
+    # to the enclosing transaction
+    if previous_transaction.parent is None:
+        session.info.pop('notifications', None)
+
+
+class NotificationHub(object):
+    """Delivers published notifications to the streams of this process.
+
+    A single Redis connection subscribed to every user's channel is shared
+    by all the streams, which receive their user's notifications through a
+    queue. The subscription is opened by a background thread on first use
+    and reopened if the connection is lost.
+    """
+
+    def __init__(self, connection, logger=None, reconnect_delay=1.0):
+        self.redis = connection
+        self.logger = logger
+        self.reconnect_delay = reconnect_delay
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._connected = threading.Event()
+
+    def subscribe(self, user_id, timeout=1.0):
+        """Return a queue of the user's notifications.
+
+        Returns ``None`` if no subscription to Redis could be opened within
+        ``timeout`` seconds.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+            listener = queue.Queue()
+            self._listeners.setdefault(user_id, set()).add(listener)
+        if not self._connected.wait(timeout):
+            self.unsubscribe(user_id, listener)
+            return None
+        return listener
+
+    def unsubscribe(self, user_id, listener):
+        with self._lock:
+            listeners = self._listeners.get(user_id, set())
+            listeners.discard(listener)
+            if not listeners:
+                self._listeners.pop(user_id, None)
+
+    def _dispatch(self, message):
+        user_id = int(message['channel'][len(CHANNEL_PREFIX):])
+        notification = json.loads(message['data'])
+        with self._lock:
+            listeners = list(self._listeners.get(user_id, ()))
+        for listener in listeners:
+            listener.put(notification)
+
+    def _run(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(CHANNEL_PREFIX + '*')
+                self._connected.set()
+                for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self._dispatch(message)
+            except redis.exceptions.RedisError:
+                if self.logger:
+                    self.logger.warning('Notification subscription lost',
+                                        exc_info=True)
+            finally:
+                self._connected.clear()
+                pubsub.close()
+            sleep(self.reconnect_delay)
+
+
+def wait_for_notification(listener, since, timeout):
+    """Return the first notification newer than ``since`` that arrives on
+    ``listener`` within ``timeout`` seconds, or ``None``."""
+    deadline = monotonic() + timeout
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return None
+        try:
+            notification = listener.get(timeout=remaining)
+        except queue.Empty:
+            return None
+        if notification['timestamp'] > since:
+            return notification
+
+
+def _event(notification):
+    return 'id: {}\ndata: {}\n\n'.format(notification['timestamp'],
+                                         json.dumps(notification))
+
+
+def event_stream(listener, feed, since, duration, heartbeat):
+    """Generate the server-sent events of a notification stream.
+
+    The ``feed`` of notifications the client has not seen is sent first,
+    followed by those arriving on ``listener`` for ``duration`` seconds,
+    with a comment every ``heartbeat`` seconds of silence to keep the
+    connection open. Each event's id is its timestamp, which the browser
+    sends back as ``Last-Event-ID`` when it reconnects. Without a
+    ``listener`` the stream ends after the feed, which turns the stream
+    into polling every ``RETRY_DELAY`` seconds.
+    """
+    yield 'retry: {}\n\n'.format(RETRY_DELAY * 1000)
+    for notification in feed:
+        since = max(since, notification['timestamp'])
+        yield _event(notification)
+    if listener is None:
+        return
+    deadline = monotonic() + duration
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return
+        notification = wait_for_notification(listener, since,
+                                              min(heartbeat, remaining))
+        if notification is None:
+            yield ': keep-alive\n\n'
+        else:
+            since = notification['timestamp']
+            yield _event(notification)
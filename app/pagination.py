@@ -0,0 +1,113 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from app import db
+
+NEXT = 'next'
+PREV = 'prev'
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _from_json(column, value):
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, db.Integer):
+        return int(value)
+    return value
+
+
+def pack_cursor(payload):
+    """Encode a JSON serializable payload as an opaque, URL safe cursor."""
+    data = json.dumps(payload, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode(
+        'ascii').rstrip('=')
+
+
+def unpack_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('invalid cursor')
+
+
+def encode_cursor(values, direction=NEXT):
+    return pack_cursor({'k': [_to_json(v) for v in values], 'd': direction})
+
+
+def decode_cursor(cursor, columns):
+    """Return the ``(values, direction)`` stored in an opaque cursor.
+
+    A missing or empty cursor points at the first page. Cursors that cannot be
+    decoded raise ``ValueError``.
+    """
+    if not cursor:
+        return None, NEXT
+    payload = unpack_cursor(cursor)
+    try:
+        values = [_from_json(column, value)
+                  for column, value in zip(columns, payload['k'])]
+        direction = payload['d']
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('invalid cursor')
+    if len(values) != len(columns) or direction not in (NEXT, PREV):
+        raise ValueError('invalid cursor')
+    return values, direction
+
+
+class CursorPagination(object):
+    """A page of items fetched with a keyset range query, newest first."""
+
+    def __init__(self, items, columns, has_next, has_prev):
+        self.items = items
+        self.columns = columns
+        self.has_next = has_next
+        self.has_prev = has_prev
+
+    def _cursor(self, item, direction):
+        return encode_cursor([getattr(item, column.key)
+                              for column in self.columns], direction)
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.items[-1], NEXT) \
+            if self.has_next and self.items else None
+
+    @property
+    def prev_cursor(self):
+        return self._cursor(self.items[0], PREV) \
+            if self.has_prev and self.items else None
+
+
+def keyset_filter(columns, values, direction):
+    key = db.tuple_(*columns) if len(columns) > 1 else columns[0]
+    bound = db.tuple_(*values) if len(values) > 1 else values[0]
+    return key < bound if direction == NEXT else key > bound
+
+
+def paginate_cursor(query, columns, per_page, cursor=None):
+    """Fetch one page of ``query`` ordered by ``columns`` descending.
+
+    Instead of an OFFSET and a separate COUNT, this issues a single range
+    query starting at the position stored in ``cursor``.
+    """
+    values, direction = decode_cursor(cursor, columns)
+    query = query.order_by(None)
+    if values is not None:
+        query = query.filter(keyset_filter(columns, values, direction))
+    if direction == NEXT:
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*[column.asc() for column in columns])
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == NEXT:
+        return CursorPagination(items, columns, has_next=has_more,
+                                has_prev=values is not None)
+    return CursorPagination(items[::-1], columns, has_next=True,
+                            has_prev=has_more)
@@ -0,0 +1,139 @@
+from datetime import datetime
+import threading
+from time import monotonic, time
+import redis
+from flask import current_app
+from app import db
+from app.models import User
+
+BUFFER_KEY = 'last_seen'
+FLUSH_GATE_KEY = 'last_seen:flush'
+
+
+class LastSeenBuffer(object):
+    """Write-behind buffer for ``User.last_seen``.
+
+    Requests record the time a user was seen here instead of committing it.
+    The buffered values are written to the ``user`` table in one batched
+    UPDATE once ``flush_interval`` seconds have passed or ``flush_threshold``
+    users are pending. With a Redis connection the buffer is shared by all
+    workers, otherwise each worker keeps its own. Flushes started by a
+    request never fail it; values that could not be written stay buffered
+    for the next flush.
+    """
+
+    def __init__(self, flush_interval=60, flush_threshold=500,
+                 connection=None):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.redis = connection
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = monotonic()
+
+    def record(self, user_id, when=None):
+        when = when or datetime.utcnow()
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.hset(BUFFER_KEY, user_id, when.isoformat())
+                pipe.hlen(BUFFER_KEY)
+                pipe.set(FLUSH_GATE_KEY, 1, nx=True, ex=self.flush_interval)
+                _, pending, gate_opened = pipe.execute()
+                if pending >= self.flush_threshold or gate_opened:
+                    self.try_flush()
+                return
+            except redis.exceptions.RedisError:
+                current_app.logger.warning('last_seen buffer unavailable in '
+                                           'Redis', exc_info=True)
+        with self._lock:
+            self._pending[user_id] = when
+            due = len(self._pending) >= self.flush_threshold or \
+                monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.try_flush()
+
+    def get(self, user_id):
+        if self.redis is not None:
+            try:
+                value = self.redis.hget(BUFFER_KEY, user_id)
+                if value is not None:
+                    return datetime.fromisoformat(value.decode('utf-8'))
+            except redis.exceptions.RedisError:
+                pass
+        return self._pending.get(user_id)
+
+    def get_many(self, user_ids):
+        """Return ``{user_id: when}`` for those of ``user_ids`` that are
+        buffered, with one Redis round trip."""
+        found = {}
+        if self.redis is not None and user_ids:
+            try:
+                values = self.redis.hmget(BUFFER_KEY, user_ids)
+                for user_id, value in zip(user_ids, values):
+                    if value is not None:
+                        found[user_id] = datetime.fromisoformat(
+                            value.decode('utf-8'))
+            except redis.exceptions.RedisError:
+                pass
+        for user_id in user_ids:
+            if user_id not in found and user_id in self._pending:
+                found[user_id] = self._pending[user_id]
+        return found
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = monotonic()
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.hgetall(BUFFER_KEY)
+                pipe.delete(BUFFER_KEY)
+                shared = pipe.execute()[0]
+            except redis.exceptions.RedisError:
+                shared = {}
+            for user_id, value in shared.items():
+                when = datetime.fromisoformat(value.decode('utf-8'))
+                user_id = int(user_id)
+                if user_id not in pending or pending[user_id] < when:
+                    pending[user_id] = when
+        return pending
+
+    def flush(self):
+        """Write all buffered values to the database and return how many."""
+        pending = self._take()
+        if not pending:
+            return 0
+        users = User.__table__
+        stmt = users.update().where(users.c.id == db.bindparam('uid')).where(
+            db.or_(users.c.last_seen.is_(None),
+                   users.c.last_seen < db.bindparam('seen'))).values(
+                last_seen=db.bindparam('seen'))
+        started = time()
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(stmt, [{'uid': user_id, 'seen': when}
+                                    for user_id, when in pending.items()])
+        except Exception:
+            # put the values back so the next flush retries them
+            with self._lock:
+                for user_id, when in pending.items():
+                    self._pending.setdefault(user_id, when)
+            raise
+        current_app.logger.debug('Flushed last_seen of %d users in %.3fs',
+                                 len(pending), time() - started)
+        return len(pending)
+
+    def try_flush(self):
+        """Like :meth:`flush`, but errors are logged instead of raised."""
+        try:
+            return self.flush()
+        except Exception:
+            current_app.logger.error('Could not flush last_seen, will retry',
+                                     exc_info=True)
+            return 0
+
+    def flush_at_exit(self, app):
+        with app.app_context():
+            self.try_flush()
@@ -0,0 +1,106 @@
+import json
+from time import monotonic, time
+import redis
+from flask import current_app
+from app import db
+from app.notifications import channel, forget_latest_notification, \
+    set_latest_notification
+
+PROGRESS_TTL = 24 * 3600
+
+
+def _progress_key(task_id):
+    return 'task:progress:{}'.format(task_id)
+
+
+def _live_notifications_key(user_id):
+    return 'notifications:live:{}'.format(user_id)
+
+
+def get_progress(task_id):
+    """Return the live progress of a task, or ``None`` if none is recorded."""
+    try:
+        progress = current_app.redis.hget(_progress_key(task_id), 'progress')
+    except redis.exceptions.RedisError:
+        return None
+    return int(progress) if progress is not None else None
+
+
+def get_live_notifications(user_id, since=0.0):
+    """Return the progress notifications of a user newer than ``since``.
+
+    They have the shape of the ``Notification`` rows of the feed, which they
+    replace while a task is running.
+    """
+    try:
+        entries = current_app.redis.hgetall(_live_notifications_key(user_id))
+    except redis.exceptions.RedisError:
+        return []
+    notifications = [json.loads(entry) for entry in entries.values()]
+    return [n for n in notifications if n['timestamp'] > since]
+
+
+class ProgressReporter(object):
+    """Reports the progress of the background job behind a ``Task``.
+
+    Updates only go to Redis, at most once every ``interval`` seconds, and
+    are published to the user's notification streams. The database is
+    written once, by ``complete``, which marks the task complete and leaves
+    the final notification in the user's feed.
+    """
+
+    def __init__(self, task, connection, interval=1.0):
+        self.task = task
+        # kept apart so that updates never refresh the expired task row
+        self.task_id = task.id if task is not None else None
+        self.user_id = task.user_id if task is not None else None
+        self.redis = connection
+        self.interval = interval
+        self._last_progress = None
+        self._last_time = None
+
+    def update(self, progress):
+        if self.task is None or progress == self._last_progress:
+            return
+        now = monotonic()
+        if self._last_time is not None and \
+                now - self._last_time < self.interval:
+            return
+        self._last_progress = progress
+        self._last_time = now
+        notification = {'name': 'task_progress',
+                        'data': {'task_id': self.task_id,
+                                 'progress': progress},
+                        'timestamp': time()}
+        live_key = _live_notifications_key(self.user_id)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(_progress_key(self.task_id), 'progress', progress)
+            pipe.expire(_progress_key(self.task_id), PROGRESS_TTL)
+            pipe.hset(live_key, 'task_progress', json.dumps(notification))
+            pipe.expire(live_key, PROGRESS_TTL)
+            pipe.execute()
+            set_latest_notification(self.redis, self.user_id,
+                                    notification['timestamp'])
+            self.redis.publish(channel(self.user_id),
+                               json.dumps(notification))
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not report task progress',
+                                       exc_info=True)
+            forget_latest_notification(self.redis, self.user_id)
+
+    def complete(self):
+        if self.task is None:
+            return
+        self.task.complete = True
+        self.task.user.add_notification(
+            'task_progress', {'task_id': self.task_id, 'progress': 100})
+        db.session.commit()
+        try:
+            pipe = self.redis.pipeline()
+            pipe.delete(_progress_key(self.task_id))
+            pipe.hdel(_live_notifications_key(self.user_id),
+                      'task_progress')
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
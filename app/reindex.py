@@ -0,0 +1,105 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import os
+from flask import current_app
+from app.search import document
+
+
+def iter_chunks(cls, chunk_size, after_id=0):
+    """Yield the rows of a searchable model as lists of ``(id, document)``.
+
+    Rows are streamed in primary key order with ``yield_per``, so only one
+    chunk is held in memory and an interrupted run can continue after the
+    last id it completed.
+    """
+    query = cls.query.filter(cls.id > after_id).order_by(cls.id).yield_per(
+        chunk_size)
+    chunk = []
+    for obj in query:
+        chunk.append((obj.id, document(obj)))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_reindex(cls, index=None, chunk_size=1000, workers=4, after_id=0,
+                 on_chunk=None):
+    """Index all rows of ``cls`` with bulk requests sent from a thread pool.
+
+    Chunks are built in the calling thread and at most ``2 * workers`` of
+    them are in flight at a time. Chunks can complete out of order, so
+    ``on_chunk(last_id, indexed, failed)`` is only called with the highest
+    id below which every chunk has completed, which is safe to resume from.
+    Returns the number of documents indexed and the number that failed.
+    """
+    backend = current_app.search_backend
+    if not backend:
+        return 0, 0
+    index = index or cls.__tablename__
+    submitted = []
+    indexed = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+
+        def collect(done):
+            nonlocal indexed, failed
+            for future in done:
+                in_flight.discard(future)
+            completed = None
+            try:
+                while submitted and submitted[0][0].done():
+                    future, last_id, size = submitted.pop(0)
+                    # re-raises a failed request once the chunks before it
+                    # have been reported
+                    chunk_failed = len(future.result())
+                    indexed += size - chunk_failed
+                    failed += chunk_failed
+                    completed = last_id
+            finally:
+                if completed is not None and on_chunk is not None:
+                    on_chunk(completed, indexed, failed)
+
+        try:
+            for chunk in iter_chunks(cls, chunk_size, after_id):
+                if len(in_flight) >= 2 * workers:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED)[0])
+                future = executor.submit(backend.bulk, index, chunk)
+                in_flight.add(future)
+                submitted.append((future, chunk[-1][0], len(chunk)))
+            while in_flight:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED)[0])
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+    return indexed, failed
+
+
+class Checkpoint(object):
+    """Progress of a reindex run, saved to a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        # written to a temporary file first, so a crash never leaves a
+        # truncated checkpoint behind
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
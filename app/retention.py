@@ -0,0 +1,42 @@
+import os
+from time import time
+from app import db
+from app.models import Notification
+
+
+def prune_notifications(max_age, batch_size=1000):
+    """Delete the notifications not updated for ``max_age`` seconds.
+
+    Rows are deleted at most ``batch_size`` at a time, each batch in its own
+    transaction, so that locks are held briefly. A row updated after it was
+    selected is left alone. Yields the number of rows deleted by each batch.
+    """
+    cutoff = time() - max_age
+    while True:
+        ids = [row.id for row in db.session.query(Notification.id).filter(
+            Notification.timestamp < cutoff).limit(batch_size)]
+        if not ids:
+            break
+        deleted = Notification.query.filter(
+            Notification.id.in_(ids),
+            Notification.timestamp < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        yield deleted
+
+
+def prune_exports(directory, max_age):
+    """Delete the exports written more than ``max_age`` seconds ago and
+    return how many."""
+    cutoff = time() - max_age
+    deleted = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    deleted += 1
+            except FileNotFoundError:
+                # removed by a concurrent prune
+                pass
+    return deleted
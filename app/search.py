@@ -1,27 +1,321 @@
+from datetime import timedelta
+from hashlib import sha256
+import json
+from time import time
+import redis
 from flask import current_app
+from app.pagination import pack_cursor, unpack_cursor
 
+# how long the changes made during an interrupted rebuild are kept for it to
+# be resumed
+REBUILD_TTL = 24 * 3600
 
-def add_to_index(index, model):
-    if not current_app.elasticsearch:
-        return
+
+def _pending_key(index):
+    return 'search:pending:{}'.format(index)
+
+
+def _pending_since_key(index):
+    return 'search:pending_since:{}'.format(index)
+
+
+def _scheduled_key(index):
+    return 'search:scheduled:{}'.format(index)
+
+
+def _rebuilding_key(index):
+    return 'search:rebuilding:{}'.format(index)
+
+
+def _replay_key(index):
+    return 'search:replay:{}'.format(index)
+
+
+def _generation_key(index):
+    return 'search:gen:{}'.format(index)
+
+
+def _results_key(index, generation, query, page, per_page):
+    # the analyzers ignore case and extra whitespace, so the cache does too
+    query = ' '.join(query.lower().split())
+    return 'search:results:{}:{}:{}:{}:{}'.format(
+        index, generation, sha256(query.encode('utf-8')).hexdigest(), page,
+        per_page)
+
+
+def document(model):
     payload = {}
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, body=payload)
+    return payload
+
+
+def add_to_index(index, model):
+    if not current_app.search_backend:
+        return
+    current_app.search_backend.add(index, model.id, document(model))
 
 
 def remove_from_index(index, model):
-    if not current_app.elasticsearch:
+    if not current_app.search_backend:
+        return
+    current_app.search_backend.remove(index, model.id)
+
+
+def bulk_index(index, models, remove_ids=()):
+    """Index and delete many documents with as few requests as possible.
+
+    Returns the ids of the documents that failed.
+    """
+    if not current_app.search_backend:
+        return []
+    return current_app.search_backend.bulk(
+        index, [(model.id, document(model)) for model in models], remove_ids)
+
+
+def create_index(index, settings=None):
+    current_app.elasticsearch.indices.create(
+        index=index, body={'settings': settings or {}})
+
+
+def update_index_settings(index, settings):
+    current_app.elasticsearch.indices.put_settings(index=index, body=settings)
+
+
+def delete_index(index):
+    current_app.elasticsearch.indices.delete(index=index)
+
+
+def swap_alias(alias, index):
+    """Point ``alias`` at ``index`` in one atomic update.
+
+    The alias is removed from the indices it pointed at before, which are
+    returned. A concrete index that has the alias's name, as created by the
+    first versions of this application, is deleted in the same update.
+    """
+    es = current_app.elasticsearch
+    actions = []
+    previous = []
+    if es.indices.exists_alias(name=alias):
+        previous = [old for old in es.indices.get_alias(name=alias)
+                    if old != index]
+        for old in previous:
+            actions.append({'remove': {'index': old, 'alias': alias}})
+    elif es.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+    actions.append({'add': {'index': index, 'alias': alias}})
+    es.indices.update_aliases(body={'actions': actions})
+    return previous
+
+
+def start_rebuild(index):
+    """Record the changes made to ``index`` while a new index is built.
+
+    The rows are read while they keep changing, and until the alias is
+    swapped the changes are written to the old index, so they are replayed
+    into the new one once it is in place.
+    """
+    pipe = current_app.redis.pipeline()
+    pipe.set(_rebuilding_key(index), 1, ex=REBUILD_TTL)
+    pipe.expire(_replay_key(index), REBUILD_TTL)
+    pipe.execute()
+
+
+def record_rebuild_changes(index, changes):
+    """Keep ``{id: 'add' | 'remove'}`` changes for the rebuild of ``index``,
+    if one is in progress."""
+    try:
+        if current_app.redis.exists(_rebuilding_key(index)):
+            pipe = current_app.redis.pipeline()
+            pipe.hset(_replay_key(index), mapping=changes)
+            pipe.expire(_replay_key(index), REBUILD_TTL)
+            pipe.execute()
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not record changes for the search '
+                                   'index rebuild', exc_info=True)
+
+
+def finish_rebuild(index):
+    """Stop recording changes and return those recorded, to replay."""
+    pipe = current_app.redis.pipeline()
+    pipe.hgetall(_replay_key(index))
+    pipe.delete(_rebuilding_key(index), _replay_key(index))
+    changes = pipe.execute()[0]
+    return {int(id): op.decode('utf-8') for id, op in changes.items()}
+
+
+def queue_index_changes(index, changes):
+    """Queue ``{id: 'add' | 'remove'}`` changes for the indexing worker.
+
+    Changes to the same id are coalesced, the last one wins. A worker job is
+    enqueued only if none is waiting already. Returns ``False`` if the
+    changes could not be queued.
+    """
+    try:
+        pipe = current_app.redis.pipeline()
+        pipe.hset(_pending_key(index), mapping=changes)
+        pipe.set(_pending_since_key(index), time(), nx=True)
+        pipe.set(_scheduled_key(index), 1, nx=True, ex=3600)
+        scheduled = pipe.execute()[2]
+        if scheduled:
+            current_app.task_queue.enqueue('app.tasks.apply_index_changes',
+                                           index)
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not queue search index changes',
+                                   exc_info=True)
+        return False
+    return True
+
+
+def take_index_changes(index):
+    """Atomically remove and return the queued ``(add_ids, remove_ids)``."""
+    pipe = current_app.redis.pipeline()
+    # clear the scheduled flag first, so that changes queued while this batch
+    # is applied get a job of their own
+    pipe.delete(_scheduled_key(index))
+    pipe.hgetall(_pending_key(index))
+    pipe.delete(_pending_key(index), _pending_since_key(index))
+    changes = pipe.execute()[1]
+    add_ids = [int(id) for id, op in changes.items() if op == b'add']
+    remove_ids = [int(id) for id, op in changes.items() if op == b'remove']
+    return add_ids, remove_ids
+
+
+def requeue_index_changes(index, changes):
+    """Queue ``{id: 'add' | 'remove'}`` changes that failed to apply again.
+
+    They are applied by the retry that :func:`schedule_index_retry`
+    schedules, or else along with the next changes. Changes queued for the
+    same ids since take precedence.
+    """
+    try:
+        pipe = current_app.redis.pipeline()
+        for id, op in changes.items():
+            pipe.hsetnx(_pending_key(index), id, op)
+        pipe.set(_pending_since_key(index), time(), nx=True)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not queue failed search index '
+                                   'changes again', exc_info=True)
+
+
+def schedule_index_retry(index, attempt):
+    """Apply the queued changes of ``index`` again after a delay.
+
+    The delay doubles with each attempt. Returns ``False`` once
+    ``SEARCH_RETRY_LIMIT`` attempts were made, so that a document that keeps
+    failing is not retried in a loop.
+    """
+    if attempt >= current_app.config['SEARCH_RETRY_LIMIT']:
+        return False
+    delay = current_app.config['SEARCH_RETRY_DELAY'] * 2 ** attempt
+    try:
+        current_app.task_queue.enqueue_in(
+            timedelta(seconds=delay), 'app.tasks.apply_index_changes', index,
+            attempt + 1)
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not schedule a search index retry',
+                                   exc_info=True)
+        return False
+    return True
+
+
+def unschedule_index_changes(index):
+    """Let the next queued change schedule a job again."""
+    try:
+        current_app.redis.delete(_scheduled_key(index))
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not clear the search index job '
+                                   'flag', exc_info=True)
+
+
+def index_lag(index):
+    """Return ``(pending, seconds)`` for changes not yet applied."""
+    pipe = current_app.redis.pipeline()
+    pipe.hlen(_pending_key(index))
+    pipe.get(_pending_since_key(index))
+    pending, since = pipe.execute()
+    return pending, time() - float(since) if since else 0.0
+
+
+def invalidate_search_results(index):
+    """Make all cached results of ``index`` stale.
+
+    Results are cached under the index's generation number, so moving to a
+    new generation invalidates them all at once. The old entries are left to
+    expire.
+    """
+    if not current_app.config['SEARCH_CACHE_TTL']:
         return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+    try:
+        current_app.redis.incr(_generation_key(index))
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not invalidate cached search '
+                                   'results', exc_info=True)
 
 
-def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
+def query_index(index, query, page, per_page, fields=None):
+    backend = current_app.search_backend
+    if not backend:
         return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        body={'query': {'multi_match': {'query': query, 'fields': ['*']}},
-              'from': (page - 1) * per_page, 'size': per_page})
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+    ttl = current_app.config['SEARCH_CACHE_TTL']
+    if not ttl:
+        return backend.query(index, query, page, per_page, fields)
+    try:
+        generation = int(current_app.redis.get(_generation_key(index)) or 0)
+        key = _results_key(index, generation, query, page, per_page)
+        cached = current_app.redis.get(key)
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Search result cache unavailable',
+                                   exc_info=True)
+        return backend.query(index, query, page, per_page, fields)
+    if cached is not None:
+        results = json.loads(cached)
+        return results['ids'], results['total']
+    ids, total = backend.query(index, query, page, per_page, fields)
+    try:
+        current_app.redis.setex(key, ttl, json.dumps({'ids': ids,
+                                                      'total': total}))
+    except redis.exceptions.RedisError:
+        pass
+    return ids, total
+
+
+def query_index_after(index, query, per_page, cursor=None, fields=None):
+    """Return the ids of the page at ``cursor`` and the next page's cursor.
+
+    The first page is served by :func:`query_index`, so it is shared with
+    the result cache. Only when the next page is requested is a point in
+    time opened, which later pages are fetched from with ``search_after``,
+    so every page costs the same and results do not shift while they are
+    browsed. The point in time is closed on the last page. Cursors that
+    cannot be decoded raise ``ValueError``.
+    """
+    backend = current_app.search_backend
+    if not backend:
+        return [], None
+    if not cursor:
+        ids, total = query_index(index, query, 1, per_page, fields)
+        if total <= per_page:
+            return ids, None
+        return ids, pack_cursor({'o': per_page})
+    payload = unpack_cursor(cursor)
+    after = pit = None
+    offset = 0
+    if isinstance(payload, dict) and 'o' in payload:
+        # the second page, which starts the point in time
+        offset = payload['o']
+        if type(offset) is not int or offset <= 0:
+            raise ValueError('invalid cursor')
+    else:
+        try:
+            after, pit = payload['a'], payload.get('p')
+        except (AttributeError, KeyError, TypeError):
+            raise ValueError('invalid cursor')
+        if not isinstance(after, list) or len(after) != 2:
+            raise ValueError('invalid cursor')
+    ids, after, pit = backend.query_after(index, query, per_page, after, pit,
+                                          fields, offset)
+    if after is None:
+        return ids, None
+    return ids, pack_cursor({'a': after, 'p': pit})
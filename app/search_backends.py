@@ -0,0 +1,237 @@
+from abc import ABC, abstractmethod
+import re
+import sqlite3
+import threading
+from elasticsearch import NotFoundError
+
+BULK_CHUNK_SIZE = 500
+PIT_KEEP_ALIVE = '5m'
+SORT = [{'_score': 'desc'}, {'id': {'order': 'asc', 'unmapped_type': 'long'}}]
+
+
+class SearchBackend(ABC):
+    """Interface of the full-text engines behind ``app.search``.
+
+    Documents are dicts of the model's ``__searchable__`` fields and are
+    identified by the model's primary key. Implementations must be safe to
+    use from several threads.
+    """
+
+    @abstractmethod
+    def add(self, index, id, document):
+        pass
+
+    @abstractmethod
+    def remove(self, index, id):
+        pass
+
+    def bulk(self, index, documents, remove_ids=()):
+        """Apply ``(id, document)`` pairs and deletions, return the ids of
+        those that failed."""
+        for id, document in documents:
+            self.add(index, id, document)
+        for id in remove_ids:
+            self.remove(index, id)
+        return []
+
+    @abstractmethod
+    def query(self, index, query, page, per_page, fields=None):
+        """Return the ids of one page of matches and the total matches."""
+
+    @abstractmethod
+    def query_after(self, index, query, per_page, after=None, pit=None,
+                    fields=None, offset=0):
+        """Return the page of matches that follows the ``after`` sort key.
+
+        Matches are sorted by relevance and then id, like the pages of
+        :meth:`query`. Without ``after`` the page starts ``offset`` matches
+        in. Returns the ids, the sort key to pass as ``after`` for the next
+        page, or ``None`` on the last page, and a backend specific snapshot
+        id to pass as ``pit``.
+        """
+
+
+class ElasticsearchBackend(SearchBackend):
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, index, id, document):
+        self.client.index(index=index, id=id, body=dict(document, id=id))
+
+    def remove(self, index, id):
+        self.client.delete(index=index, id=id)
+
+    def bulk(self, index, documents, remove_ids=()):
+        # the id is stored as a field too, as the tiebreaker of search_after.
+        # Deleting a document that is not in the index is not a failure.
+        actions = [({'index': {'_index': index, '_id': id}},
+                    dict(document, id=id)) for id, document in documents]
+        actions.extend(({'delete': {'_index': index, '_id': id}}, None)
+                       for id in remove_ids)
+        failed = []
+        for start in range(0, len(actions), BULK_CHUNK_SIZE):
+            body = []
+            for action, document in actions[start:start + BULK_CHUNK_SIZE]:
+                body.append(action)
+                if document is not None:
+                    body.append(document)
+            response = self.client.bulk(body=body)
+            if response.get('errors'):
+                for item in response['items']:
+                    result = next(iter(item.values()))
+                    if result.get('status', 200) >= 300 and \
+                            not ('delete' in item and result['status'] == 404):
+                        failed.append(int(result['_id']))
+        return failed
+
+    @staticmethod
+    def _match(query, fields):
+        return {'multi_match': {'query': query,
+                                'fields': list(fields or ['*'])}}
+
+    def query(self, index, query, page, per_page, fields=None):
+        # sorted like query_after, so that the following pages continue
+        # where a page of this query ends
+        search = self.client.search(
+            index=index,
+            body={'query': self._match(query, fields), 'sort': SORT,
+                  'from': (page - 1) * per_page, 'size': per_page})
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        return ids, search['hits']['total']['value']
+
+    def query_after(self, index, query, per_page, after=None, pit=None,
+                    fields=None, offset=0):
+        body = {'query': self._match(query, fields), 'size': per_page + 1,
+                'sort': SORT, 'track_total_hits': False}
+        if after is not None:
+            body['search_after'] = after
+        elif offset:
+            body['from'] = offset
+        if pit is None:
+            pit = self.client.open_point_in_time(
+                index=index, keep_alive=PIT_KEEP_ALIVE)['id']
+        body['pit'] = {'id': pit, 'keep_alive': PIT_KEEP_ALIVE}
+        try:
+            search = self.client.search(body=body)
+        except NotFoundError:
+            # the point in time expired; continue from the same sort key in
+            # a fresh one
+            body['pit']['id'] = self.client.open_point_in_time(
+                index=index, keep_alive=PIT_KEEP_ALIVE)['id']
+            search = self.client.search(body=body)
+        pit = search.get('pit_id', body['pit']['id'])
+        hits = search['hits']['hits']
+        ids = [int(hit['_id']) for hit in hits[:per_page]]
+        if len(hits) <= per_page:
+            self.client.close_point_in_time(body={'id': pit})
+            return ids, None, None
+        return ids, hits[per_page - 1]['sort'], pit
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """Embedded engine that keeps one SQLite FTS5 table per index.
+
+    Matches are ranked with BM25. Like the Elasticsearch ``multi_match``
+    query it replaces, any word of the query can match any searchable field.
+    The database is a single file, so it suits one-node deployments, where
+    the web and task worker processes share it; ``:memory:`` keeps it in
+    process, for tests.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._tables = set()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30,
+                                         check_same_thread=False)
+            if self.path != ':memory:':
+                # lets readers in other processes run while one writes
+                self._conn.execute('PRAGMA journal_mode=WAL')
+        return self._conn
+
+    def _table(self, conn, index):
+        if not re.fullmatch(r'\w+', index):
+            raise ValueError('invalid index name: ' + index)
+        if index not in self._tables:
+            conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS "{}" USING '
+                         'fts5(content)'.format(index))
+            self._tables.add(index)
+        return '"{}"'.format(index)
+
+    @staticmethod
+    def _content(document):
+        return '\n'.join(str(value) for value in document.values()
+                         if value is not None)
+
+    def add(self, index, id, document):
+        self.bulk(index, [(id, document)])
+
+    def remove(self, index, id):
+        self.bulk(index, [], [id])
+
+    def bulk(self, index, documents, remove_ids=()):
+        with self._lock:
+            conn = self._connect()
+            table = self._table(conn, index)
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO {}(rowid, content) '
+                    'VALUES (?, ?)'.format(table),
+                    [(id, self._content(document))
+                     for id, document in documents])
+                conn.executemany(
+                    'DELETE FROM {} WHERE rowid = ?'.format(table),
+                    [(id,) for id in remove_ids])
+        return []
+
+    @staticmethod
+    def _match(query):
+        # every word is quoted, so that the user's input is never parsed as
+        # FTS5 query syntax
+        words = re.findall(r'\w+', query)
+        return ' OR '.join('"{}"'.format(word) for word in words)
+
+    def query(self, index, query, page, per_page, fields=None):
+        match = self._match(query)
+        if not match:
+            return [], 0
+        with self._lock:
+            conn = self._connect()
+            table = self._table(conn, index)
+            total = conn.execute(
+                'SELECT count(*) FROM {0} WHERE {0} MATCH ?'.format(table),
+                (match,)).fetchone()[0]
+            rows = conn.execute(
+                'SELECT rowid FROM {0} WHERE {0} MATCH ? '
+                'ORDER BY bm25({0}), rowid LIMIT ? OFFSET ?'.format(table),
+                (match, per_page, (page - 1) * per_page)).fetchall()
+        return [row[0] for row in rows], total
+
+    def query_after(self, index, query, per_page, after=None, pit=None,
+                    fields=None, offset=0):
+        # a keyset range on (rank, rowid) instead of an OFFSET, so a deep
+        # page costs the same as the first one
+        match = self._match(query)
+        if not match:
+            return [], None, None
+        where = '{0} MATCH ?'
+        params = [match]
+        if after is not None:
+            where += ' AND (bm25({0}) > ? OR (bm25({0}) = ? AND rowid > ?))'
+            params += [after[0], after[0], after[1]]
+        with self._lock:
+            conn = self._connect()
+            table = self._table(conn, index)
+            rows = conn.execute(
+                ('SELECT rowid, bm25({0}) FROM {0} WHERE ' + where +
+                 ' ORDER BY bm25({0}), rowid LIMIT ? OFFSET ?').format(table),
+                params + [per_page + 1, 0 if after else offset]).fetchall()
+        ids = [row[0] for row in rows[:per_page]]
+        if len(rows) <= per_page:
+            return ids, None, None
+        last_id, last_rank = rows[per_page - 1]
+        return ids, [last_rank, last_id], None
@@ -1,51 +1,121 @@
-import json
+import io
+import os
 import sys
-import time
 from flask import render_template
 from rq import get_current_job
 from app import create_app, db
-from app.models import User, Post, Task
+from app.models import User, Task, SearchableMixin
+from app.counters import reconcile_unread_counters as reconcile_unread
 from app.email import send_email
+from app.export import Throttle, export_user_posts, store_export
+from app.imports import import_user_posts, parse_posts
+from app.progress import ProgressReporter
+from app.retention import prune_exports, prune_notifications
 
 app = create_app()
 app.app_context().push()
 
 
-def _set_task_progress(progress):
+def _progress_reporter():
     job = get_current_job()
-    if job:
-        job.meta['progress'] = progress
-        job.save_meta()
-        task = Task.query.get(job.get_id())
-        task.user.add_notification('task_progress', {'task_id': job.get_id(),
-                                                     'progress': progress})
-        if progress >= 100:
-            task.complete = True
-        db.session.commit()
-
-
-def export_posts(user_id):
+    task = Task.query.get(job.get_id()) if job else None
+    return ProgressReporter(task, app.redis,
+                            app.config['TASK_PROGRESS_INTERVAL'])
+
+
+def apply_index_changes(index, attempt=0):
+    model = SearchableMixin.searchable_models()[index]
+    failed = model.apply_index_changes(attempt)
+    if failed:
+        app.logger.error('%d search index changes failed for %s', failed,
+                         index)
+
+
+def flush_last_seen():
+    flushed = app.last_seen.flush()
+    app.logger.info('Flushed last_seen of %d users', flushed)
+
+
+def compact_notifications(batch_size=1000):
+    deleted = sum(prune_notifications(app.config['NOTIFICATIONS_MAX_AGE'],
+                                      batch_size))
+    app.logger.info('Pruned %d stale notifications', deleted)
+
+
+def expire_exports():
+    deleted = prune_exports(app.config['EXPORT_DIR'],
+                            app.config['EXPORT_MAX_AGE'])
+    app.logger.info('Deleted %d expired exports', deleted)
+
+
+def reconcile_unread_counters(batch_size=1000):
+    checked = repaired = 0
+    for batch_checked, batch_repaired in reconcile_unread(batch_size):
+        checked += batch_checked
+        repaired += batch_repaired
+    app.logger.info('Checked %d unread counters, repaired %d', checked,
+                    repaired)
+
+
+def export_posts(user_id, token, download_url, fmt='json', compress=False):
+    reporter = _progress_reporter()
     try:
         user = User.query.get(user_id)
-        _set_task_progress(0)
-        data = []
-        i = 0
-        total_posts = user.posts.count()
-        for post in user.posts.order_by(Post.timestamp.asc()):
-            data.append({'body': post.body,
-                         'timestamp': post.timestamp.isoformat() + 'Z'})
-            time.sleep(5)
-            i += 1
-            _set_task_progress(100 * i // total_posts)
+        reporter.update(0)
+        total = user.post_count or 1
+
+        def progress(done):
+            # 100 is only reported once the email is on its way
+            reporter.update(min(100 * done // total, 99))
 
+        export, filename, content_type = export_user_posts(
+            user, fmt, compress, Throttle(
+                progress, app.config['EXPORT_PROGRESS_ROWS'],
+                app.config['EXPORT_PROGRESS_INTERVAL']))
+        with export:
+            # linked rather than attached, which would need the whole export
+            # in memory
+            store_export(export, app.config['EXPORT_DIR'], user.id, token,
+                         filename)
+        days = max(app.config['EXPORT_MAX_AGE'] // (24 * 3600), 1)
         send_email('[Microblog] Your blog posts',
                 sender=app.config['ADMINS'][0], recipients=[user.email],
-                text_body=render_template('email/export_posts.txt', user=user),
+                text_body=render_template('email/export_posts.txt',
+                                          user=user, url=download_url,
+                                          days=days),
                 html_body=render_template('email/export_posts.html',
-                                          user=user),
-                attachments=[('posts.json', 'application/json',
-                              json.dumps({'posts': data}, indent=4))],
+                                          user=user, url=download_url,
+                                          days=days),
                 sync=True)
+        prune_exports(app.config['EXPORT_DIR'], app.config['EXPORT_MAX_AGE'])
+    except:
+        db.session.rollback()
+        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+    finally:
+        reporter.complete()
+
+
+def import_posts(user_id, path, fmt='ndjson'):
+    reporter = _progress_reporter()
+    try:
+        user = User.query.get(user_id)
+        reporter.update(0)
+        size = os.path.getsize(path) or 1
+        with open(path, 'rb') as raw:
+            # utf-8-sig skips the byte order mark spreadsheets tend to add
+            f = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+            def progress(done):
+                reporter.update(min(100 * raw.tell() // size, 99))
+
+            imported, skipped = import_user_posts(
+                user, parse_posts(f, fmt), app.config['IMPORT_BATCH_SIZE'],
+                progress)
+        app.logger.info('Imported %d posts for user %s, skipped %d',
+                        imported, user_id, skipped)
     except:
-        _set_task_progress(100)
+        db.session.rollback()
         app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+    finally:
+        reporter.complete()
+        os.remove(path)
@@ -0,0 +1,296 @@
+from datetime import datetime
+import redis
+from flask import current_app
+from app import db
+from app.models import Post, followers
+from app.pagination import CursorPagination, NEXT, decode_cursor, \
+    keyset_filter, paginate_cursor
+
+EPOCH = datetime(1970, 1, 1)
+CELEBRITIES_KEY = 'timeline:celebrities'
+# placeholder member that marks a cached timeline as built but empty
+EMPTY_MARKER = b'-'
+CURSOR_COLUMNS = [Post.timestamp, Post.id]
+
+
+def _key(user_id):
+    return 'timeline:{}'.format(user_id)
+
+
+def _score(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+def _enabled():
+    return current_app.config['TIMELINE_CACHE']
+
+
+def _celebrity_ids():
+    return {int(i) for i in current_app.redis.smembers(CELEBRITIES_KEY)}
+
+
+def _followed_ids_query(user):
+    return db.session.query(followers.c.followed_id).filter(
+        followers.c.follower_id == user.id)
+
+
+def fan_out(post):
+    """Push a new post into the cached timelines of the author's followers.
+
+    Authors with more than ``TIMELINE_FANOUT_LIMIT`` followers are only
+    recorded as celebrities; their posts are merged in at read time instead.
+    Timelines that are not cached are left alone and get rebuilt on the next
+    read. Cached timelines can still hold posts fanned out before the author
+    became a celebrity, so reads drop duplicates.
+    """
+    if not _enabled():
+        return
+    author_id = post.user_id
+    try:
+        if post.author.follower_count > \
+                current_app.config['TIMELINE_FANOUT_LIMIT']:
+            current_app.redis.sadd(CELEBRITIES_KEY, author_id)
+            recipients = [author_id]
+        else:
+            update_celebrity(post.author)
+            recipients = [author_id] + [
+                row.follower_id for row in db.session.query(
+                    followers.c.follower_id).filter(
+                        followers.c.followed_id == author_id)]
+        pipe = current_app.redis.pipeline(transaction=False)
+        for user_id in recipients:
+            pipe.exists(_key(user_id))
+        cached = [user_id for user_id, exists in zip(recipients, pipe.execute())
+                  if exists]
+        max_length = current_app.config['TIMELINE_MAX_LENGTH']
+        for user_id in cached:
+            pipe.zadd(_key(user_id), {post.id: _score(post.timestamp)})
+            pipe.zrem(_key(user_id), EMPTY_MARKER)
+            pipe.zremrangebyrank(_key(user_id), 0, -(max_length + 1))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Timeline fan-out failed for post %s',
+                                   post.id, exc_info=True)
+
+
+def update_celebrity(author):
+    """Stop treating the author as a celebrity once their follower count
+    has dropped to ``TIMELINE_FANOUT_LIMIT``.
+
+    Their older posts were never fanned out, so the cached timelines of
+    their followers are dropped and get rebuilt with them on the next read.
+    """
+    if not _enabled() or author.follower_count > \
+            current_app.config['TIMELINE_FANOUT_LIMIT']:
+        return
+    try:
+        demoted = current_app.redis.srem(CELEBRITIES_KEY, author.id)
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not update the celebrity status of '
+                                   'user %s', author.id, exc_info=True)
+        return
+    if demoted:
+        invalidate_follower_timelines(author)
+
+
+def invalidate_timeline(user):
+    """Drop a cached timeline, e.g. after the user follows someone new."""
+    if not _enabled():
+        return
+    try:
+        current_app.redis.delete(_key(user.id))
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not invalidate timeline of user %s',
+                                   user.id, exc_info=True)
+
+
+def invalidate_follower_timelines(author):
+    """Drop the cached timelines that hold the author's posts.
+
+    Used when posts are added in bulk rather than fanned out one by one.
+    The posts of celebrities are merged at read time, so only their own
+    timeline is dropped.
+    """
+    if not _enabled():
+        return
+    user_ids = [author.id]
+    if author.follower_count <= current_app.config['TIMELINE_FANOUT_LIMIT']:
+        user_ids += [row.follower_id for row in db.session.query(
+            followers.c.follower_id).filter(
+                followers.c.followed_id == author.id)]
+    try:
+        current_app.redis.delete(*[_key(user_id) for user_id in user_ids])
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not invalidate the timelines of '
+                                   'the followers of user %s', author.id,
+                                   exc_info=True)
+
+
+def rebuild_timeline(user, celebrity_ids=None):
+    """Repopulate a cached timeline from SQL and return its entries.
+
+    The entries are ``(post_id, score)`` tuples, newest first. Posts by
+    celebrities are left out since they are merged at read time.
+    """
+    if celebrity_ids is None:
+        celebrity_ids = _celebrity_ids()
+    celebrity_ids = celebrity_ids - {user.id}
+    query = db.session.query(Post.id, Post.timestamp).filter(db.or_(
+        Post.user_id == user.id,
+        Post.user_id.in_(_followed_ids_query(user))))
+    if celebrity_ids:
+        query = query.filter(Post.user_id.notin_(celebrity_ids))
+    rows = query.order_by(Post.timestamp.desc(), Post.id.desc()).limit(
+        current_app.config['TIMELINE_MAX_LENGTH']).all()
+    entries = [(row.id, _score(row.timestamp)) for row in rows]
+    pipe = current_app.redis.pipeline()
+    pipe.delete(_key(user.id))
+    if entries:
+        pipe.zadd(_key(user.id), {post_id: score for post_id, score in entries})
+    else:
+        pipe.zadd(_key(user.id), {EMPTY_MARKER: 0})
+    pipe.expire(_key(user.id), current_app.config['TIMELINE_TTL'])
+    pipe.execute()
+    return entries
+
+
+def _sql_page(user, page, per_page):
+    posts = user.followed_posts().offset((page - 1) * per_page).limit(
+        per_page + 1).all()
+    return posts[:per_page], len(posts) > per_page
+
+
+def _cached_page(user, page, per_page):
+    stop = page * per_page
+    if stop >= current_app.config['TIMELINE_MAX_LENGTH']:
+        # pages past the end of the bounded cache are only available in SQL
+        return _sql_page(user, page, per_page)
+
+    pipe = current_app.redis.pipeline(transaction=False)
+    pipe.exists(_key(user.id))
+    pipe.zrevrange(_key(user.id), 0, stop, withscores=True)
+    pipe.expire(_key(user.id), current_app.config['TIMELINE_TTL'])
+    pipe.smembers(CELEBRITIES_KEY)
+    exists, entries, _, celebrity_ids = pipe.execute()
+    celebrity_ids = {int(i) for i in celebrity_ids} - {user.id}
+    if exists:
+        entries = [(int(member), score) for member, score in entries
+                   if member != EMPTY_MARKER]
+    else:
+        entries = rebuild_timeline(user, celebrity_ids)[:stop + 1]
+
+    if celebrity_ids:
+        followed_celebrities = [row.followed_id for row in _followed_ids_query(
+            user).filter(followers.c.followed_id.in_(celebrity_ids))]
+        if followed_celebrities:
+            rows = db.session.query(Post.id, Post.timestamp).filter(
+                Post.user_id.in_(followed_celebrities)).order_by(
+                    Post.timestamp.desc(), Post.id.desc()).limit(stop + 1)
+            entries.extend((row.id, _score(row.timestamp)) for row in rows)
+            entries = sorted(set(entries),
+                             key=lambda entry: (entry[1], entry[0]),
+                             reverse=True)
+
+    ids = [post_id for post_id, _ in entries[(page - 1) * per_page:stop]]
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_(ids))} \
+        if ids else {}
+    return [posts[i] for i in ids if i in posts], len(entries) > stop
+
+
+def followed_posts_page(user, page, per_page):
+    """Return one page of the user's home timeline as ``(posts, has_next)``.
+
+    Pages are served from the Redis timeline cache when it is enabled, and
+    from :meth:`User.followed_posts` otherwise or when Redis is unavailable.
+    """
+    if _enabled():
+        try:
+            return _cached_page(user, page, per_page)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Timeline cache unavailable, using SQL',
+                                       exc_info=True)
+    return _sql_page(user, page, per_page)
+
+
+def _cached_cursor_page(user, per_page, cursor):
+    values, direction = decode_cursor(cursor, CURSOR_COLUMNS)
+    key = _key(user.id)
+    pipe = current_app.redis.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.zcard(key)
+    pipe.expire(key, current_app.config['TIMELINE_TTL'])
+    pipe.smembers(CELEBRITIES_KEY)
+    exists, size, _, celebrity_ids = pipe.execute()
+    celebrity_ids = {int(i) for i in celebrity_ids} - {user.id}
+    if not exists:
+        size = len(rebuild_timeline(user, celebrity_ids))
+
+    if values is None:
+        raw = current_app.redis.zrevrange(key, 0, per_page, withscores=True)
+    else:
+        score = _score(values[0])
+        # entries sharing the cursor's score are ordered by id below, so
+        # fetch enough of them to cover every tie
+        count = per_page + 1 + current_app.redis.zcount(key, score, score)
+        if direction == NEXT:
+            raw = current_app.redis.zrevrangebyscore(
+                key, score, '-inf', start=0, num=count, withscores=True)
+        else:
+            raw = current_app.redis.zrangebyscore(
+                key, score, '+inf', start=0, num=count, withscores=True)
+    entries = [(score, int(member)) for member, score in raw
+               if member != EMPTY_MARKER]
+    if values is not None:
+        bound = (_score(values[0]), values[1])
+        entries = [entry for entry in entries
+                   if (entry < bound if direction == NEXT else entry > bound)]
+
+    if celebrity_ids:
+        followed_celebrities = [row.followed_id for row in _followed_ids_query(
+            user).filter(followers.c.followed_id.in_(celebrity_ids))]
+        if followed_celebrities:
+            query = db.session.query(Post.id, Post.timestamp).filter(
+                Post.user_id.in_(followed_celebrities))
+            if values is not None:
+                query = query.filter(
+                    keyset_filter(CURSOR_COLUMNS, values, direction))
+            order = [Post.timestamp.desc(), Post.id.desc()] \
+                if direction == NEXT else [Post.timestamp, Post.id]
+            entries.extend((_score(row.timestamp), row.id)
+                           for row in query.order_by(*order).limit(
+                               per_page + 1))
+    entries = sorted(set(entries), reverse=direction == NEXT)
+
+    has_more = len(entries) > per_page
+    if direction == NEXT and not has_more and \
+            size >= current_app.config['TIMELINE_MAX_LENGTH']:
+        # reached the end of a full cache, older posts are only in SQL
+        return paginate_cursor(user.followed_posts(), CURSOR_COLUMNS,
+                               per_page, cursor)
+    ids = [post_id for _, post_id in entries[:per_page]]
+    if direction != NEXT:
+        ids.reverse()
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_(ids))} \
+        if ids else {}
+    items = [posts[i] for i in ids if i in posts]
+    if direction == NEXT:
+        return CursorPagination(items, CURSOR_COLUMNS, has_next=has_more,
+                                has_prev=values is not None)
+    return CursorPagination(items, CURSOR_COLUMNS, has_next=True,
+                            has_prev=has_more)
+
+
+def followed_posts_cursor(user, per_page, cursor=None):
+    """Return one page of the home timeline as a :class:`CursorPagination`.
+
+    Like :func:`followed_posts_page`, but positioned with a ``(timestamp, id)``
+    cursor so every page costs the same regardless of its depth.
+    """
+    if _enabled():
+        try:
+            return _cached_cursor_page(user, per_page, cursor)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Timeline cache unavailable, using SQL',
+                                       exc_info=True)
+    return paginate_cursor(user.followed_posts(), CURSOR_COLUMNS, per_page,
+                           cursor)
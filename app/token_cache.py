@@ -0,0 +1,151 @@
+from datetime import datetime
+from hashlib import sha256
+import json
+from time import time
+import redis
+from flask import current_app
+from app.cache import TTLCache
+
+
+# revoked token digests scored by the time of the revocation
+REVOKED_KEY = 'token:revoked'
+
+
+def _digest(token):
+    # tokens are credentials, so only their digest is kept
+    return sha256(token.encode('utf-8')).hexdigest()
+
+
+def _redis_key(digest):
+    return 'token:' + digest
+
+
+def _encode(values):
+    return json.dumps({key: value.isoformat() if isinstance(value, datetime)
+                       else value for key, value in values.items()})
+
+
+def _decode(data, datetime_fields):
+    values = json.loads(data)
+    for key in datetime_fields:
+        if values.get(key) is not None:
+            values[key] = datetime.fromisoformat(values[key])
+    return values
+
+
+class TokenCache(object):
+    """Cache of verified API tokens and the user columns they resolve to.
+
+    Lookups go to an in-process LRU first and then, if configured, to a Redis
+    layer that is shared by all workers. Entries never outlive the token's
+    expiration. Invalidated tokens are added to a set of revocations in
+    Redis, which each worker reads at most every ``revocation_poll``
+    seconds, so that a token revoked in one worker stops being accepted from
+    the LRU of another within that time, without a Redis call per hit.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, connection=None,
+                 revocation_poll=1):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.redis = connection
+        self.revocation_poll = revocation_poll
+        self.revoked = set()
+        self.revocations_read_at = None
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    def get(self, token, datetime_fields=()):
+        digest = _digest(token)
+        if not self._read_revocations() or digest in self.revoked:
+            return None
+        values = self.local.get(digest)
+        if values is not None:
+            return values
+        if self.redis is None:
+            return None
+        try:
+            data = self.redis.get(_redis_key(digest))
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Token cache unavailable in Redis',
+                                       exc_info=True)
+            return None
+        if data is None:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        values = _decode(data, datetime_fields)
+        self.local.set(digest, values, self._ttl(values))
+        return values
+
+    def set(self, token, values):
+        digest = _digest(token)
+        ttl = self._ttl(values)
+        if ttl <= 0 or digest in self.revoked:
+            return
+        self.local.set(digest, values, ttl)
+        if self.redis is not None:
+            try:
+                self.redis.setex(_redis_key(digest), int(ttl) or 1,
+                                 _encode(values))
+            except redis.exceptions.RedisError:
+                current_app.logger.warning('Token cache unavailable in Redis',
+                                           exc_info=True)
+
+    def invalidate(self, token):
+        digest = _digest(token)
+        self.local.delete(digest)
+        self.revoked.add(digest)
+        now = time()
+        try:
+            # kept for twice the TTL, to also cover entries cached by other
+            # workers while the revocation was being committed
+            pipe = current_app.redis.pipeline()
+            pipe.zadd(REVOKED_KEY, {digest: now})
+            pipe.zremrangebyscore(REVOKED_KEY, '-inf', now - 2 * self.ttl)
+            pipe.expire(REVOKED_KEY, 2 * self.ttl)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Could not record token revocation',
+                                       exc_info=True)
+        if self.redis is not None:
+            try:
+                self.redis.delete(_redis_key(digest))
+            except redis.exceptions.RedisError:
+                current_app.logger.warning('Token cache unavailable in Redis',
+                                           exc_info=True)
+
+    def _read_revocations(self):
+        """Refresh the set of revoked digests if it is due.
+
+        Returns False if it could not be read, in which case no cached entry
+        can be trusted and tokens are checked against the database.
+        """
+        now = time()
+        if self.revocations_read_at is not None and \
+                now - self.revocations_read_at < self.revocation_poll:
+            return True
+        try:
+            revoked = current_app.redis.zrangebyscore(
+                REVOKED_KEY, now - 2 * self.ttl, '+inf')
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Token revocations unavailable in '
+                                       'Redis', exc_info=True)
+            return False
+        self.revoked = {digest.decode('utf-8') for digest in revoked}
+        self.revocations_read_at = now
+        for digest in self.revoked:
+            self.local.delete(digest)
+        return True
+
+    def _ttl(self, values):
+        remaining = (values['token_expiration'] -
+                     datetime.utcnow()).total_seconds()
+        return min(self.ttl, remaining)
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['redis'] = self.redis is not None
+        stats['redis_hits'] = self.redis_hits
+        stats['redis_misses'] = self.redis_misses
+        return stats
@@ -1,21 +1,92 @@
-import json
 import requests
 from flask import current_app
 from flask_babel import _
+from app.translation_cache import TranslationError
 
+# limits of a single request to the Microsoft Translator API
+MAX_BATCH_ELEMENTS = 1000
+MAX_BATCH_CHARACTERS = 50000
 
-def translate(text, source_language, dest_language):
-    if 'MS_TRANSLATOR_KEY' not in current_app.config or \
-            not current_app.config['MS_TRANSLATOR_KEY']:
-        return _('Error: the translation service is not configured.')
+
+def _configured():
+    return 'MS_TRANSLATOR_KEY' in current_app.config and \
+        current_app.config['MS_TRANSLATOR_KEY']
+
+
+def _request(texts, source_language, dest_language):
+    """Translate a list of texts with one request to the translator."""
     auth = {
         'Ocp-Apim-Subscription-Key': current_app.config['MS_TRANSLATOR_KEY'],
         'Ocp-Apim-Subscription-Region': 'westus2'}
-    r = requests.post(
-        'https://api.cognitive.microsofttranslator.com'
-        '/translate?api-version=3.0&from={}&to={}'.format(
-            source_language, dest_language), headers=auth, json=[
-                {'Text': text}])
+    url = current_app.config['MS_TRANSLATOR_URL'] + \
+        '/translate?api-version=3.0&to={}'.format(dest_language)
+    if source_language:
+        url += '&from={}'.format(source_language)
+    try:
+        r = current_app.http.post(url, headers=auth,
+                                  json=[{'Text': text} for text in texts])
+    except requests.RequestException as e:
+        raise TranslationError(str(e))
     if r.status_code != 200:
+        raise TranslationError('status {}'.format(r.status_code))
+    return [item['translations'][0]['text'] for item in r.json()]
+
+
+def _batches(texts):
+    batch, size = [], 0
+    for text in texts:
+        if batch and (len(batch) >= MAX_BATCH_ELEMENTS or
+                      size + len(text) > MAX_BATCH_CHARACTERS):
+            yield batch
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text)
+    if batch:
+        yield batch
+
+
+def translate(text, source_language, dest_language):
+    if not _configured():
+        return _('Error: the translation service is not configured.')
+    try:
+        return current_app.translation_cache.translate(
+            text, source_language, dest_language,
+            lambda: _request([text], source_language, dest_language)[0])
+    except TranslationError:
         return _('Error: the translation service failed.')
-    return r.json()[0]['translations'][0]['text']
+
+
+def translate_batch(texts, dest_language):
+    """Translate a list of ``(text, source_language)`` pairs.
+
+    Returns the translations in the same order, with an error message in
+    place of each one that failed. Cached translations are used where
+    possible; the rest are grouped by source language and sent in as few
+    requests as the translator's size limits allow.
+    """
+    if not _configured():
+        return [_('Error: the translation service is not configured.')] * \
+            len(texts)
+    cache = current_app.translation_cache
+    values = {}
+    missing = {}
+    for text, source_language in texts:
+        if (text, source_language) in values:
+            continue
+        value = cache.lookup(text, source_language, dest_language)
+        values[(text, source_language)] = value
+        if value is None:
+            missing.setdefault(source_language, []).append(text)
+    for source_language, group in missing.items():
+        for batch in _batches(group):
+            try:
+                batch_values = [{'text': translation} for translation in
+                                _request(batch, source_language,
+                                         dest_language)]
+            except TranslationError as e:
+                batch_values = [{'error': str(e)}] * len(batch)
+            for text, value in zip(batch, batch_values):
+                cache.store(text, source_language, dest_language, value)
+                values[(text, source_language)] = value
+    failed = _('Error: the translation service failed.')
+    return [values[pair].get('text', failed) for pair in texts]
@@ -0,0 +1,149 @@
+from hashlib import sha256
+import json
+import threading
+from time import monotonic, sleep
+import redis
+from flask import current_app
+from app.cache import TTLCache
+
+POLL_INTERVAL = 0.05
+
+
+class TranslationError(Exception):
+    pass
+
+
+def _redis_key(text, source_language, dest_language):
+    return 'translate:' + sha256(json.dumps(
+        [text, source_language, dest_language]).encode('utf-8')).hexdigest()
+
+
+class TranslationCache(object):
+    """Two tier cache of translations.
+
+    Lookups go to an in-process LRU first and then to Redis, which is shared
+    by all workers. Failed translations are cached too, for a short time, so
+    that an outage of the translator is not hammered with retries. Concurrent
+    misses for the same text wait for a single upstream call: threads of one
+    worker wait on an event, other workers poll Redis while a lock is held.
+    """
+
+    def __init__(self, maxsize=4096, ttl=30 * 24 * 3600, failure_ttl=60,
+                 connection=None, lock_timeout=10):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.redis = connection
+        self.lock_timeout = lock_timeout
+        self.upstream_calls = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def translate(self, text, source_language, dest_language, fetch):
+        """Return the translation of ``text``, calling ``fetch()`` on a miss.
+
+        ``fetch`` raises ``TranslationError`` when the translator fails, which
+        is raised again for every lookup until the failure expires.
+        """
+        key = _redis_key(text, source_language, dest_language)
+        value = self.get(key)
+        if value is None:
+            value = self._single_flight(key, fetch)
+        if 'error' in value:
+            raise TranslationError(value['error'])
+        return value['text']
+
+    def lookup(self, text, source_language, dest_language):
+        """Return the cached ``{'text': ...}`` or ``{'error': ...}``, if any."""
+        return self.get(_redis_key(text, source_language, dest_language))
+
+    def store(self, text, source_language, dest_language, value):
+        self.set(_redis_key(text, source_language, dest_language), value)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.redis is None:
+            return value
+        try:
+            data = self.redis.get(key)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('Translation cache unavailable in '
+                                       'Redis', exc_info=True)
+            return None
+        if data is None:
+            return None
+        value = json.loads(data)
+        self.local.set(key, value, self._ttl(value))
+        return value
+
+    def set(self, key, value):
+        ttl = self._ttl(value)
+        self.local.set(key, value, ttl)
+        if self.redis is not None:
+            try:
+                self.redis.setex(key, ttl, json.dumps(value))
+            except redis.exceptions.RedisError:
+                current_app.logger.warning('Translation cache unavailable in '
+                                           'Redis', exc_info=True)
+
+    def _ttl(self, value):
+        return self.failure_ttl if 'error' in value else self.ttl
+
+    def _single_flight(self, key, fetch):
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if not leader:
+            event.wait(self.lock_timeout)
+            value = self.get(key)
+            # only fetch again if the leader did not finish in time
+            return value if value is not None else self._fetch(key, fetch)
+        try:
+            return self._fetch_once(key, fetch)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def _fetch_once(self, key, fetch):
+        if self.redis is None:
+            return self._fetch(key, fetch)
+        lock_key = key + ':lock'
+        try:
+            locked = self.redis.set(lock_key, 1, nx=True,
+                                    ex=self.lock_timeout)
+        except redis.exceptions.RedisError:
+            return self._fetch(key, fetch)
+        if not locked:
+            # another worker is translating the same text
+            deadline = monotonic() + self.lock_timeout
+            while monotonic() < deadline:
+                sleep(POLL_INTERVAL)
+                value = self.get(key)
+                if value is not None:
+                    return value
+            return self._fetch(key, fetch)
+        try:
+            return self._fetch(key, fetch)
+        finally:
+            try:
+                self.redis.delete(lock_key)
+            except redis.exceptions.RedisError:
+                pass
+
+    def _fetch(self, key, fetch):
+        self.upstream_calls += 1
+        try:
+            value = {'text': fetch()}
+        except TranslationError as e:
+            value = {'error': str(e)}
+        self.set(key, value)
+        return value
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['redis'] = self.redis is not None
+        stats['upstream_calls'] = self.upstream_calls
+        return stats
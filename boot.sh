@@ -17,6 +17,6 @@ flask translate compile
 if [[ -n "${TESTING}" && "${TESTING}" == "true" ]]; then
 	pytest -svv
 else
-	exec gunicorn -b :5000 --access-logfile - --error-logfile - microblog:app
+	exec gunicorn -k gevent -b :5000 --access-logfile - --error-logfile - microblog:app
 fi
 
@@ -20,6 +20,64 @@ class Config(object):
     ADMINS = ['your-email@example.com']
     LANGUAGES = ['en', 'es']
     MS_TRANSLATOR_KEY = os.environ.get('MS_TRANSLATOR_KEY')
+    LANGID_LANGUAGES = [language for language in (
+        os.environ.get('LANGID_LANGUAGES') or
+        'en,es,fr,de,it,pt,nl,sv,pl,tr,ru,ar,hi,ja,ko,zh-cn').split(',')
+        if language]
+    LANGID_CACHE_SIZE = int(os.environ.get('LANGID_CACHE_SIZE') or 4096)
+    MS_TRANSLATOR_URL = os.environ.get('MS_TRANSLATOR_URL') or \
+        'https://api.cognitive.microsofttranslator.com'
+    TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE') or
+                                 4096)
+    TRANSLATION_CACHE_TTL = int(os.environ.get('TRANSLATION_CACHE_TTL') or
+                                30 * 24 * 3600)
+    TRANSLATION_FAILURE_TTL = int(os.environ.get('TRANSLATION_FAILURE_TTL') or
+                                  60)
+    TRANSLATE_BATCH_LIMIT = 100
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE') or 10)
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT') or
+                                 3.05)
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT') or 10)
+    HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES') or 2)
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH') or \
+        os.path.join(basedir, 'search.db')
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
     POSTS_PER_PAGE = 25
+    TASK_PROGRESS_INTERVAL = float(
+        os.environ.get('TASK_PROGRESS_INTERVAL') or 1)
+    EXPORT_PROGRESS_ROWS = int(os.environ.get('EXPORT_PROGRESS_ROWS') or 1000)
+    EXPORT_PROGRESS_INTERVAL = float(
+        os.environ.get('EXPORT_PROGRESS_INTERVAL') or 2)
+    EXPORT_DIR = os.environ.get('EXPORT_DIR') or \
+        os.path.join(basedir, 'exports')
+    EXPORT_MAX_AGE = int(os.environ.get('EXPORT_MAX_AGE') or 2 * 24 * 3600)
+    IMPORT_UPLOAD_DIR = os.environ.get('IMPORT_UPLOAD_DIR') or \
+        os.path.join(basedir, 'uploads')
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 1000)
+    NOTIFICATIONS_STREAM_DURATION = int(
+        os.environ.get('NOTIFICATIONS_STREAM_DURATION') or 300)
+    NOTIFICATIONS_HEARTBEAT = int(
+        os.environ.get('NOTIFICATIONS_HEARTBEAT') or 15)
+    NOTIFICATIONS_LONG_POLL_TIMEOUT = int(
+        os.environ.get('NOTIFICATIONS_LONG_POLL_TIMEOUT') or 25)
+    NOTIFICATIONS_MAX_AGE = int(os.environ.get('NOTIFICATIONS_MAX_AGE') or
+                                30 * 24 * 3600)
+    TIMELINE_CACHE = os.environ.get('TIMELINE_CACHE') is not None
+    TIMELINE_MAX_LENGTH = int(os.environ.get('TIMELINE_MAX_LENGTH') or 800)
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or
+                                10000)
+    TIMELINE_TTL = int(os.environ.get('TIMELINE_TTL') or 7 * 24 * 3600)
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 1024)
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL') or 60)
+    TOKEN_CACHE_REDIS = os.environ.get('TOKEN_CACHE_REDIS') is not None
+    TOKEN_REVOCATION_POLL = float(os.environ.get('TOKEN_REVOCATION_POLL') or 1)
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or
+                                   60)
+    LAST_SEEN_FLUSH_THRESHOLD = int(
+        os.environ.get('LAST_SEEN_FLUSH_THRESHOLD') or 500)
+    LAST_SEEN_REDIS = os.environ.get('LAST_SEEN_REDIS') is not None
+    SEARCH_INDEX_SYNC = os.environ.get('SEARCH_INDEX_SYNC') is not None
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL') or 300)
+    SEARCH_RETRY_DELAY = int(os.environ.get('SEARCH_RETRY_DELAY') or 30)
+    SEARCH_RETRY_LIMIT = int(os.environ.get('SEARCH_RETRY_LIMIT') or 5)
@@ -0,0 +1,94 @@
+"""conversations
+
+Revision ID: 9e4b6c1f2a57
+Revises: 4c2f9a7d1e36
+Create Date: 2026-10-18 17:48:32.904117
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b6c1f2a57'
+down_revision = '4c2f9a7d1e36'
+branch_labels = None
+depends_on = None
+
+
+def backfill_conversations():
+    message = sa.table('message', sa.column('id'), sa.column('sender_id'),
+                       sa.column('recipient_id'), sa.column('body'),
+                       sa.column('timestamp'), sa.column('conversation_key'))
+    user = sa.table('user', sa.column('id'),
+                    sa.column('last_message_read_time'))
+    conversation = sa.table(
+        'conversation', sa.column('user_id'), sa.column('peer_id'),
+        sa.column('last_activity'), sa.column('last_sender_id'),
+        sa.column('last_body'), sa.column('unread_count'))
+    conn = op.get_bind()
+    pairs = {tuple(sorted(pair)) for pair in conn.execute(
+        sa.select(message.c.sender_id, message.c.recipient_id).distinct())}
+    last_read = dict(conn.execute(
+        sa.select(user.c.id, user.c.last_message_read_time)).fetchall())
+    for a, b in pairs:
+        key = '{}:{}'.format(a, b)
+        conn.execute(message.update().where(sa.or_(
+            sa.and_(message.c.sender_id == a, message.c.recipient_id == b),
+            sa.and_(message.c.sender_id == b, message.c.recipient_id == a)))
+            .values(conversation_key=key))
+        last = conn.execute(
+            sa.select(message.c.sender_id, message.c.body,
+                      message.c.timestamp).where(
+                message.c.conversation_key == key).order_by(
+                    message.c.timestamp.desc(), message.c.id.desc()).limit(
+                        1)).first()
+        for user_id, peer_id in {(a, b), (b, a)}:
+            unread = conn.execute(
+                sa.select(sa.func.count()).select_from(message).where(
+                    message.c.sender_id == peer_id,
+                    message.c.recipient_id == user_id,
+                    message.c.timestamp > (last_read.get(user_id) or
+                                           datetime(1900, 1, 1)))).scalar()
+            conn.execute(conversation.insert().values(
+                user_id=user_id, peer_id=peer_id,
+                last_activity=last.timestamp, last_sender_id=last.sender_id,
+                last_body=last.body, unread_count=unread))
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('conversation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('peer_id', sa.Integer(), nullable=False),
+    sa.Column('last_activity', sa.DateTime(), nullable=False),
+    sa.Column('last_sender_id', sa.Integer(), nullable=True),
+    sa.Column('last_body', sa.String(length=140), nullable=True),
+    sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['last_sender_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['peer_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_conversation_user_id_last_activity_id', 'conversation', ['user_id', 'last_activity', 'id'], unique=False)
+    op.create_index('ix_conversation_user_id_peer_id', 'conversation', ['user_id', 'peer_id'], unique=True)
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('conversation_key', sa.String(length=32), nullable=True))
+        batch_op.create_index('ix_message_conversation_key_timestamp_id', ['conversation_key', 'timestamp', 'id'], unique=False)
+
+    # ### end Alembic commands ###
+    backfill_conversations()
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_conversation_key_timestamp_id')
+        batch_op.drop_column('conversation_key')
+
+    op.drop_index('ix_conversation_user_id_peer_id', table_name='conversation')
+    op.drop_index('ix_conversation_user_id_last_activity_id', table_name='conversation')
+    op.drop_table('conversation')
+    # ### end Alembic commands ###
@@ -0,0 +1,99 @@
+"""access pattern indexes
+
+Revision ID: e3cadb85a622
+Revises: b1979da2dbf5
+Create Date: 2026-10-18 14:02:47.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3cadb85a622'
+down_revision = 'b1979da2dbf5'
+branch_labels = None
+depends_on = None
+
+
+def remove_duplicate_pairs(table_name, first, second):
+    # the association tables have no primary key, so duplicated pairs are
+    # deleted entirely and inserted back once
+    table = sa.table(table_name, sa.column(first), sa.column(second))
+    conn = op.get_bind()
+    duplicates = conn.execute(
+        sa.select(table.c[first], table.c[second]).group_by(
+            table.c[first], table.c[second]).having(
+                sa.func.count() > 1)).fetchall()
+    for a, b in duplicates:
+        conn.execute(table.delete().where(
+            table.c[first] == a, table.c[second] == b))
+        conn.execute(table.insert().values({first: a, second: b}))
+    return duplicates
+
+
+def count(table, column, value):
+    return sa.select(sa.func.count()).select_from(table).where(
+        column == value).scalar_subquery()
+
+
+def recount_follows(user_ids):
+    # the counters backfilled by b1979da2dbf5 included the duplicates
+    user = sa.table('user', sa.column('id'), sa.column('follower_count'),
+                    sa.column('followed_count'))
+    followers = sa.table('followers', sa.column('follower_id'),
+                         sa.column('followed_id'))
+    op.execute(user.update().where(user.c.id.in_(user_ids)).values(
+        follower_count=count(followers, followers.c.followed_id, user.c.id),
+        followed_count=count(followers, followers.c.follower_id, user.c.id)))
+
+
+def recount_likes(post_ids):
+    post = sa.table('post', sa.column('id'), sa.column('like_count'))
+    likes = sa.table('likes', sa.column('user_id'), sa.column('post_id'))
+    op.execute(post.update().where(post.c.id.in_(post_ids)).values(
+        like_count=count(likes, likes.c.post_id, post.c.id)))
+
+
+def remove_duplicate_favorites():
+    favorite = sa.table('favorite', sa.column('id'), sa.column('user_id'),
+                        sa.column('post_id'))
+    # wrapped in a derived table, since MySQL cannot select from the table
+    # it deletes from in a plain subquery
+    keep = sa.select(sa.func.min(favorite.c.id).label('id')).group_by(
+        favorite.c.user_id, favorite.c.post_id).subquery()
+    op.get_bind().execute(favorite.delete().where(
+        favorite.c.id.notin_(sa.select(keep.c.id))))
+
+
+def upgrade():
+    follows = remove_duplicate_pairs('followers', 'follower_id', 'followed_id')
+    if follows:
+        recount_follows(sorted({user_id for pair in follows
+                                for user_id in pair}))
+    likes = remove_duplicate_pairs('likes', 'user_id', 'post_id')
+    if likes:
+        recount_likes(sorted({post_id for _, post_id in likes}))
+    remove_duplicate_favorites()
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_index('ix_followers_follower_id_followed_id', 'followers', ['follower_id', 'followed_id'], unique=True)
+    op.create_index('ix_followers_followed_id_follower_id', 'followers', ['followed_id', 'follower_id'], unique=False)
+    op.create_index('ix_likes_user_id_post_id', 'likes', ['user_id', 'post_id'], unique=True)
+    op.create_index('ix_favorite_user_id_post_id', 'favorite', ['user_id', 'post_id'], unique=True)
+    op.create_index('ix_post_user_id_timestamp', 'post', ['user_id', 'timestamp'], unique=False)
+    op.create_index('ix_message_recipient_id_timestamp', 'message', ['recipient_id', 'timestamp'], unique=False)
+    op.create_index('ix_notification_user_id_name_timestamp', 'notification', ['user_id', 'name', 'timestamp'], unique=False)
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('ix_notification_user_id_name_timestamp', table_name='notification')
+    op.drop_index('ix_message_recipient_id_timestamp', table_name='message')
+    op.drop_index('ix_post_user_id_timestamp', table_name='post')
+    op.drop_index('ix_favorite_user_id_post_id', table_name='favorite')
+    op.drop_index('ix_likes_user_id_post_id', table_name='likes')
+    op.drop_index('ix_followers_followed_id_follower_id', table_name='followers')
+    op.drop_index('ix_followers_follower_id_followed_id', table_name='followers')
+    # ### end Alembic commands ###
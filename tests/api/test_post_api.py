@@ -13,6 +13,7 @@ class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite://"
     ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
 
 class TestPostAPI:
     @pytest.fixture(autouse=True)
@@ -76,6 +77,31 @@ class TestPostAPI:
         assert len(d["items"]) == 1
         assert d["items"][0]["id"] == post1.id
 
+    def test_get_posts_cursor(self, user1, headers):
+        for i in range(3):
+            db.session.add(Post(body="post %d" % i, user_id=user1.id))
+        db.session.commit()
+
+        response = self.client.get("/api/posts?cursor=&per_page=2",
+                                   headers=headers)
+        assert response.status_code == 200
+        d = response.get_json()
+        assert len(d["items"]) == 2
+        assert d["_links"]["prev"] is None
+        assert "total_items" not in d["_meta"]
+
+        response = self.client.get(d["_links"]["next"], headers=headers)
+        d2 = response.get_json()
+        assert len(d2["items"]) == 1
+        assert d2["_links"]["next"] is None
+        ids = [item["id"] for item in d["items"] + d2["items"]]
+        assert sorted(ids, reverse=True) == ids
+
+    def test_get_posts_invalid_cursor(self, headers):
+        response = self.client.get("/api/posts?cursor=garbage",
+                                   headers=headers)
+        assert response.status_code == 400
+
     def test_get_post_invalid_user(self, headers):
         response = self.client.get("/api/posts/21380", headers=headers)
         assert response.status_code == 400
@@ -0,0 +1,55 @@
+import pytest
+from app import create_app, db
+from app.models import User, Post
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+    SEARCH_INDEX_SYNC = True
+
+
+class TestSearchAPI:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @pytest.fixture()
+    def headers(self):
+        user = User(username="joe", email="joe@joe.com")
+        db.session.add(user)
+        db.session.add_all([Post(body="hello %d" % i, author=user)
+                            for i in range(5)])
+        db.session.commit()
+        return {"Authorization": "Bearer {}".format(user.get_token())}
+
+    def test_search_follows_next_links(self, headers):
+        url, bodies = "/api/search?q=hello&per_page=2", []
+        while url:
+            response = self.client.get(url, headers=headers)
+            assert response.status_code == 200
+            data = response.get_json()
+            bodies.extend(item["body"] for item in data["items"])
+            url = data["_links"]["next"]
+        assert sorted(bodies) == ["hello %d" % i for i in range(5)]
+
+    def test_search_requires_query(self, headers):
+        response = self.client.get("/api/search", headers=headers)
+        assert response.status_code == 400
+
+    def test_search_invalid_cursor(self, headers):
+        response = self.client.get("/api/search?q=hello&cursor=bad",
+                                   headers=headers)
+        assert response.status_code == 400
+        assert response.get_json()["message"] == "invalid cursor"
@@ -0,0 +1,117 @@
+import fakeredis
+import pytest
+from app import create_app, db
+from app.models import User
+from app.token_cache import TokenCache
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+
+
+class TestTokenAPI:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @pytest.fixture()
+    def user(self):
+        user = User(username="joe", email="joe@joe.com")
+        user.set_password("cat")
+        db.session.add(user)
+        db.session.commit()
+        yield user
+
+    @pytest.fixture()
+    def headers(self, user):
+        return {"Authorization": "Bearer {}".format(user.get_token())}
+
+    def _count_queries(self, url, headers):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.remove()
+        db.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.get(url, headers=headers)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+        return response, statements
+
+    def test_verified_tokens_skip_the_database(self, user, headers):
+        response, statements = self._count_queries("/api/tokens/stats",
+                                                    headers)
+        assert response.status_code == 200
+        assert len(statements) == 1
+        assert "user.token =" in statements[0]
+
+        response, statements = self._count_queries("/api/tokens/stats",
+                                                   headers)
+        assert response.status_code == 200
+        assert statements == []
+        assert response.get_json()["hits"] == 1
+
+    def test_revocations_are_read_once_per_poll(self, user, headers,
+                                                mocker):
+        token = headers["Authorization"].split()[1]
+        User.check_token(token)
+        spy = mocker.spy(self.app.redis, "zrangebyscore")
+        for _ in range(3):
+            assert User.check_token(token).id == user.id
+        assert spy.call_count == 0
+
+    def test_cached_user_is_not_stale(self, user, headers):
+        self.client.get("/api/tokens/stats", headers=headers)
+        User.query.filter_by(id=user.id).update({"about_me": "changed"})
+        db.session.commit()
+        db.session.remove()
+        token = headers["Authorization"].split()[1]
+        assert User.check_token(token).about_me == "changed"
+
+    def test_revoke_invalidates_cache(self, user, headers):
+        assert self.client.get("/api/tokens/stats",
+                               headers=headers).status_code == 200
+        assert self.client.delete("/api/tokens",
+                                  headers=headers).status_code == 204
+        assert self.client.get("/api/tokens/stats",
+                               headers=headers).status_code == 401
+
+    def test_revocation_reaches_other_workers(self, user, headers):
+        token = user.get_token()
+        other_worker = TokenCache(revocation_poll=0.5)
+        self.app.token_cache = other_worker
+        assert User.check_token(token).id == user.id
+
+        self.app.token_cache = TokenCache()
+        user.revoke_token()
+        self.app.token_cache = other_worker
+        # read on the next poll
+        other_worker.revocations_read_at -= 1
+        assert other_worker.get(token) is None
+        db.session.commit()
+        assert User.check_token(token) is None
+
+    def test_shared_redis_layer(self, user):
+        token = user.get_token()
+        self.app.token_cache = TokenCache(connection=fakeredis.FakeRedis())
+        assert User.check_token(token).id == user.id
+
+        # a second worker only finds the entry in Redis
+        self.app.token_cache.local.clear()
+        assert User.check_token(token).username == "joe"
+        assert self.app.token_cache.stats()["redis_hits"] == 1
@@ -10,6 +10,7 @@ class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite://"
     ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
 
 class TestUserModel:
     @pytest.fixture(autouse=True)
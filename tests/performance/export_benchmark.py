@@ -0,0 +1,62 @@
+"""Measure how fast posts are exported, and the memory it takes.
+
+    python tests/performance/export_benchmark.py --posts 50000
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from app import create_app, db  # noqa: E402
+from app.export import export_user_posts  # noqa: E402
+from app.models import User, Post  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        class BenchmarkConfig(Config):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp,
+                                                                  'app.db')
+            ELASTICSEARCH_URL = None
+            SEARCH_INDEX_PATH = None
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            user = User(username='bench', email='bench@example.com')
+            db.session.add(user)
+            db.session.commit()
+            now = datetime.utcnow()
+            db.session.bulk_insert_mappings(Post, [
+                {'body': 'post number %d of the benchmark' % i,
+                 'timestamp': now + timedelta(seconds=i), 'user_id': user.id}
+                for i in range(args.posts)])
+            db.session.commit()
+
+            for fmt, compress in [('json', False), ('ndjson', False),
+                                  ('ndjson', True)]:
+                tracemalloc.start()
+                started = perf_counter()
+                export, _, _ = export_user_posts(user, fmt, compress)
+                elapsed = perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                size = export.seek(0, os.SEEK_END)
+                export.close()
+                print('{:<12} {:>9.0f} rows/s  {:>7.1f} MB written  '
+                      'peak {:.1f} MB'.format(
+                          fmt + (' gzip' if compress else ''),
+                          args.posts / elapsed, size / 1e6, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Compare language identification with and without the cached n-gram engine.
+
+    python tests/performance/langid_benchmark.py --posts 2000
+"""
+import argparse
+import os
+import random
+import sys
+from time import perf_counter
+from langdetect import LangDetectException, detect
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from app.langid import LanguageIdentifier, NgramEngine  # noqa: E402
+from config import Config  # noqa: E402
+
+SENTENCES = [
+    'The quick brown fox jumps over the lazy dog',
+    'I love this new phone, it works great',
+    'What are you doing tonight?',
+    'Me gusta mucho la comida mexicana',
+    'Buenos días a todos, hoy es un gran día',
+    'Bonjour, je suis très content de vous voir',
+    'Le chat est sur la table de la cuisine',
+    'Ich habe heute leider keine Zeit für dich',
+    'Mi piace la pizza con le acciughe',
+    'Eu gosto de futebol e de praia',
+    'Привет, как дела? Давно не виделись',
+    'hi',
+]
+
+
+def langdetect_only(text):
+    try:
+        return detect(text)
+    except LangDetectException:
+        return ''
+
+
+def run(name, detect_one, posts):
+    latencies = []
+    started = perf_counter()
+    for text in posts:
+        t = perf_counter()
+        detect_one(text)
+        latencies.append((perf_counter() - t) * 1000)
+    elapsed = perf_counter() - started
+    latencies.sort()
+    print('{:<28} {:>8.0f} posts/s  p50 {:.3f}ms  p95 {:.3f}ms'.format(
+        name, len(posts) / elapsed, latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.95)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--unique', type=float, default=0.5,
+                        help='Fraction of posts that are not repeats.')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    posts = []
+    for i in range(args.posts):
+        if posts and rng.random() > args.unique:
+            posts.append(rng.choice(posts))
+        else:
+            posts.append('{} {}'.format(rng.choice(SENTENCES), i))
+
+    engine = NgramEngine(Config.LANGID_LANGUAGES)
+    started = perf_counter()
+    engine.table
+    print('n-gram model loaded in {:.3f}s'.format(perf_counter() - started))
+
+    run('langdetect', langdetect_only, posts)
+    run('n-gram engine, no cache', LanguageIdentifier(
+        engine, cache_size=0).detect, posts)
+    run('n-gram engine, cached', LanguageIdentifier(engine).detect, posts)
+    identifier = LanguageIdentifier(engine)
+    started = perf_counter()
+    identifier.detect_many(posts)
+    print('{:<28} {:>8.0f} posts/s'.format(
+        'detect_many', len(posts) / (perf_counter() - started)))
+
+
+if __name__ == '__main__':
+    main()
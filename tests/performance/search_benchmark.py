@@ -0,0 +1,126 @@
+"""Compare query latency of the search backends.
+
+The Elasticsearch backend talks to a local stand-in server that implements
+just enough of the bulk and search APIs, so the numbers include the HTTP
+round trip and JSON encoding, but not the work of a real cluster.
+
+    python tests/performance/search_benchmark.py --docs 20000 --queries 500
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+from time import perf_counter
+from elasticsearch import Elasticsearch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from app.search_backends import ElasticsearchBackend, \
+    SQLiteSearchBackend  # noqa: E402
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+         'hotel', 'india', 'juliett', 'kilo', 'lima', 'mike', 'november',
+         'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform',
+         'victor', 'whiskey', 'xray', 'yankee', 'zulu']
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    documents = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8')
+
+    def do_GET(self):
+        if self.path.split('?')[0].endswith('/_search'):
+            return self._search(json.loads(self._body() or '{}'))
+        self._reply({'version': {'number': '7.13.3'}})
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path.endswith('/_bulk'):
+            lines = [json.loads(line) for line in self._body().splitlines()
+                     if line]
+            for action, document in zip(lines[::2], lines[1::2]):
+                self.documents[action['index']['_id']] = ' '.join(
+                    document.values()).split()
+            return self._reply({'errors': False, 'items': []})
+        self._search(json.loads(self._body() or '{}'))
+
+    def _search(self, body):
+        terms = body['query']['multi_match']['query'].split()
+        scored = []
+        for id, words in self.documents.items():
+            score = sum(words.count(term) for term in terms)
+            if score:
+                scored.append((-score, int(id)))
+        scored.sort()
+        start = body.get('from', 0)
+        hits = [{'_id': str(id), '_score': -score}
+                for score, id in scored[start:start + body.get('size', 10)]]
+        self._reply({'hits': {'total': {'value': len(scored)},
+                              'hits': hits}})
+
+
+def measure(backend, queries, per_page):
+    latencies = []
+    for query in queries:
+        started = perf_counter()
+        backend.query('post', query, 1, per_page)
+        latencies.append((perf_counter() - started) * 1000)
+    latencies.sort()
+    return {'mean': statistics.mean(latencies),
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[int(len(latencies) * 0.95)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--per-page', type=int, default=25)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    documents = [(i, {'body': ' '.join(rng.choices(WORDS, k=12))})
+                 for i in range(1, args.docs + 1)]
+    queries = [' '.join(rng.sample(WORDS, 2)) for _ in range(args.queries)]
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'elasticsearch (stand-in)': ElasticsearchBackend(Elasticsearch(
+                ['http://127.0.0.1:{}'.format(server.server_port)])),
+            'sqlite fts5': SQLiteSearchBackend(os.path.join(tmp,
+                                                            'search.db')),
+        }
+        for name, backend in backends.items():
+            started = perf_counter()
+            backend.bulk('post', documents)
+            print('{:<26} indexed {} documents in {:.2f}s'.format(
+                name, len(documents), perf_counter() - started))
+        for name, backend in backends.items():
+            stats = measure(backend, queries, args.per_page)
+            print('{:<26} mean {mean:.2f}ms  p50 {p50:.2f}ms  '
+                  'p95 {p95:.2f}ms'.format(name, **stats))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite://"
     ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
     WTF_CSRF_ENABLED = False
 
 
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+import gzip
+import io
+import json
+import os
+import time
+import pytest
+from app import cli, create_app, db
+from app.export import Throttle, export_user_posts, find_export, \
+    store_export, write_posts
+from app.models import User, Post
+from app.retention import prune_exports
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+
+
+class TestExport:
+    @pytest.fixture(autouse=True)
+    def setup_app(self, tmp_path):
+        self.app = create_app(TestConfig)
+        self.app.config['EXPORT_DIR'] = str(tmp_path)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @pytest.fixture()
+    def user(self):
+        user = User(username='john', email='john@example.com')
+        other = User(username='susan', email='susan@example.com')
+        now = datetime.utcnow()
+        db.session.add_all(
+            [Post(body='post %d' % i, author=user,
+                  timestamp=now + timedelta(seconds=i)) for i in range(5)] +
+            [Post(body='not mine', author=other, timestamp=now)])
+        db.session.commit()
+        return user
+
+    def test_write_json(self):
+        f = io.StringIO()
+        when = datetime(2021, 1, 2, 3, 4, 5)
+        assert write_posts([('a', when), ('b "quoted"', when)], f) == 2
+        assert json.loads(f.getvalue()) == {'posts': [
+            {'body': 'a', 'timestamp': '2021-01-02T03:04:05Z'},
+            {'body': 'b "quoted"', 'timestamp': '2021-01-02T03:04:05Z'}]}
+
+        f = io.StringIO()
+        write_posts([], f)
+        assert json.loads(f.getvalue()) == {'posts': []}
+
+    def test_write_ndjson(self):
+        f = io.StringIO()
+        when = datetime(2021, 1, 2, 3, 4, 5)
+        write_posts([('a', when), ('b', when)], f, 'ndjson')
+        lines = f.getvalue().splitlines()
+        assert [json.loads(line)['body'] for line in lines] == ['a', 'b']
+
+    def test_export_user_posts(self, user):
+        done = []
+        export, filename, content_type = export_user_posts(
+            user, progress=done.append, batch_size=2)
+        assert (filename, content_type) == ('posts.json', 'application/json')
+        posts = json.loads(export.read())['posts']
+        assert [post['body'] for post in posts] == \
+            ['post %d' % i for i in range(5)]
+        assert done == [1, 2, 3, 4, 5]
+
+    def test_export_gzip_spools_to_disk(self, user):
+        export, filename, content_type = export_user_posts(
+            user, 'ndjson', compress=True, spool_size=10)
+        assert (filename, content_type) == ('posts.ndjson.gz',
+                                            'application/gzip')
+        assert export._rolled
+        lines = gzip.decompress(export.read()).decode('utf-8').splitlines()
+        assert len(lines) == 5
+
+    def test_throttle(self, mocker):
+        calls = []
+        clock = mocker.patch('app.export.monotonic', return_value=0.0)
+        throttle = Throttle(calls.append, rows=3, seconds=10)
+        for done in range(1, 8):
+            throttle(done)
+        assert calls == [3, 6]
+        clock.return_value = 20.0
+        throttle(7)
+        assert calls == [3, 6, 7]
+
+    def test_download_export(self, user):
+        export, filename, _ = export_user_posts(user, 'ndjson')
+        token = 'a' * 32
+        store_export(export, self.app.config['EXPORT_DIR'], user.id, token,
+                     filename)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        response = client.get('/exports/' + token)
+        assert response.status_code == 200
+        assert 'posts.ndjson' in response.headers['Content-Disposition']
+        assert len(response.get_data().splitlines()) == 5
+        response.close()
+
+        other = User.query.filter_by(username='susan').first()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(other.id)
+        assert client.get('/exports/' + token).status_code == 404
+        assert find_export(self.app.config['EXPORT_DIR'], user.id,
+                           '../' + token, 60) is None
+
+    def test_expired_export_link(self, user):
+        export, filename, _ = export_user_posts(user)
+        token = 'c' * 32
+        path = store_export(export, self.app.config['EXPORT_DIR'], user.id,
+                            token, filename)
+        assert find_export(self.app.config['EXPORT_DIR'], user.id, token,
+                           60) == (path, filename)
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        assert find_export(self.app.config['EXPORT_DIR'], user.id, token,
+                           60) is None
+
+    def test_prune_exports(self, user):
+        export, filename, _ = export_user_posts(user)
+        path = store_export(export, self.app.config['EXPORT_DIR'], user.id,
+                            'b' * 32, filename)
+        assert prune_exports(self.app.config['EXPORT_DIR'], 60) == 0
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        assert prune_exports(self.app.config['EXPORT_DIR'], 60) == 1
+        assert not os.path.exists(path)
+
+    def test_prune_command(self, user):
+        export, filename, _ = export_user_posts(user)
+        path = store_export(export, self.app.config['EXPORT_DIR'], user.id,
+                            'd' * 32, filename)
+        old = time.time() - self.app.config['EXPORT_MAX_AGE'] - 1
+        os.utime(path, (old, old))
+        cli.register(self.app)
+        result = self.app.test_cli_runner().invoke(args=['exports', 'prune'])
+        assert result.exit_code == 0, result.output
+        assert '1 expired exports deleted' in result.output
+        assert not os.path.exists(path)
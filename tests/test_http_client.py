@@ -0,0 +1,115 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import pytest
+import requests
+from app import create_app
+from app.http_client import HTTPClient
+from app.translate import translate_batch
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+    MS_TRANSLATOR_KEY = "test-key"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        if status == 503:
+            self.send_header('Retry-After', '30')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        if self.path == '/slow':
+            time.sleep(1)
+        if self.path == '/flaky':
+            self.server.failures -= 1
+            if self.server.failures >= 0:
+                return self._reply(503, {})
+        self._reply(200, {'path': self.path})
+
+    def do_POST(self):
+        texts = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])))
+        self.server.clients.add(self.client_address)
+        if self.path == '/flaky':
+            self.server.failures -= 1
+            return self._reply(503, {})
+        self._reply(200, [{'translations': [{'text': item['Text'][::-1]}]}
+                          for item in texts])
+
+
+class TestHTTPClient:
+    @pytest.fixture(autouse=True)
+    def stub(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.clients = set()
+        self.server.failures = 0
+        # the slow handler writes to a client that has given up already
+        self.server.handle_error = lambda request, client_address: None
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        yield
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        client = HTTPClient()
+        for _ in range(5):
+            assert client.get(self.url + '/ok').json() == {'path': '/ok'}
+        assert len(self.server.clients) == 1
+        stats = client.stats()['127.0.0.1:{}'.format(self.server.server_port)]
+        assert stats['requests'] == 5
+        assert stats['errors'] == 0
+        assert 0 < stats['mean_time'] <= stats['max_time']
+
+    def test_read_timeout(self):
+        client = HTTPClient(read_timeout=0.2, retries=0)
+        started = time.monotonic()
+        with pytest.raises(requests.RequestException):
+            client.get(self.url + '/slow')
+        assert time.monotonic() - started < 0.9
+        assert list(client.stats().values())[0]['errors'] == 1
+
+    def test_retries_with_backoff(self):
+        self.server.failures = 2
+        client = HTTPClient(retries=2, backoff_factor=0.01)
+        assert client.get(self.url + '/flaky').status_code == 200
+        self.server.failures = 3
+        started = time.monotonic()
+        assert client.get(self.url + '/flaky').status_code == 503
+        # the stub's Retry-After of 30 seconds is not honoured
+        assert time.monotonic() - started < 5
+
+    def test_post_is_not_retried(self):
+        self.server.failures = 3
+        client = HTTPClient(retries=2, backoff_factor=0.01)
+        assert client.post(self.url + '/flaky', json=[]).status_code == 503
+        assert self.server.failures == 2
+
+    def test_translator_calls_use_the_client(self):
+        app = create_app(TestConfig)
+        app.config['MS_TRANSLATOR_URL'] = self.url
+        app.translation_cache.redis = None
+        with app.test_request_context():
+            assert translate_batch([('hello', 'en'), ('world', 'en')],
+                                   'es') == ['olleh', 'dlrow']
+        assert list(app.http.stats().values())[0]['requests'] == 1
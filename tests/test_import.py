@@ -0,0 +1,101 @@
+from datetime import datetime
+import io
+import json
+import pytest
+from app import create_app, db
+from app.imports import import_user_posts, parse_posts
+from app.models import User, Post
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+
+
+class TestImport:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @pytest.fixture()
+    def user(self):
+        user = User(username='john', email='john@example.com')
+        other = User(username='susan', email='susan@example.com')
+        db.session.add_all([user, other, Post(body='existing', author=user),
+                            Post(body='not mine', author=other)])
+        db.session.commit()
+        return user
+
+    def test_parse_ndjson(self):
+        lines = [json.dumps({'body': 'hello', 'timestamp':
+                             '2021-01-02T03:04:05Z'}),
+                 '',
+                 'not json',
+                 json.dumps({'body': 'x' * 141}),
+                 json.dumps({'body': 'offset', 'timestamp':
+                             '2021-01-02T03:04:05+01:00'}),
+                 json.dumps({'body': 'bad date', 'timestamp': 'yesterday'}),
+                 json.dumps(['not', 'an', 'object'])]
+        posts = list(parse_posts(io.StringIO('\n'.join(lines)), 'ndjson'))
+        assert posts == [('hello', datetime(2021, 1, 2, 3, 4, 5)), None, None,
+                         ('offset', datetime(2021, 1, 2, 2, 4, 5)), None,
+                         None]
+
+    def test_parse_csv(self):
+        f = io.StringIO('body,timestamp\n'
+                        '"hello, world",2021-01-02T03:04:05\n'
+                        ',2021-01-02T03:04:05\n'
+                        'no timestamp,\n')
+        posts = list(parse_posts(f, 'csv'))
+        assert posts[0] == ('hello, world', datetime(2021, 1, 2, 3, 4, 5))
+        assert posts[1] is None
+        assert posts[2][0] == 'no timestamp'
+
+    def test_parse_unknown_format(self):
+        with pytest.raises(ValueError):
+            list(parse_posts(io.StringIO(''), 'xml'))
+
+    def test_import_user_posts(self, user):
+        when = datetime(2021, 1, 2, 3, 4, 5)
+        posts = [('imported post %d' % i, when) for i in range(5)] + [None]
+        done = []
+        assert import_user_posts(user, posts, batch_size=2,
+                                 progress=done.append) == (5, 1)
+        assert done == [2, 4, 6]
+        assert user.post_count == 6
+        imported = Post.query.filter(Post.user_id == user.id,
+                                     Post.body.like('imported%')).all()
+        assert len(imported) == 5
+        assert all(post.timestamp == when for post in imported)
+        assert all(post.language is not None for post in imported)
+        assert User.query.filter_by(username='susan').first().post_count == 1
+
+        results, total = Post.search('imported', 1, 10)
+        assert total == 5
+
+    def test_import_batches_queries(self, user):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        posts = [('post %d' % i, datetime.utcnow()) for i in range(50)]
+        db.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            import_user_posts(user, posts, batch_size=25)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+        inserts = [s for s in statements if s.startswith('INSERT INTO post')]
+        # executemany counts once per batch
+        assert len(inserts) == 2
+        assert len(statements) < 20
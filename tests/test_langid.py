@@ -0,0 +1,48 @@
+import pytest
+from app.langid import LanguageIdentifier, NgramEngine
+
+LANGUAGES = ['en', 'es', 'fr', 'de', 'it', 'pt', 'ru']
+
+
+class TestLanguageIdentifier:
+    @pytest.fixture(scope='class')
+    def engine(self):
+        return NgramEngine(LANGUAGES)
+
+    @pytest.mark.parametrize('text, language', [
+        ('The quick brown fox jumps over the lazy dog', 'en'),
+        ('Me gusta mucho la comida mexicana', 'es'),
+        ('Bonjour, je suis très content de vous voir', 'fr'),
+        ('Ich habe heute keine Zeit', 'de'),
+        ('Mi piace la pizza', 'it'),
+        ('Eu gosto de futebol', 'pt'),
+        ('Привет, как дела?', 'ru'),
+    ])
+    def test_engine(self, engine, text, language):
+        assert engine.detect(text) == language
+
+    def test_engine_abstains_on_short_text(self, engine):
+        assert engine.detect('hi') is None
+        assert engine.detect('1234 !!') is None
+
+    def test_falls_back_to_seeded_langdetect(self, engine):
+        langid = LanguageIdentifier(engine)
+        results = {LanguageIdentifier(engine).detect('hi') for _ in range(5)}
+        assert len(results) == 1
+        assert langid.detect('12345') == ''
+        assert langid.stats()['fallback_answers'] == 1
+
+    def test_results_are_cached(self, engine, mocker):
+        langid = LanguageIdentifier(engine)
+        spy = mocker.spy(engine, 'detect')
+        assert langid.detect('Mi piace la pizza') == 'it'
+        assert langid.detect('Mi piace la pizza') == 'it'
+        assert spy.call_count == 1
+
+    def test_detect_many(self, engine, mocker):
+        langid = LanguageIdentifier(engine, cache_size=0)
+        spy = mocker.spy(engine, 'detect')
+        texts = ['Mi piace la pizza', 'Eu gosto de futebol',
+                 'Mi piace la pizza']
+        assert langid.detect_many(texts) == ['it', 'pt', 'it']
+        assert spy.call_count == 2
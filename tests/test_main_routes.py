@@ -0,0 +1,249 @@
+import io
+import fakeredis
+import pytest
+from flask import g
+from app import create_app, db
+from app.models import User, Post, Message, Conversation, \
+    conversation_key
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+    WTF_CSRF_ENABLED = False
+
+
+class TestMainRoutes:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @pytest.fixture()
+    def users(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(u1.id)
+            session['_fresh'] = True
+        return u1, u2
+
+    def _add_posts(self, users, count):
+        u1, u2 = users
+        posts = [Post(body='post %d' % i, author=(u1, u2)[i % 2])
+                 for i in range(count)]
+        db.session.add_all(posts)
+        db.session.commit()
+        for post in posts[::3]:
+            u1.like(post)
+            u1.favorite(post)
+        db.session.commit()
+
+    def _queries(self, url):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        # start from an empty session so every request loads the same rows
+        db.session.remove()
+        engine = db.get_engine()
+        db.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.get(url)
+        finally:
+            db.event.remove(engine, 'before_cursor_execute', count)
+        assert response.status_code == 200
+        return statements
+
+    def test_explore_query_count_does_not_grow_with_posts(self, users):
+        self._add_posts(users, 3)
+        self.client.get('/explore')  # mints the API token
+        few = self._queries('/explore')
+        self._add_posts(users, 20)
+        many = self._queries('/explore')
+        assert len(few) == len(many)
+
+    def test_api_token_minted_once_per_page(self, users):
+        self._add_posts(users, 10)
+        statements = self._queries('/explore')
+        assert len([s for s in statements if 'SET token' in s]) == 1
+        html = self.client.get('/explore').get_data(as_text=True)
+        token = User.query.filter_by(username='john').first().token
+        assert html.count(token) == 1
+
+    def test_page_view_does_not_write_last_seen(self, users):
+        self.client.get('/explore')
+        statements = self._queries('/explore')
+        assert not [s for s in statements if s.startswith('UPDATE')]
+        assert self.app.last_seen.get(users[0].id) is not None
+
+    def test_post_state_rendered(self, users):
+        u1, u2 = users
+        post = Post(body='liked post', author=u2)
+        db.session.add(post)
+        db.session.commit()
+        u1.like(post)
+        u1.favorite(post)
+        db.session.commit()
+
+        html = self.client.get('/explore').get_data(as_text=True)
+        assert 'up-arrow-red.svg' in html
+        assert 'removeFromFavorites({})'.format(post.id) in html
+
+    def test_messages_render(self, users):
+        u1, u2 = users
+        message = Message(author=u2, recipient=u1, body='hello there')
+        db.session.add(message)
+        Conversation.add_message(message)
+        db.session.commit()
+
+        response = self.client.get('/messages')
+        assert response.status_code == 200
+        assert 'hello there' in response.get_data(as_text=True)
+
+    def test_send_message_threads_conversation(self, users):
+        u1, u2 = users
+        for body in ['first', 'second']:
+            response = self.client.post('/send_message/susan',
+                                        data={'message': body})
+            assert response.status_code == 302
+        mine = Conversation.query.filter_by(user_id=u1.id).one()
+        theirs = Conversation.query.filter_by(user_id=u2.id).one()
+        assert (mine.peer_id, mine.last_body, mine.unread_count) == \
+            (u2.id, 'second', 0)
+        assert (theirs.peer_id, theirs.unread_count) == (u1.id, 2)
+        assert Message.query.first().conversation_key == \
+            conversation_key(u2.id, u1.id)
+
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(u2.id)
+        html = self.client.get('/messages').get_data(as_text=True)
+        assert 'second' in html and '<span class="badge">2</span>' in html
+        # the inbox leaves the conversations unread
+        assert User.query.get(u2.id).new_messages() == 2
+        html = self.client.get('/messages/john').get_data(as_text=True)
+        assert 'first' in html and 'second' in html
+        db.session.expire_all()
+        assert Conversation.query.filter_by(
+            user_id=u2.id).one().unread_count == 0
+        assert User.query.get(u2.id).new_messages() == 0
+
+    def test_inbox_query_count_does_not_grow(self, users):
+        u1, u2 = users
+        others = [User(username='user%d' % i, email='user%d@example.com' % i)
+                  for i in range(10)]
+        db.session.add_all(others)
+        for sender in [u2] + others:
+            for i in range(3):
+                message = Message(author=sender, recipient=u1, body='hi')
+                db.session.add(message)
+                Conversation.add_message(message)
+        db.session.commit()
+        self.client.get('/messages')
+        statements = self._queries('/messages')
+        assert len([s for s in statements
+                    if s.lstrip().startswith('SELECT') and
+                    'conversation' in s]) == 1
+        assert not [s for s in statements if 'FROM message' in s]
+
+    def test_inbox_legacy_page_links(self, users):
+        u1, u2 = users
+        self.app.config['POSTS_PER_PAGE'] = 1
+        others = [User(username='user%d' % i, email='user%d@example.com' % i)
+                  for i in range(2)]
+        db.session.add_all(others)
+        for sender in [u2] + others:
+            message = Message(author=sender, recipient=u1, body='hi')
+            db.session.add(message)
+            Conversation.add_message(message)
+        db.session.commit()
+        html = self.client.get('/messages?page=2').get_data(as_text=True)
+        assert 'page=3' in html and 'page=1' in html
+
+    def test_conversation_pages_with_cursor(self, users):
+        u1, u2 = users
+        self.app.config['POSTS_PER_PAGE'] = 2
+        for i in range(3):
+            message = Message(author=u2, recipient=u1, body='msg %d' % i)
+            db.session.add(message)
+            Conversation.add_message(message)
+        db.session.commit()
+        html = self.client.get('/messages/susan').get_data(as_text=True)
+        assert 'cursor=' in html
+        assert self.client.get(
+            '/messages/susan?cursor=bad').status_code == 302
+
+    def test_search_pages_with_cursor(self, users):
+        self.app.config['POSTS_PER_PAGE'] = 2
+        db.session.add_all([Post(body='findme %d' % i, author=users[1])
+                            for i in range(3)])
+        db.session.commit()
+
+        html = self.client.get('/search?q=findme').get_data(as_text=True)
+        assert html.count('findme') >= 2
+        assert 'cursor=' in html
+        response = self.client.get('/search?q=findme&cursor=bad')
+        assert response.status_code == 302
+
+    def test_import_posts_upload(self, users, mocker, tmp_path):
+        self.app.config['IMPORT_UPLOAD_DIR'] = str(tmp_path)
+        launch_task = mocker.patch.object(User, 'launch_task')
+        data = {'file': (io.BytesIO(b'body\nhello\n'), 'posts.csv')}
+        response = self.client.post('/import_posts', data=data,
+                                    content_type='multipart/form-data')
+        assert response.status_code == 302
+        name, description, path, fmt = launch_task.call_args[0]
+        assert (name, fmt) == ('import_posts', 'csv')
+        with open(path, 'rb') as f:
+            assert f.read() == b'body\nhello\n'
+
+    def _template_queries(self, url):
+        db.session.remove()
+        with self.client:
+            response = self.client.get(url)
+            assert response.status_code == 200
+            return g.template_queries
+
+    def test_template_query_counts(self, users):
+        self._add_posts(users, 10)
+        message = Message(author=users[1], recipient=users[0], body='hello')
+        db.session.add(message)
+        Conversation.add_message(message)
+        db.session.commit()
+        self.client.get('/index')  # mints the API token
+        # queries run while rendering, after the view has loaded its data;
+        # the layout's tasks in progress are the only one left
+        budgets = {
+            '/index': ('index.html', 1),
+            '/explore': ('index.html', 1),
+            '/user/susan': ('user.html', 2),
+            '/user/john': ('user.html', 1),
+            '/messages': ('messages.html', 1),
+            '/messages/susan': ('conversation.html', 1),
+            '/favorites': ('favorites.html', 1),
+            '/user/susan/popup': ('user_popup.html', 1),
+        }
+        for url, (template, budget) in budgets.items():
+            assert self._template_queries(url) == {template: budget}, url
+
+    def test_layout_data_loaded_once(self, users):
+        self.client.get('/user/susan')
+        statements = self._queries('/user/susan')
+        assert len([s for s in statements if 'FROM task' in s]) == 1
+        assert len([s for s in statements if 'followers.' in s]) == 1
+        # the unread count comes from Redis once it is cached
+        assert len([s for s in statements if 'FROM message' in s]) == 0
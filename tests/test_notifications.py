@@ -0,0 +1,231 @@
+import json
+import queue
+from time import time
+import fakeredis
+import pytest
+import redis
+from app import create_app, db
+from app.models import User, Notification, Task
+from app.notifications import NotificationHub, event_stream, \
+    wait_for_notification
+from app import cli
+from app.progress import ProgressReporter
+from app.retention import prune_notifications
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+    NOTIFICATIONS_STREAM_DURATION = 0
+
+
+class TestNotifications:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.notification_hub = NotificationHub(self.app.redis)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.user.id)
+            session['_fresh'] = True
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_published_on_commit(self):
+        listener = self.app.notification_hub.subscribe(self.user.id)
+        assert listener is not None
+        self.user.add_notification('unread_message_count', 3)
+        assert listener.empty()
+        db.session.commit()
+        notification = listener.get(timeout=1)
+        assert notification['name'] == 'unread_message_count'
+        assert notification['data'] == 3
+
+    def test_not_published_on_rollback(self):
+        listener = self.app.notification_hub.subscribe(self.user.id)
+        self.user.add_notification('unread_message_count', 3)
+        db.session.rollback()
+        db.session.commit()
+        with pytest.raises(queue.Empty):
+            listener.get(timeout=0.2)
+
+    def test_savepoint_rollback_keeps_queued_notifications(self):
+        listener = self.app.notification_hub.subscribe(self.user.id)
+        self.user.add_notification('unread_message_count', 3)
+        savepoint = db.session.begin_nested()
+        savepoint.rollback()
+        db.session.commit()
+        assert listener.get(timeout=1)['data'] == 3
+
+    def test_failed_publish_forgets_the_latest_marker(self, mocker):
+        self.user.add_notification('unread_message_count', 1)
+        db.session.commit()
+        timestamp = Notification.query.one().timestamp
+        mocker.patch.object(self.app.redis, 'publish',
+                            side_effect=redis.exceptions.ConnectionError())
+        self.user.add_notification('unread_message_count', 2)
+        db.session.commit()
+        response = self.client.get(
+            '/notifications?since={!r}'.format(timestamp))
+        assert response.get_json()[0]['data'] == 2
+
+    def test_task_progress_published(self):
+        task = Task(id='job-1', name='export_posts', user=self.user)
+        db.session.add(task)
+        db.session.commit()
+        listener = self.app.notification_hub.subscribe(self.user.id)
+        ProgressReporter(task, self.app.redis).update(40)
+        notification = listener.get(timeout=1)
+        assert notification['data'] == {'task_id': 'job-1', 'progress': 40}
+
+    def test_add_notification_upserts(self):
+        self.user.add_notification('unread_message_count', 1)
+        db.session.commit()
+        first = Notification.query.one()
+        self.user.add_notification('unread_message_count', 2)
+        db.session.commit()
+        db.session.refresh(first)
+        assert Notification.query.count() == 1
+        assert first.get_data() == 2
+        self.user.add_notification('task_progress', {})
+        db.session.commit()
+        assert Notification.query.count() == 2
+
+    def test_poll_with_nothing_new_skips_the_database(self):
+        self.user.add_notification('unread_message_count', 1)
+        db.session.commit()
+        timestamp = Notification.query.one().timestamp
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.get(
+                '/notifications?since={!r}'.format(timestamp))
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+        assert response.status_code == 304
+        assert statements == []
+
+        response = self.client.get('/notifications?since=0')
+        assert response.get_json()[0]['data'] == 1
+
+    def test_empty_feed_is_remembered(self):
+        since = time() - 10
+        response = self.client.get('/notifications?since={!r}'.format(since))
+        assert response.get_json() == []
+        response = self.client.get('/notifications?since={!r}'.format(since))
+        assert response.status_code == 304
+
+        self.user.add_notification('unread_message_count', 1)
+        db.session.commit()
+        response = self.client.get('/notifications?since={!r}'.format(since))
+        assert response.get_json()[0]['data'] == 1
+
+    def test_prune_notifications(self):
+        old = time() - 3600
+        users = [User(username='user%d' % i) for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add_all([Notification(user_id=user.id, name='old',
+                                         payload_json='0', timestamp=old)
+                            for user in users])
+        self.user.add_notification('recent', 1)
+        db.session.commit()
+        assert list(prune_notifications(60, batch_size=2)) == [2, 2, 1]
+        assert [n.name for n in Notification.query] == ['recent']
+
+    def test_compact_command(self):
+        db.session.add(Notification(user_id=self.user.id, name='old',
+                                    payload_json='0', timestamp=0.0))
+        db.session.commit()
+        cli.register(self.app)
+        result = self.app.test_cli_runner().invoke(
+            args=['notifications', 'compact'])
+        assert result.exit_code == 0
+        assert '1 notifications deleted' in result.output
+        assert Notification.query.count() == 0
+
+    def test_only_the_users_listeners_receive(self):
+        hub = self.app.notification_hub
+        mine = hub.subscribe(self.user.id)
+        other = hub.subscribe(self.user.id + 1)
+        self.user.add_notification('unread_message_count', 1)
+        db.session.commit()
+        assert mine.get(timeout=1)['data'] == 1
+        assert other.empty()
+        hub.unsubscribe(self.user.id, mine)
+        hub.unsubscribe(self.user.id + 1, other)
+        assert hub._listeners == {}
+
+    def test_hub_without_redis(self, mocker):
+        connection = mocker.Mock()
+        connection.pubsub.return_value.psubscribe.side_effect = \
+            redis.exceptions.ConnectionError()
+        hub = NotificationHub(connection, reconnect_delay=60)
+        assert hub.subscribe(1, timeout=0.1) is None
+        assert hub._listeners == {}
+
+    def test_wait_for_notification_skips_old(self):
+        listener = queue.Queue()
+        listener.put({'name': 'a', 'data': 1, 'timestamp': 1.0})
+        listener.put({'name': 'b', 'data': 2, 'timestamp': 3.0})
+        assert wait_for_notification(listener, 2.0, 1)['name'] == 'b'
+        assert wait_for_notification(listener, 2.0, 0.05) is None
+
+    def test_event_stream(self):
+        listener = queue.Queue()
+        listener.put({'name': 'old', 'data': 0, 'timestamp': 1.0})
+        listener.put({'name': 'new', 'data': 1, 'timestamp': 5.0})
+        feed = [{'name': 'feed', 'data': 0, 'timestamp': 2.0}]
+        events = list(event_stream(listener, feed, 0.0, 0.2, 0.05))
+        assert events[0] == 'retry: 10000\n\n'
+        assert events[1].startswith('id: 2.0\n')
+        assert events[2] == 'id: 5.0\ndata: {}\n\n'.format(json.dumps(
+            {'name': 'new', 'data': 1, 'timestamp': 5.0}))
+        assert ': keep-alive\n\n' in events[3:]
+
+    def test_event_stream_without_listener(self):
+        feed = [{'name': 'feed', 'data': 0, 'timestamp': 2.0}]
+        assert len(list(event_stream(None, feed, 0.0, 60, 15))) == 2
+
+    def test_stream_route(self):
+        self.user.add_notification('unread_message_count', 2)
+        db.session.commit()
+        response = self.client.get('/notifications/stream')
+        assert response.mimetype == 'text/event-stream'
+        body = response.get_data(as_text=True)
+        assert '"unread_message_count"' in body
+
+        timestamp = Notification.query.first().timestamp
+        response = self.client.get('/notifications/stream', headers={
+            'Last-Event-ID': str(timestamp)})
+        assert 'data:' not in response.get_data(as_text=True)
+        assert self.app.notification_hub._listeners == {}
+
+    def test_long_poll(self, mocker):
+        wait = mocker.patch('app.main.routes.wait_for_notification',
+                            return_value={'name': 'task_progress',
+                                          'data': {}, 'timestamp': 1.0})
+        response = self.client.get('/notifications?since=0&wait=5')
+        assert response.get_json()[0]['name'] == 'task_progress'
+        assert wait.call_args[0][2] == 5
+        assert self.app.notification_hub._listeners == {}
+
+        self.client.get('/notifications?since=0&wait=600')
+        assert wait.call_args[0][2] == \
+            self.app.config['NOTIFICATIONS_LONG_POLL_TIMEOUT']
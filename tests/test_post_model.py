@@ -8,6 +8,7 @@ class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite://"
     ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
 
 
 class TestPostAPI:
@@ -0,0 +1,81 @@
+import fakeredis
+import pytest
+from app import create_app, db
+from app.models import User, Task
+from app.progress import ProgressReporter, get_live_notifications
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+
+
+class TestProgressReporter:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username='john', email='john@example.com')
+        self.task = Task(id='job-1', name='export_posts', user=self.user)
+        db.session.add_all([self.user, self.task])
+        db.session.commit()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_updates_do_not_touch_the_database(self, mocker):
+        clock = mocker.patch('app.progress.monotonic', return_value=0.0)
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        reporter = ProgressReporter(self.task, self.app.redis, interval=1)
+        db.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            reporter.update(10)
+            assert self.task.get_progress() == 10
+            clock.return_value = 0.5
+            reporter.update(20)
+            assert self.task.get_progress() == 10
+            clock.return_value = 1.5
+            reporter.update(30)
+            assert self.task.get_progress() == 30
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+        assert statements == []
+
+        live = get_live_notifications(self.user.id)
+        assert [n['data'] for n in live] == [{'task_id': 'job-1',
+                                              'progress': 30}]
+        assert get_live_notifications(self.user.id,
+                                      live[0]['timestamp']) == []
+
+    def test_complete_writes_once(self):
+        reporter = ProgressReporter(self.task, self.app.redis)
+        reporter.update(50)
+        reporter.complete()
+        assert self.task.complete
+        assert self.task.get_progress() == 100
+        assert get_live_notifications(self.user.id) == []
+        notification = self.user.notifications.filter_by(
+            name='task_progress').one()
+        assert notification.get_data() == {'task_id': 'job-1',
+                                           'progress': 100}
+
+    def test_notifications_feed_includes_live_progress(self):
+        ProgressReporter(self.task, self.app.redis).update(40)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(self.user.id)
+            session['_fresh'] = True
+        feed = client.get('/notifications').get_json()
+        assert [n['data'] for n in feed if n['name'] == 'task_progress'] == \
+            [{'task_id': 'job-1', 'progress': 40}]
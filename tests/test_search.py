@@ -0,0 +1,413 @@
+from datetime import timedelta
+import fakeredis
+import pytest
+from app import cli, create_app, db
+from app.models import User, Post
+from app.pagination import pack_cursor
+from app.reindex import Checkpoint, bulk_reindex
+from app.search import index_lag
+from app.search_backends import ElasticsearchBackend, SearchBackend, \
+    SQLiteSearchBackend
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+
+
+class TestSearchIndexing:
+    @pytest.fixture(autouse=True)
+    def setup_app(self, mocker):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.task_queue = mocker.Mock()
+        self.app.elasticsearch = mocker.Mock()
+        self.app.elasticsearch.bulk.return_value = {'errors': False,
+                                                    'items': []}
+        self.app.search_backend = ElasticsearchBackend(self.app.elasticsearch)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @pytest.fixture()
+    def user(self):
+        user = User(username='john', email='john@example.com')
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def test_changes_are_queued_and_coalesced(self, user):
+        p1 = Post(body='first', author=user)
+        p2 = Post(body='second', author=user)
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        p1.body = 'first, edited'
+        db.session.commit()
+        db.session.delete(p2)
+        db.session.commit()
+
+        assert not self.app.elasticsearch.index.called
+        self.app.task_queue.enqueue.assert_called_once_with(
+            'app.tasks.apply_index_changes', 'post')
+        pending, lag = index_lag('post')
+        assert pending == 2
+        assert lag >= 0
+
+        assert Post.apply_index_changes() == 0
+        body = self.app.elasticsearch.bulk.call_args.kwargs['body']
+        assert body == [{'index': {'_index': 'post', '_id': p1.id}},
+                        {'body': 'first, edited', 'id': p1.id},
+                        {'delete': {'_index': 'post', '_id': p2.id}}]
+        assert index_lag('post') == (0, 0.0)
+
+    def test_failed_changes_are_queued_again(self, user):
+        p1 = Post(body='first', author=user)
+        p2 = Post(body='second', author=user)
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        self.app.elasticsearch.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_id': str(p1.id), 'status': 201}},
+            {'index': {'_id': str(p2.id), 'status': 429}}]}
+        assert Post.apply_index_changes() == 1
+        assert index_lag('post')[0] == 1
+        assert self.app.redis.hgetall('search:pending:post') == {
+            str(p2.id).encode(): b'add'}
+        assert not self.app.redis.exists('search:scheduled:post')
+        self.app.task_queue.enqueue_in.assert_called_once_with(
+            timedelta(seconds=30), 'app.tasks.apply_index_changes', 'post', 1)
+
+        self.app.elasticsearch.bulk.side_effect = ConnectionError('down')
+        with pytest.raises(ConnectionError):
+            Post.apply_index_changes(1)
+        assert index_lag('post')[0] == 1
+        assert not self.app.redis.exists('search:scheduled:post')
+        self.app.task_queue.enqueue_in.assert_called_with(
+            timedelta(seconds=60), 'app.tasks.apply_index_changes', 'post', 2)
+
+        # the retries are bounded
+        self.app.task_queue.enqueue_in.reset_mock()
+        with pytest.raises(ConnectionError):
+            Post.apply_index_changes(5)
+        assert index_lag('post')[0] == 1
+        assert not self.app.task_queue.enqueue_in.called
+
+    def test_new_job_scheduled_after_apply(self, user):
+        db.session.add(Post(body='first', author=user))
+        db.session.commit()
+        Post.apply_index_changes()
+        db.session.add(Post(body='second', author=user))
+        db.session.commit()
+        assert self.app.task_queue.enqueue.call_count == 2
+
+    def test_sync_mode(self, user):
+        self.app.config['SEARCH_INDEX_SYNC'] = True
+        post = Post(body='hello', author=user)
+        db.session.add(post)
+        db.session.commit()
+        self.app.elasticsearch.index.assert_called_once_with(
+            index='post', id=post.id, body={'body': 'hello', 'id': post.id})
+        assert not self.app.task_queue.enqueue.called
+
+    def test_falls_back_to_sync_when_redis_is_down(self, user):
+        self.app.redis = fakeredis.FakeRedis(connected=False)
+        db.session.add(Post(body='hello', author=user))
+        db.session.commit()
+        assert self.app.elasticsearch.index.called
+
+
+    def test_search_results_cached_until_commit(self, user):
+        post = Post(body='hello world', author=user)
+        db.session.add(post)
+        db.session.commit()
+        self.app.elasticsearch.search.return_value = {
+            'hits': {'total': {'value': 1}, 'hits': [{'_id': str(post.id)}]}}
+
+        for query in ['hello', '  HELLO ']:
+            posts, total = Post.search(query, 1, 10)
+            assert (posts.all(), total) == ([post], 1)
+        assert self.app.elasticsearch.search.call_count == 1
+        Post.search('hello', 2, 10)
+        assert self.app.elasticsearch.search.call_count == 2
+
+        post.body = 'hello again'
+        db.session.commit()
+        Post.search('hello', 1, 10)
+        assert self.app.elasticsearch.search.call_count == 3
+        # the worker applying the change starts a new generation as well
+        Post.apply_index_changes()
+        Post.search('hello', 1, 10)
+        assert self.app.elasticsearch.search.call_count == 4
+
+    def test_likes_are_not_indexed(self, user):
+        post = Post(body='hello world', author=user)
+        db.session.add(post)
+        db.session.commit()
+        Post.apply_index_changes()
+        self.app.task_queue.reset_mock()
+        generation = self.app.redis.get('search:gen:post')
+        user.like(post)
+        db.session.commit()
+        assert self.app.redis.get('search:gen:post') == generation
+        # the document is not queued for indexing again either
+        assert not self.app.redis.exists('search:pending:post')
+        assert not self.app.task_queue.enqueue.called
+        self.app.config['SEARCH_INDEX_SYNC'] = True
+        user.unlike(post)
+        db.session.commit()
+        assert not self.app.elasticsearch.index.called
+
+    def test_search_cache_disabled(self, user):
+        self.app.config['SEARCH_CACHE_TTL'] = 0
+        self.app.elasticsearch.search.return_value = {
+            'hits': {'total': {'value': 0}, 'hits': []}}
+        Post.search('hello', 1, 10)
+        Post.search('hello', 1, 10)
+        assert self.app.elasticsearch.search.call_count == 2
+        assert self.app.redis.get('search:gen:post') is None
+
+
+    def test_search_after_uses_point_in_time(self, user):
+        posts = [Post(body='hello', author=user) for _ in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        es = self.app.elasticsearch
+        es.search.return_value = {'hits': {'total': {'value': 5}, 'hits': [
+            {'_id': str(post.id)} for post in posts[:2]]}}
+
+        # the first page comes from the cached query, without a point in time
+        found, cursor = Post.search_after('hello', 2)
+        assert found == posts[:2]
+        assert Post.search_after('hello', 2) == (found, cursor)
+        assert es.search.call_count == 1
+        body = es.search.call_args.kwargs['body']
+        assert 'pit' not in body
+        assert body['query']['multi_match']['fields'] == ['body']
+        assert body['sort'][0] == {'_score': 'desc'}
+        es.open_point_in_time.assert_not_called()
+
+        es.open_point_in_time.return_value = {'id': 'pit-1'}
+        es.search.return_value = {'pit_id': 'pit-2', 'hits': {'hits': [
+            {'_id': str(post.id), 'sort': [1.5, post.id]}
+            for post in posts[2:]]}}
+        found, cursor = Post.search_after('hello', 2, cursor)
+        assert found == posts[2:4]
+        body = es.search.call_args.kwargs['body']
+        assert body['pit'] == {'id': 'pit-1', 'keep_alive': '5m'}
+        assert body['from'] == 2
+        assert body['size'] == 3
+        assert 'search_after' not in body
+        es.close_point_in_time.assert_not_called()
+
+        es.search.return_value = {'pit_id': 'pit-2', 'hits': {'hits': [
+            {'_id': str(posts[4].id), 'sort': [1.5, posts[4].id]}]}}
+        found, cursor = Post.search_after('hello', 2, cursor)
+        assert (found, cursor) == ([posts[4]], None)
+        body = es.search.call_args.kwargs['body']
+        assert body['pit']['id'] == 'pit-2'
+        assert body['search_after'] == [1.5, posts[3].id]
+        assert 'from' not in body
+        assert es.open_point_in_time.call_count == 1
+        es.close_point_in_time.assert_called_once_with(body={'id': 'pit-2'})
+
+    def test_search_after_single_page(self, user):
+        post = Post(body='hello', author=user)
+        db.session.add(post)
+        db.session.commit()
+        self.app.elasticsearch.search.return_value = {
+            'hits': {'total': {'value': 1}, 'hits': [{'_id': str(post.id)}]}}
+        assert Post.search_after('hello', 2) == ([post], None)
+        self.app.elasticsearch.open_point_in_time.assert_not_called()
+
+
+class TestReindex:
+    @pytest.fixture(autouse=True)
+    def setup_app(self, mocker):
+        self.app = create_app(TestConfig)
+        cli.register(self.app)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.task_queue = mocker.Mock()
+        self.app.elasticsearch = mocker.Mock()
+        self.app.elasticsearch.bulk.return_value = {'errors': False,
+                                                    'items': []}
+        self.app.elasticsearch.indices.exists_alias.return_value = False
+        self.app.elasticsearch.indices.exists.return_value = True
+        self.app.search_backend = ElasticsearchBackend(self.app.elasticsearch)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user = User(username='john', email='john@example.com')
+        db.session.add_all([Post(body='post %d' % i, author=user)
+                            for i in range(10)])
+        db.session.commit()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _indexed_ids(self):
+        ids = []
+        for call in self.app.elasticsearch.bulk.call_args_list:
+            ids.extend(action['index']['_id']
+                       for action in call.kwargs['body'][::2])
+        return sorted(ids)
+
+    def test_chunks_and_checkpoints(self):
+        checkpoints = []
+        indexed, failed = bulk_reindex(
+            Post, chunk_size=3, workers=2,
+            on_chunk=lambda *args: checkpoints.append(args))
+        assert (indexed, failed) == (10, 0)
+        assert self.app.elasticsearch.bulk.call_count == 4
+        assert self._indexed_ids() == list(range(1, 11))
+        # checkpoints only move forward and end at the last id
+        last_ids = [last_id for last_id, _, _ in checkpoints]
+        assert last_ids == sorted(last_ids)
+        assert checkpoints[-1] == (10, 10, 0)
+
+    def test_failed_chunk_keeps_earlier_checkpoint(self):
+        self.app.elasticsearch.bulk.side_effect = [
+            {'errors': False, 'items': []}, ConnectionError('down')]
+        checkpoints = []
+        with pytest.raises(ConnectionError):
+            bulk_reindex(Post, chunk_size=4, workers=1,
+                         on_chunk=lambda *args: checkpoints.append(args))
+        assert checkpoints == [(4, 4, 0)]
+
+    def test_resume(self, tmp_path):
+        Checkpoint(str(tmp_path / 'reindex-post.json')).save(
+            {'index': 'post', 'alias': None, 'last_id': 6})
+        result = self.app.test_cli_runner().invoke(args=[
+            'search', 'reindex', 'post', '--resume',
+            '--checkpoint-dir', str(tmp_path)])
+        assert result.exit_code == 0, result.output
+        assert self._indexed_ids() == [7, 8, 9, 10]
+        assert not (tmp_path / 'reindex-post.json').exists()
+
+    def test_new_index_swaps_alias(self, tmp_path):
+        result = self.app.test_cli_runner().invoke(args=[
+            'search', 'reindex', 'post', '--new-index', '--chunk-size', '4',
+            '--checkpoint-dir', str(tmp_path)])
+        assert result.exit_code == 0, result.output
+        es = self.app.elasticsearch
+        new_index = es.indices.create.call_args.kwargs['index']
+        assert new_index.startswith('post-')
+        assert {call.kwargs['body'][0]['index']['_index']
+                for call in es.bulk.call_args_list} == {new_index}
+        actions = es.indices.update_aliases.call_args.kwargs['body'][
+            'actions']
+        assert actions == [{'remove_index': {'index': 'post'}},
+                           {'add': {'index': new_index, 'alias': 'post'}}]
+
+    def test_new_index_replays_changes_and_deletes_old_index(self, tmp_path):
+        es = self.app.elasticsearch
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {'post-old': {'aliases': {}}}
+
+        def edit_post(**kwargs):
+            # a change made after its row was read into the new index
+            post = Post.query.get(3)
+            post.body = 'edited'
+            db.session.commit()
+
+        es.indices.put_settings.side_effect = edit_post
+        # only the change made during the rebuild is queued
+        self.app.redis.flushall()
+        result = self.app.test_cli_runner().invoke(args=[
+            'search', 'reindex', 'post', '--new-index', '--chunk-size', '4',
+            '--checkpoint-dir', str(tmp_path)])
+        assert result.exit_code == 0, result.output
+        replayed = es.bulk.call_args.kwargs['body']
+        assert replayed[0] == {'index': {'_index': 'post', '_id': 3}}
+        assert replayed[1]['body'] == 'edited'
+        es.indices.delete.assert_called_once_with(index='post-old')
+        assert not self.app.redis.exists('search:rebuilding:post')
+
+
+class TestEmbeddedSearch:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app.config['SEARCH_INDEX_SYNC'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _search(self, query, page=1, per_page=10):
+        posts, total = Post.search(query, page, per_page)
+        return [post.body for post in posts], total
+
+    def test_used_without_elasticsearch(self):
+        assert isinstance(self.app.search_backend, SQLiteSearchBackend)
+        with pytest.raises(TypeError):
+            SearchBackend()
+
+    def test_incremental_updates(self):
+        post = Post(body='the quick brown fox', author=self.user)
+        db.session.add_all([post, Post(body='a lazy dog', author=self.user)])
+        db.session.commit()
+        assert self._search('fox') == (['the quick brown fox'], 1)
+
+        post.body = 'the quick brown cat'
+        db.session.commit()
+        assert self._search('fox') == ([], 0)
+        assert self._search('cat') == (['the quick brown cat'], 1)
+
+        db.session.delete(post)
+        db.session.commit()
+        assert self._search('cat') == ([], 0)
+
+    def test_ranking_and_paging(self):
+        db.session.add_all([
+            Post(body='fox', author=self.user),
+            Post(body='fox and more fox words fox', author=self.user),
+            Post(body='one fox among many other unrelated words here',
+                 author=self.user),
+            Post(body='no match', author=self.user)])
+        db.session.commit()
+        bodies, total = self._search('fox', per_page=2)
+        assert total == 3
+        assert sorted(bodies) == ['fox', 'fox and more fox words fox']
+        assert self._search('fox', page=2, per_page=2) == (
+            ['one fox among many other unrelated words here'], 3)
+
+    def test_query_syntax_is_not_interpreted(self):
+        db.session.add(Post(body='hello "world"', author=self.user))
+        db.session.commit()
+        assert self._search('world" OR (NEAR') == (['hello "world"'], 1)
+        assert self._search('*:') == ([], 0)
+
+    def test_search_after_pages(self):
+        db.session.add_all([Post(body='fox ' * (i % 4 + 1), author=self.user)
+                            for i in range(7)])
+        db.session.commit()
+        seen, cursor, pages = [], None, 0
+        while True:
+            posts, cursor = Post.search_after('fox', 3, cursor)
+            seen.extend(post.id for post in posts)
+            pages += 1
+            if cursor is None:
+                break
+        assert pages == 3
+        assert sorted(seen) == list(range(1, 8))
+        ranked, _ = Post.search('fox', 1, 7)
+        assert [post.id for post in ranked] == seen
+
+    def test_search_after_invalid_cursor(self):
+        for cursor in ['garbage', 'e30', 'eyJhIjogMX0',
+                       pack_cursor({'o': -1}), pack_cursor({'o': 'x'})]:
+            with pytest.raises(ValueError):
+                Post.search_after('fox', 3, cursor)
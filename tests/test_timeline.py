@@ -0,0 +1,185 @@
+import fakeredis
+import pytest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Post
+from app.timeline import fan_out, followed_posts_cursor, followed_posts_page, \
+    invalidate_timeline, rebuild_timeline, update_celebrity, CELEBRITIES_KEY
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+    TIMELINE_CACHE = True
+    TIMELINE_MAX_LENGTH = 10
+    TIMELINE_FANOUT_LIMIT = 1
+
+
+class TestTimeline:
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @pytest.fixture()
+    def users(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        return u1, u2, u3
+
+    def _post(self, author, seconds):
+        post = Post(body='post from {}'.format(author.username), author=author,
+                    timestamp=datetime.utcnow() + timedelta(seconds=seconds))
+        db.session.add(post)
+        db.session.commit()
+        fan_out(post)
+        return post
+
+    def test_rebuild_on_cache_miss(self, users):
+        u1, u2, _ = users
+        u1.follow(u2)
+        db.session.commit()
+        p1 = self._post(u1, 1)
+        p2 = self._post(u2, 2)
+        assert not self.app.redis.exists('timeline:{}'.format(u1.id))
+
+        posts, has_next = followed_posts_page(u1, 1, 5)
+        assert posts == [p2, p1]
+        assert not has_next
+        assert self.app.redis.zcard('timeline:{}'.format(u1.id)) == 2
+
+    def test_fan_out_to_cached_timelines(self, users):
+        u1, u2, _ = users
+        u1.follow(u2)
+        db.session.commit()
+        assert rebuild_timeline(u1) == []
+        p1 = self._post(u2, 1)
+        p2 = self._post(u2, 2)
+
+        posts, _ = followed_posts_page(u1, 1, 5)
+        assert posts == [p2, p1]
+
+    def test_pagination(self, users):
+        u1 = users[0]
+        posts = [self._post(u1, i) for i in range(5)]
+        page1, has_next = followed_posts_page(u1, 1, 2)
+        assert page1 == [posts[4], posts[3]]
+        assert has_next
+        page3, has_next = followed_posts_page(u1, 3, 2)
+        assert page3 == [posts[0]]
+        assert not has_next
+
+    def test_celebrity_posts_merged_at_read_time(self, users):
+        u1, u2, u3 = users
+        u1.follow(u3)
+        u2.follow(u3)
+        db.session.commit()
+        rebuild_timeline(u1)
+        p1 = self._post(u1, 1)
+        p3 = self._post(u3, 3)
+        assert self.app.redis.sismember(CELEBRITIES_KEY, u3.id)
+        assert not self.app.redis.zscore('timeline:{}'.format(u1.id), p3.id)
+
+        posts, _ = followed_posts_page(u1, 1, 5)
+        assert posts == [p3, p1]
+
+    def test_posts_fanned_out_before_promotion_are_not_repeated(self, users):
+        u1, u2, u3 = users
+        u1.follow(u3)
+        db.session.commit()
+        rebuild_timeline(u1)
+        p1 = self._post(u3, 1)
+        assert self.app.redis.zscore('timeline:{}'.format(u1.id), p1.id)
+        u2.follow(u3)
+        db.session.commit()
+        p2 = self._post(u3, 2)
+        assert self.app.redis.sismember(CELEBRITIES_KEY, u3.id)
+
+        assert followed_posts_page(u1, 1, 5) == ([p2, p1], False)
+        page = followed_posts_cursor(u1, 5)
+        assert (page.items, page.has_next) == ([p2, p1], False)
+
+    def test_celebrity_demoted_when_followers_drop(self, users):
+        u1, u2, u3 = users
+        u1.follow(u3)
+        u2.follow(u3)
+        db.session.commit()
+        p1 = self._post(u3, 1)
+        assert followed_posts_page(u1, 1, 5)[0] == [p1]
+
+        u2.unfollow(u3)
+        db.session.commit()
+        update_celebrity(u3)
+        assert not self.app.redis.sismember(CELEBRITIES_KEY, u3.id)
+        assert not self.app.redis.exists('timeline:{}'.format(u1.id))
+        p2 = self._post(u3, 2)
+        assert followed_posts_page(u1, 1, 5)[0] == [p2, p1]
+
+    def test_invalidate_after_unfollow(self, users):
+        u1, u2, _ = users
+        u1.follow(u2)
+        db.session.commit()
+        p2 = self._post(u2, 2)
+        assert followed_posts_page(u1, 1, 5)[0] == [p2]
+
+        u1.unfollow(u2)
+        db.session.commit()
+        invalidate_timeline(u1)
+        assert followed_posts_page(u1, 1, 5)[0] == []
+
+    def test_sql_fallback_when_redis_is_down(self, users):
+        u1 = users[0]
+        p1 = self._post(u1, 1)
+        self.app.redis = fakeredis.FakeRedis(connected=False)
+        assert followed_posts_page(u1, 1, 5) == ([p1], False)
+
+    def _walk(self, user, per_page):
+        pages, cursor = [], None
+        while True:
+            pagination = followed_posts_cursor(user, per_page, cursor)
+            pages.append(pagination.items)
+            if not pagination.has_next:
+                return pages, pagination
+            cursor = pagination.next_cursor
+
+    def test_cursor_pagination(self, users):
+        u1, u2, u3 = users
+        u1.follow(u2)
+        u1.follow(u3)
+        u2.follow(u3)
+        db.session.commit()
+        rebuild_timeline(u1)
+        posts = [self._post((u1, u2, u3)[i % 3], i) for i in range(7)]
+
+        pages, last = self._walk(u1, 3)
+        assert pages == [posts[6:3:-1], posts[3:0:-1], posts[:1]]
+        previous = followed_posts_cursor(u1, 3, last.prev_cursor)
+        assert previous.items == posts[3:0:-1]
+        assert previous.has_next and previous.has_prev
+
+    def test_cursor_pagination_without_cache(self, users):
+        u1, u2, _ = users
+        u1.follow(u2)
+        db.session.commit()
+        self.app.config['TIMELINE_CACHE'] = False
+        posts = [self._post((u1, u2)[i % 2], i) for i in range(5)]
+
+        pages, _ = self._walk(u1, 2)
+        assert pages == [posts[4:2:-1], posts[2:0:-1], posts[:1]]
+
+    def test_invalid_cursor(self, users):
+        with pytest.raises(ValueError):
+            followed_posts_cursor(users[0], 5, 'garbage')
@@ -0,0 +1,187 @@
+import threading
+import time
+import fakeredis
+import pytest
+from app import create_app, db
+from app.models import User, Post
+from app.translate import translate, translate_batch
+from app.translation_cache import TranslationCache, TranslationError
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
+    MS_TRANSLATOR_KEY = "test-key"
+
+
+class TestTranslationCache:
+    @pytest.fixture(autouse=True)
+    def setup_app(self, mocker):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.translation_cache = TranslationCache(
+            connection=self.app.redis, lock_timeout=2)
+        # the error messages are translated, which needs a request
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        self.post = mocker.patch.object(self.app.http, 'post')
+        self.post.return_value.status_code = 200
+        self.post.return_value.json.return_value = [
+            {'translations': [{'text': 'hola'}]}]
+        yield
+        self.request_context.pop()
+
+    def test_repeated_translations_are_cached(self):
+        assert translate('hello', 'en', 'es') == 'hola'
+        assert translate('hello', 'en', 'es') == 'hola'
+        assert self.post.call_count == 1
+        translate('hello', 'en', 'fr')
+        assert self.post.call_count == 2
+
+    def test_redis_tier_shared_between_workers(self):
+        translate('hello', 'en', 'es')
+        # a new cache stands in for another worker process
+        self.app.translation_cache = TranslationCache(
+            connection=self.app.redis)
+        assert translate('hello', 'en', 'es') == 'hola'
+        assert self.post.call_count == 1
+
+    def test_failures_are_cached_briefly(self):
+        self.post.return_value.status_code = 500
+        for _ in range(3):
+            assert translate('hello', 'en', 'es') == \
+                'Error: the translation service failed.'
+        assert self.post.call_count == 1
+        key = next(iter(self.app.redis.scan_iter('translate:*')))
+        assert 0 < self.app.redis.ttl(key) <= 60
+
+    def test_works_without_redis(self):
+        self.app.translation_cache = TranslationCache(
+            connection=fakeredis.FakeRedis(connected=False))
+        assert translate('hello', 'en', 'es') == 'hola'
+        assert translate('hello', 'en', 'es') == 'hola'
+        assert self.post.call_count == 1
+
+    def test_concurrent_misses_share_one_call(self):
+        cache = self.app.translation_cache
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'hola'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.translate('hello', 'en', 'es', fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == ['hola'] * 5
+        assert len(calls) == 1
+
+    def test_waits_for_another_worker(self):
+        other = TranslationCache(connection=self.app.redis)
+        cache = self.app.translation_cache
+
+        def fetch():
+            time.sleep(0.2)
+            return 'hola'
+
+        thread = threading.Thread(
+            target=lambda: other.translate('hello', 'en', 'es', fetch))
+        thread.start()
+        time.sleep(0.05)
+
+        def fail():
+            raise TranslationError('should not be called')
+
+        assert cache.translate('hello', 'en', 'es', fail) == 'hola'
+        thread.join()
+
+    def test_batch_groups_by_source_language(self, mocker):
+        def fake_post(url, headers, json):
+            response = mocker.Mock(status_code=200)
+            response.json.return_value = [
+                {'translations': [{'text': item['Text'].upper()}]}
+                for item in json]
+            return response
+
+        self.post.side_effect = fake_post
+        translate('cached', 'en', 'es')
+        results = translate_batch([('hello', 'en'), ('bonjour', 'fr'),
+                                   ('cached', 'en'), ('world', 'en'),
+                                   ('hello', 'en')], 'es')
+        assert results == ['HELLO', 'BONJOUR', 'CACHED', 'WORLD', 'HELLO']
+        # one call for the cached text, then one per source language
+        assert self.post.call_count == 3
+        urls = sorted(call.args[0] for call in self.post.call_args_list[1:])
+        assert urls[0].endswith('to=es&from=en')
+        assert urls[1].endswith('to=es&from=fr')
+
+        assert translate_batch([('world', 'en')], 'es') == ['WORLD']
+        assert self.post.call_count == 3
+
+    def test_batch_splits_at_size_limits(self, mocker):
+        mocker.patch('app.translate.MAX_BATCH_ELEMENTS', 3)
+        mocker.patch('app.translate.MAX_BATCH_CHARACTERS', 10)
+        self.post.return_value.status_code = 500
+        texts = [('aaaa', 'en'), ('bbbb', 'en'), ('cccc', 'en'),
+                 ('d', 'en'), ('e', 'en'), ('f', 'en'), ('g', 'en')]
+        results = translate_batch(texts, 'es')
+        assert results == ['Error: the translation service failed.'] * 7
+        sizes = [len(call.kwargs['json'])
+                 for call in self.post.call_args_list]
+        assert sizes == [2, 3, 2]
+
+
+class TestTranslateBatchRoute:
+    @pytest.fixture(autouse=True)
+    def setup_app(self, mocker):
+        self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.translation_cache = TranslationCache(
+            connection=self.app.redis)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        self.post = mocker.patch.object(self.app.http, 'post')
+        self.post.return_value.status_code = 200
+        self.post.return_value.json.return_value = [
+            {'translations': [{'text': 'hola'}]}] * 2
+        yield
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_translate_posts(self):
+        user = User(username='john', email='john@example.com')
+        posts = [Post(body='hi', author=user, language='en'),
+                 Post(body='hey', author=user, language='en')]
+        db.session.add_all(posts)
+        db.session.commit()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+
+        response = self.client.post('/translate/batch', json={
+            'posts': [post.id for post in posts], 'dest_language': 'es'})
+        assert response.status_code == 200
+        assert response.get_json()['posts'] == {
+            str(posts[0].id): 'hola', str(posts[1].id): 'hola'}
+        assert self.post.call_count == 1
+
+        for body in [['hello'], None, 'hello', {'dest_language': 'es',
+                                                 'texts': ['not an object']},
+                     {'dest_language': 'es', 'texts': [{'text': 1}]},
+                     {'dest_language': 'es', 'texts': {'text': 'hello'}},
+                     {'dest_language': 'es', 'posts': [[1]]},
+                     {'dest_language': ['es'], 'texts': []}]:
+            response = self.client.post('/translate/batch', json=body)
+            assert response.status_code == 400
+            assert 'error' in response.get_json()
@@ -1,3 +1,4 @@
+import fakeredis
 import jwt
 import pytest
 from pytest_mock import mocker
@@ -11,12 +12,14 @@ class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite://"
     ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = ":memory:"
 
 
 class TestUserModel:
     @pytest.fixture(autouse=True)
     def setup_app(self):
         self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeRedis()
         self.app_context = self.app.app_context()
         self.app_text_request_context = self.app.test_request_context()
         self.app_context.push()
@@ -236,3 +239,188 @@ class TestUserModel:
 
         assert new_user.liked.count() == user_liked-1
         assert new_post.likes.count() == post_likes-1
+
+    def test_counters(self, new_user):
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add(u2)
+        db.session.commit()
+        new_user.follow(u2)
+        post = Post(body='hi', author=u2)
+        db.session.add(post)
+        db.session.commit()
+        new_user.like(post)
+        db.session.commit()
+        assert (new_user.followed_count, u2.follower_count) == (1, 1)
+        assert (u2.post_count, post.like_count) == (1, 1)
+
+        new_user.unlike(post)
+        new_user.unfollow(u2)
+        db.session.delete(post)
+        db.session.commit()
+        assert (new_user.followed_count, u2.follower_count) == (0, 0)
+        assert (u2.post_count, new_user.post_count) == (0, 0)
+
+    def test_repair_counters(self, new_user):
+        from app.counters import repair_user_counters
+        db.session.add(Post(body='hi', author=new_user))
+        db.session.commit()
+        new_user.post_count = 7
+        new_user.follower_count = 3
+        db.session.commit()
+
+        batches = list(repair_user_counters(batch_size=1))
+        assert batches == [(new_user.id, 1, 1)]
+        assert (new_user.post_count, new_user.follower_count) == (1, 0)
+
+    def test_access_pattern_indexes(self):
+        from app.indexes import check_indexes
+        report = check_indexes(db.engine)
+        assert [query for query, _, _, index in report if index is None] == []
+
+    def test_last_seen_buffered(self, new_user):
+        seen = datetime.utcnow() + timedelta(minutes=5)
+        self.app.last_seen.record(new_user.id, seen)
+        assert new_user.get_last_seen() == seen
+        assert new_user.last_seen != seen
+
+        assert self.app.last_seen.flush() == 1
+        db.session.expire(new_user)
+        assert new_user.last_seen == seen
+        assert self.app.last_seen.flush() == 0
+
+    def test_last_seen_flush_errors_keep_the_buffer(self, new_user, mocker):
+        from sqlalchemy.exc import OperationalError
+        self.app.last_seen.flush_threshold = 1
+        begin = mocker.patch.object(
+            db.engine, 'begin',
+            side_effect=OperationalError('UPDATE', {}, Exception('locked')))
+        seen = datetime.utcnow() + timedelta(minutes=5)
+        self.app.last_seen.record(new_user.id, seen)
+        assert begin.call_count == 1
+        assert self.app.last_seen.get(new_user.id) == seen
+
+        mocker.stopall()
+        runner = self.app.test_cli_runner()
+        from app import cli
+        cli.register(self.app)
+        result = runner.invoke(args=['presence', 'flush'])
+        assert 'Flushed last_seen of 1 users' in result.output
+        assert User.query.get(new_user.id).last_seen == seen
+
+    def test_last_seen_buffered_in_redis(self, new_user):
+        from app.presence import LastSeenBuffer
+        buffer = LastSeenBuffer(flush_interval=60, flush_threshold=2,
+                                connection=fakeredis.FakeRedis())
+        self.app.last_seen = buffer
+        seen = datetime.utcnow() + timedelta(minutes=5)
+        # the first record opens the flush interval and is written at once
+        buffer.record(new_user.id, seen - timedelta(minutes=1))
+        buffer.record(new_user.id, seen)
+        assert new_user.get_last_seen() == seen
+
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add(u2)
+        db.session.commit()
+        buffer.record(u2.id, seen)
+        db.session.expire_all()
+        assert new_user.last_seen == seen
+        assert u2.last_seen == seen
+
+    def test_last_seen_of_a_page_in_one_lookup(self, new_user, mocker):
+        from app.presence import LastSeenBuffer
+        connection = fakeredis.FakeRedis()
+        self.app.last_seen = LastSeenBuffer(connection=connection)
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add(u2)
+        db.session.commit()
+        seen = datetime.utcnow() + timedelta(minutes=5)
+        connection.hset('last_seen', u2.id, seen.isoformat())
+        hget = mocker.spy(connection, 'hget')
+        hmget = mocker.spy(connection, 'hmget')
+        with self.app.test_request_context():
+            items = User.to_dicts([new_user, u2])
+        assert hget.call_count == 0
+        assert hmget.call_count == 1
+        assert items[0]['last_seen'] == new_user.last_seen.isoformat() + 'Z'
+        assert items[1]['last_seen'] == seen.isoformat() + 'Z'
+
+    def _send(self, author, recipient, body):
+        from app.models import Conversation, Message
+        message = Message(author=author, recipient=recipient, body=body)
+        db.session.add(message)
+        Conversation.add_message(message)
+        return message
+
+    def test_unread_message_counter(self, new_user):
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add(u2)
+        self._send(u2, new_user, 'hi')
+        db.session.commit()
+        # counted once in SQL, then kept up to date in Redis
+        assert new_user.new_messages() == 1
+        self._send(u2, new_user, 'again')
+        assert new_user.add_unread_message() == 2
+        # only counted once committed
+        assert self.app.redis.get('unread:{}'.format(new_user.id)) == b'1'
+        db.session.commit()
+        assert self.app.redis.get('unread:{}'.format(new_user.id)) == b'2'
+
+        self._send(u2, new_user, 'lost')
+        new_user.add_unread_message()
+        db.session.rollback()
+        assert new_user.new_messages() == 2
+
+        from app.models import Conversation
+        Conversation.mark_read(new_user, u2)
+        db.session.commit()
+        assert new_user.new_messages() == 0
+        assert new_user.count_new_messages() == 0
+
+    def test_mark_read_takes_the_conversation_off_the_count(self, new_user):
+        from app.models import Conversation
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u2, u3])
+        for author in [u2, u2, u3]:
+            self._send(author, new_user, 'hi')
+            new_user.add_unread_message()
+        db.session.commit()
+        assert new_user.new_messages() == 3
+
+        assert Conversation.mark_read(new_user, u2) == 1
+        db.session.commit()
+        assert new_user.new_messages() == 1
+        assert new_user.count_new_messages() == 1
+        assert Conversation.mark_read(new_user, u2) is None
+
+        # without a counter in Redis the database is counted
+        self.app.redis.delete('unread:{}'.format(new_user.id))
+        assert Conversation.mark_read(new_user, u3) == 0
+        db.session.commit()
+        assert new_user.new_messages() == 0
+
+    def test_unread_message_counter_without_redis(self, new_user, mocker):
+        import redis
+        mocker.patch.object(self.app.redis, 'get',
+                            side_effect=redis.exceptions.ConnectionError())
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add(u2)
+        self._send(u2, new_user, 'hi')
+        db.session.commit()
+        assert new_user.new_messages() == 1
+
+    def test_reconcile_unread_counters(self, new_user):
+        from app.counters import reconcile_unread_counters
+        users = [User(username='user%d' % i) for i in range(3)]
+        db.session.add_all(users)
+        self._send(users[0], new_user, 'hi')
+        db.session.commit()
+        self.app.redis.set('unread:{}'.format(new_user.id), 5)
+        self.app.redis.set('unread:{}'.format(users[0].id), 0)
+        self.app.redis.set('unread:{}'.format(users[1].id), 2)
+
+        batches = list(reconcile_unread_counters(batch_size=2))
+        assert sum(checked for checked, _ in batches) == 3
+        assert sum(repaired for _, repaired in batches) == 2
+        assert new_user.new_messages() == 1
+        assert users[1].new_messages() == 0